@@ -0,0 +1,493 @@
+"""
+Reproducible performance benchmarks.
+
+Usage:
+    python benchmark.py                                   # quick profile
+    python benchmark.py --profile full -o results.json    # 1 KB - 10 GB files
+    python benchmark.py --save-baseline benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json  # exit 1 on regressions
+
+Every case runs in a fresh interpreter so its peak RSS can be measured on
+its own. Input data is synthetic (a random 1 MiB block repeated, which the
+codec selection treats as incompressible) and generated once per run in a
+scratch directory. Results are JSON; compared against a baseline, a metric
+that is worse by more than the tolerance counts as a regression.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from config import *
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+RESULTS_VERSION = 1
+DEFAULT_TOLERANCE = 0.25
+BENCH_PASSWORD = "BenchmarkPassword123"
+MIN_CASE_TIME = 0.5  # Small operations are repeated for at least this long
+MIN_COMPARED_SECONDS = 0.005  # Faster operations are too noisy to flag
+
+KB = 1024
+MB = 1024 * KB
+GB = 1024 * MB
+
+PROFILES = {
+    'smoke': {
+        'file_sizes': [KB, 256 * KB],
+        'batch_counts': [20],
+        'store_size': 256 * KB,
+        'tree': (4, 10),
+        'kdf_rounds': 1
+    },
+    'quick': {
+        'file_sizes': [KB, MB, 64 * MB],
+        'batch_counts': [100, 1000],
+        'store_size': 16 * MB,
+        'tree': (50, 100),
+        'kdf_rounds': 3
+    },
+    'full': {
+        'file_sizes': [KB, MB, 100 * MB, GB, 10 * GB],
+        'batch_counts': [100, 1000, 10000],
+        'store_size': 256 * MB,
+        'tree': (200, 250),
+        'kdf_rounds': 5
+    }
+}
+
+# Metric name suffixes and whether bigger is better
+_HIGHER_IS_BETTER = ('_mbps', '_per_s')
+_LOWER_IS_BETTER = ('_seconds', '_ms', '_rss_mb')
+
+
+def _size_label(size):
+    for unit, factor in (('G', GB), ('M', MB), ('K', KB)):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return str(size)
+
+
+def _make_file(path, size):
+    """Write size bytes of synthetic data (a repeated random block)."""
+    block = os.urandom(min(size, MB))
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining:
+            n = min(remaining, len(block))
+            f.write(block[:n])
+            remaining -= n
+
+
+def _make_tree(root, dirs, files_per_dir, size=4 * KB):
+    """Create dirs directories, nested two levels deep, each holding files_per_dir files."""
+    data = os.urandom(size)
+    for d in range(dirs):
+        directory = os.path.join(root, f"group{d % 10}", f"dir{d}")
+        os.makedirs(directory, exist_ok=True)
+        for i in range(files_per_dir):
+            name = f"file{i}.locked" if i % 10 == 0 else f"file{i}.txt"
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(data)
+
+
+def _timed(func, min_time=MIN_CASE_TIME, max_runs=50):
+    """Median seconds per call of func(), repeating short calls until min_time has passed."""
+    times = []
+    started = time.perf_counter()
+    while not times or (time.perf_counter() - started < min_time and len(times) < max_runs):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (MB if sys.platform == 'darwin' else KB), 1)
+
+
+def _throughput(nbytes, seconds):
+    return round(nbytes / MB / seconds, 2) if seconds > 0 else 0.0
+
+
+# Cases: each runs in its own process and returns a dict of metrics
+
+def case_file(workdir, size):
+    """encrypt_file / decrypt_file round trip of one synthetic file."""
+    from crypto_handler import CryptoHandler
+
+    source = os.path.join(workdir, 'data', f"file_{_size_label(size)}.bin")
+    key = CryptoHandler.generate_key_file(os.path.join(workdir, 'case.key'))
+    encrypted = os.path.join(workdir, 'case.locked')
+    out_dir = os.path.join(workdir, 'case_out')
+
+    def encrypt():
+        CryptoHandler.encrypt_file(source, encrypted, MODE_KEYFILE, key=key)
+
+    def decrypt():
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.makedirs(out_dir)
+        CryptoHandler.decrypt_file(encrypted, out_dir, key=key)
+
+    encrypt_seconds = _timed(encrypt)
+    decrypt_seconds = _timed(decrypt)
+    return {
+        'bytes': size,
+        'encrypt_seconds': encrypt_seconds,
+        'encrypt_mbps': _throughput(size, encrypt_seconds),
+        'decrypt_seconds': decrypt_seconds,
+        'decrypt_mbps': _throughput(size, decrypt_seconds),
+        'overhead_bytes': os.path.getsize(encrypted) - size
+    }
+
+
+def case_batch(workdir, count):
+    """BatchProcessor over count small files, encrypted then decrypted."""
+    from crypto_handler import CryptoHandler
+    from file_manager import BatchProcessor
+
+    directory = os.path.join(workdir, 'batch')
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    data = os.urandom(4 * KB)
+    files = []
+    for i in range(count):
+        path = os.path.join(directory, f"small{i}.txt")
+        with open(path, 'wb') as f:
+            f.write(data)
+        files.append(path)
+
+    key = CryptoHandler.generate_key_file(os.path.join(workdir, 'case.key'))
+    processor = BatchProcessor(max_workers=DEFAULT_MAX_WORKERS)
+
+    started = time.perf_counter()
+    results = processor.batch_encrypt(files, MODE_KEYFILE, key=key, delete_originals=True)
+    encrypt_seconds = time.perf_counter() - started
+    if results['failed']:
+        raise RuntimeError(f"{len(results['failed'])} files failed to encrypt")
+
+    started = time.perf_counter()
+    results = processor.batch_decrypt([path + ENCRYPTED_EXTENSION for path in files], key=key)
+    decrypt_seconds = time.perf_counter() - started
+    if results['failed']:
+        raise RuntimeError(f"{len(results['failed'])} files failed to decrypt")
+
+    return {
+        'files': count,
+        'workers': DEFAULT_MAX_WORKERS,
+        'encrypt_seconds': encrypt_seconds,
+        'encrypt_files_per_s': round(count / encrypt_seconds, 1),
+        'decrypt_seconds': decrypt_seconds,
+        'decrypt_files_per_s': round(count / decrypt_seconds, 1),
+        'per_file_ms': round((encrypt_seconds + decrypt_seconds) / count * 1000, 3)
+    }
+
+
+def case_store(workdir, size):
+    """encrypt_file into a chunk store: into an empty store, again once every chunk exists, and back."""
+    import chunk_store
+    from crypto_handler import CryptoHandler
+
+    source = os.path.join(workdir, 'data', f"store_{_size_label(size)}.bin")
+    key = CryptoHandler.generate_key_file(os.path.join(workdir, 'case.key'))
+    encrypted = os.path.join(workdir, 'case.locked')
+    store_dir = os.path.join(workdir, 'case_store')
+    out_dir = os.path.join(workdir, 'case_out')
+    shutil.rmtree(store_dir, ignore_errors=True)
+    store = chunk_store.ChunkStore(store_dir)
+
+    def encrypt():
+        return CryptoHandler.encrypt_file(source, encrypted, MODE_KEYFILE, key=key, chunk_store=store)
+
+    def decrypt():
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.makedirs(out_dir)
+        CryptoHandler.decrypt_file(encrypted, out_dir, key=key, chunk_store=store)
+
+    # Only the first run finds the store empty
+    started = time.perf_counter()
+    encrypt()
+    new_seconds = time.perf_counter() - started
+    dedup_seconds = _timed(encrypt)
+    decrypt_seconds = _timed(decrypt)
+    stored = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(store_dir) for f in files)
+    return {
+        'bytes': size,
+        'chunker': 'numpy' if chunk_store.numpy is not None else 'python',
+        'store_new_seconds': new_seconds,
+        'store_new_mbps': _throughput(size, new_seconds),
+        'store_dedup_seconds': dedup_seconds,
+        'store_dedup_mbps': _throughput(size, dedup_seconds),
+        'store_decrypt_seconds': decrypt_seconds,
+        'store_decrypt_mbps': _throughput(size, decrypt_seconds),
+        'stored_bytes': stored
+    }
+
+
+def case_search(workdir):
+    """search_files over the generated tree, all files and .locked only."""
+    from file_manager import FileManager
+
+    root = os.path.join(workdir, 'tree')
+    found = []
+
+    def search_all():
+        found[:] = FileManager.search_files(root)
+
+    search_seconds = _timed(search_all)
+    locked_seconds = _timed(lambda: FileManager.search_files(root, only_locked=True))
+    return {
+        'files': len(found),
+        'search_seconds': search_seconds,
+        'search_files_per_s': round(len(found) / search_seconds, 1),
+        'search_locked_seconds': locked_seconds
+    }
+
+
+def case_compress(workdir):
+    """compress_folder of the generated tree into a ZIP."""
+    from file_manager import FileManager
+
+    root = os.path.join(workdir, 'tree')
+    output = os.path.join(workdir, 'tree.zip')
+    size = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+    seconds = _timed(lambda: FileManager.compress_folder(root, output))
+    return {
+        'bytes': size,
+        'compress_seconds': seconds,
+        'compress_mbps': _throughput(size, seconds)
+    }
+
+
+def case_kdf(workdir, rounds):
+    """PBKDF2 key derivation latency."""
+    from crypto_handler import CryptoHandler
+
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        CryptoHandler.derive_key_from_password(BENCH_PASSWORD)
+        times.append(time.perf_counter() - started)
+    return {
+        'iterations': PBKDF2_ITERATIONS,
+        'kdf_ms': round(statistics.median(times) * 1000, 2)
+    }
+
+
+CASES = {
+    'file': case_file,
+    'batch': case_batch,
+    'store': case_store,
+    'search': case_search,
+    'compress': case_compress,
+    'kdf': case_kdf
+}
+
+
+def plan(profile):
+    """List of (case name, case function name, args) for a profile."""
+    settings = PROFILES[profile]
+    cases = [(f"file_{_size_label(size)}", 'file', [size]) for size in settings['file_sizes']]
+    cases += [(f"batch_{count}", 'batch', [count]) for count in settings['batch_counts']]
+    cases.append((f"store_{_size_label(settings['store_size'])}", 'store', [settings['store_size']]))
+    cases += [('search_tree', 'search', []), ('compress_tree', 'compress', [])]
+    cases.append(('kdf_pbkdf2', 'kdf', [settings['kdf_rounds']]))
+    return cases
+
+
+def prepare(workdir, profile):
+    """Generate the shared input data for a profile."""
+    settings = PROFILES[profile]
+    data_dir = os.path.join(workdir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    for size in settings['file_sizes']:
+        _make_file(os.path.join(data_dir, f"file_{_size_label(size)}.bin"), size)
+    size = settings['store_size']
+    _make_file(os.path.join(data_dir, f"store_{_size_label(size)}.bin"), size)
+    _make_tree(os.path.join(workdir, 'tree'), *settings['tree'])
+
+
+def run_case(workdir, func_name, args):
+    """Run one case in a fresh interpreter and return its metrics."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-case', func_name, json.dumps(args),
+         '--workdir', workdir],
+        capture_output=True, text=True, cwd=here
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else
+                           f"case exited with status {completed.returncode}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run_suite(profile='quick', only=None, workdir=None, log=print):
+    """
+    Run every case of a profile.
+
+    Args:
+        profile: Key of PROFILES
+        only: Optional list of case names (or prefixes such as 'file') to run
+        workdir: Scratch directory; a temporary one is created and removed if None
+        log: Called with one line of text per finished case
+
+    Returns:
+        Results document (see --help)
+    """
+    own_workdir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='flck_bench_')
+    cases = [case for case in plan(profile)
+             if not only or any(case[0] == name or case[0].startswith(name + '_') for name in only)]
+    results = {}
+    try:
+        prepare(workdir, profile)
+        for name, func_name, args in cases:
+            try:
+                results[name] = run_case(workdir, func_name, args)
+            except Exception as e:
+                results[name] = {'error': str(e)}
+            log(format_case(name, results[name]))
+    finally:
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'version': RESULTS_VERSION,
+        'app_version': APP_VERSION,
+        'profile': profile,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results
+    }
+
+
+def format_case(name, metrics):
+    if 'error' in metrics:
+        return f"{name:<16} ERROR {metrics['error']}"
+    shown = ', '.join(
+        f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}"
+        for key, value in metrics.items()
+    )
+    return f"{name:<16} {shown}"
+
+
+def _direction(metric):
+    """+1 if bigger is better, -1 if smaller is better, 0 if the metric is not compared."""
+    if metric.endswith(_HIGHER_IS_BETTER):
+        return 1
+    if metric.endswith(_LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def _seconds_of(metrics, metric):
+    """Baseline duration behind a timing or throughput metric, e.g. encrypt_mbps -> encrypt_seconds."""
+    for suffix in ('_files_per_s', '_mbps', '_seconds'):
+        if metric.endswith(suffix):
+            return metrics.get(metric[:-len(suffix)] + '_seconds')
+    return None
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare a results document against a baseline document.
+
+    Cases or metrics missing on either side are ignored, as are metrics with
+    no direction (byte counts and the like) and timings of operations that
+    took less than MIN_COMPARED_SECONDS in the baseline.
+
+    Returns:
+        List of (case, metric, baseline value, new value, relative change)
+        for every metric that got worse by more than tolerance; a case that
+        errored now but not in the baseline is reported with metric 'error'
+    """
+    regressions = []
+    for name, old in baseline.get('results', {}).items():
+        new = results.get('results', {}).get(name)
+        if new is None or 'error' in old:
+            continue
+        if 'error' in new:
+            regressions.append((name, 'error', None, new['error'], None))
+            continue
+        for metric, old_value in old.items():
+            direction = _direction(metric)
+            new_value = new.get(metric)
+            if not direction or not old_value or new_value is None:
+                continue
+            seconds = _seconds_of(old, metric)
+            if seconds is not None and seconds < MIN_COMPARED_SECONDS:
+                continue
+            change = (new_value - old_value) / old_value
+            if -direction * change > tolerance:
+                regressions.append((name, metric, old_value, new_value, change))
+    return regressions
+
+
+def _run_case_main(func_name, args, workdir):
+    metrics = CASES[func_name](workdir, *args)
+    metrics['peak_rss_mb'] = _peak_rss_mb()
+    print(json.dumps(metrics))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=f"{APP_NAME} benchmarks")
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='quick')
+    parser.add_argument('--only', nargs='+', metavar='CASE',
+                        help="run only these cases or case groups, e.g. 'file' or 'batch_1000'")
+    parser.add_argument('-o', '--output', metavar='PATH', help='write the results as JSON')
+    parser.add_argument('--baseline', metavar='PATH', help='compare against this results file')
+    parser.add_argument('--save-baseline', metavar='PATH', help='also write the results as a new baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed relative slowdown before failing (default: %(default)s)')
+    parser.add_argument('--workdir', metavar='DIR', help='scratch directory (needs room for the largest file)')
+    parser.add_argument('--run-case', nargs=2, metavar=('CASE', 'ARGS'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_case:
+        return _run_case_main(args.run_case[0], json.loads(args.run_case[1]), args.workdir)
+
+    results = run_suite(args.profile, only=args.only, workdir=args.workdir)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+
+    status = 1 if any('error' in metrics for metrics in results['results'].values()) else 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('profile') != results['profile']:
+            print(f"warning: baseline profile {baseline.get('profile')!r} differs from {results['profile']!r}")
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, old, new, change in regressions:
+            if metric == 'error':
+                print(f"REGRESSION {name}: now fails ({new})")
+            else:
+                print(f"REGRESSION {name}.{metric}: {old:.4g} -> {new:.4g} ({change:+.0%})")
+        if regressions:
+            status = 1
+        else:
+            print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
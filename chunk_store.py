@@ -0,0 +1,401 @@
+"""
+Deduplicating chunk store for encrypted backups.
+
+Plaintext is split with content-defined chunking, so an insertion or
+deletion only changes the chunks around it, and every distinct chunk is
+stored once in a content-addressed directory. The chunker uses numpy when
+it is installed and big-integer arithmetic otherwise. Chunks are sealed with
+convergent keys: the key is derived from the chunk's SHA-256 and the
+store key, so identical chunks encrypted with the same store key give
+identical blobs and are written only once. The .locked file is then a
+small recipe listing the chunks in order.
+"""
+
+import base64
+import hashlib
+import hmac
+import io
+import json
+import os
+import struct
+import tempfile
+import time
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+from config import *
+from compression import get_codec
+from durability import group_fsync, remove_temp, sync_directories
+from metrics import timed_stage
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+_RECIPE_ENTRY = struct.Struct('>32sI')  # chunk SHA-256, plaintext length
+_ZERO_NONCE = bytes(AEAD_NONCE_SIZE)  # Every chunk key seals exactly one plaintext
+
+# Gear table for the rolling hash: fixed, so chunk boundaries are stable across runs
+_GEAR = tuple(
+    int.from_bytes(hashlib.sha256(b'FLCK gear %d' % i).digest()[:4], 'big')
+    for i in range(256)
+)
+# Byte k of every gear value, as translate() tables
+_GEAR_BYTES = tuple(bytes(gear >> (8 * k) & 0xFF for gear in _GEAR) for k in range(4))
+_GEAR_ARRAY = numpy.array(_GEAR, dtype=numpy.uint32) if numpy is not None else None
+_SCAN_BLOCK = 16 * 1024  # Bytes hashed at a time while looking for a boundary
+
+
+def _find_boundary(data, start, mask):
+    """
+    Index of the first byte at or after start after which the gear hash of
+    data has no bit of mask set, or -1.
+
+    The hash is h = (h << 1) + gear[byte] on 32 bits, starting from 0 at
+    data[0]. Only the last 32 bytes survive the shifts, so the hash after
+    byte i is the sum of gear[data[i - k]] << k for k < 32; it is computed
+    for every position at once by doubling that window from 1 to 32 bytes.
+    """
+    if _GEAR_ARRAY is not None:
+        h = _GEAR_ARRAY[numpy.frombuffer(data, dtype=numpy.uint8)]
+        for window in (1, 2, 4, 8, 16):
+            h[window:] += h[:-window] << window
+        hits = numpy.flatnonzero((h[start:] & mask) == 0)
+        return start + int(hits[0]) if len(hits) else -1
+
+    # Without numpy, one big integer holds the hash of every position in its
+    # own 64-bit slot, wide enough that a slot never carries into the next
+    n = len(data)
+    spread = bytearray(8 * n)
+    for k in range(4):
+        spread[k::8] = data.translate(_GEAR_BYTES[k])
+    h = int.from_bytes(spread, 'little')
+    for window in (1, 2, 4, 8, 16):
+        h += h << (65 * window)
+    hashes = h.to_bytes(8 * (n + 32), 'little')
+
+    # The mask always includes the top bit, so only slots whose top byte passes need a full check
+    top_fails = bytes(1 if (value << 24) & mask else 0 for value in range(256))
+    tops = hashes[3:8 * n:8].translate(top_fails)
+    i = tops.find(0, start)
+    while i != -1:
+        if not int.from_bytes(hashes[8 * i:8 * i + 4], 'little') & mask:
+            return i
+        i = tops.find(0, i + 1)
+    return -1
+
+
+def _scan_boundary(data, first, lo, hi, mask):
+    """
+    Position just after the first boundary in data[lo:hi] for a gear hash
+    started at data[first], or None.
+
+    Blocks are hashed one at a time, each starting up to 31 bytes early so
+    that its first hashes cover complete windows.
+    """
+    for block in range(lo, hi, _SCAN_BLOCK):
+        begin = max(first, block - 31)
+        i = _find_boundary(data[begin:min(hi, block + _SCAN_BLOCK)], block - begin, mask)
+        if i >= 0:
+            return begin + i + 1
+    return None
+
+
+def _cut_point(data, min_size, avg_size, max_size):
+    """
+    Length of the next chunk at the start of data (FastCDC-style gear hash).
+
+    A stricter mask is used before avg_size and a looser one after it, which
+    keeps chunk sizes close to avg_size. The mask selects high bits of the
+    hash, so a boundary depends on the last 32 bytes.
+    """
+    length = len(data)
+    if length <= min_size:
+        return length
+    end = min(length, max_size)
+    normal = min(end, avg_size)
+
+    bits = avg_size.bit_length() - 1
+    mask_strict = ((1 << (bits + 1)) - 1) << (31 - bits)
+    mask_loose = ((1 << (bits - 1)) - 1) << (33 - bits)
+
+    # Hashing starts at min_size and runs on past normal, where the looser mask takes over
+    first = min(min_size, normal)
+    cut = _scan_boundary(data, first, min_size, normal, mask_strict)
+    if cut is None:
+        cut = _scan_boundary(data, first, normal, end, mask_loose)
+    return end if cut is None else cut
+
+
+def cdc_chunks(reader, min_size=CDC_MIN_SIZE, avg_size=CDC_AVG_SIZE, max_size=CDC_MAX_SIZE):
+    """
+    Split a readable binary stream into content-defined chunks.
+
+    Yields:
+        bytes objects between min_size and max_size long (the last may be shorter)
+    """
+    buf = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buf) < max_size:
+            block = reader.read(max(max_size, CHUNK_SIZE))
+            if not block:
+                eof = True
+            buf += block
+        if not buf:
+            return
+        cut = _cut_point(buf, min_size, avg_size, max_size)
+        yield bytes(buf[:cut])
+        del buf[:cut]
+
+
+class ChunkStore:
+    """
+    Content-addressed directory of convergently encrypted chunks.
+
+    Layout: store.json (store id and password salt) and one file per chunk
+    under objects/, named by an HMAC of the chunk hash so names reveal
+    nothing without the store key. A blob is [CODEC:1][CIPHERTEXT][TAG:16]
+    with the name and codec authenticated. Blobs are written to a temporary
+    file and renamed into place, so concurrent writers are safe. A blob
+    that is already present is only reused if it authenticates, so one a
+    crash left truncated is written again.
+
+    Chunks are never deleted; removing .locked files does not free space.
+    """
+
+    def __init__(self, root=CHUNK_STORE_PATH, create=True, fsync=False):
+        """
+        Open (or create) a store.
+
+        Args:
+            root: Store directory
+            create: Create the store if it does not exist yet
+            fsync: Flush new chunks to disk before write_recipe returns, so
+                recipes written afterwards never refer to chunks a crash
+                could lose. The chunks of one recipe are synced together in
+                one pass (see durability.group_fsync) and only renamed into
+                place once their data is on disk
+        """
+        self.root = os.path.abspath(root)
+        self.fsync = fsync
+        self._unsynced = {}  # blob path -> temporary file awaiting sync()
+        self._objects = os.path.join(self.root, 'objects')
+        meta_path = os.path.join(self.root, 'store.json')
+
+        if not os.path.exists(meta_path):
+            if not create:
+                raise FileNotFoundError(f"Chunk store not found: {self.root}")
+            self._create(meta_path)
+
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != CHUNK_STORE_VERSION:
+            raise ValueError(f"Unsupported chunk store version: {meta.get('version')}")
+        self.store_id = bytes.fromhex(meta['id'])
+        self.salt = bytes.fromhex(meta['salt'])
+
+    def _create(self, meta_path):
+        os.makedirs(self._objects, exist_ok=True)
+        meta = json.dumps({
+            'version': CHUNK_STORE_VERSION,
+            'id': os.urandom(CHUNK_STORE_ID_SIZE).hex(),
+            'salt': os.urandom(SALT_SIZE).hex()
+        })
+        try:
+            with open(meta_path, 'x', encoding='utf-8') as f:
+                f.write(meta)
+        except FileExistsError:
+            pass
+
+    @staticmethod
+    def _derive(store_key, label, digest):
+        return hmac.new(base64.urlsafe_b64decode(store_key), label + digest, hashlib.sha256).digest()
+
+    def _blob_path(self, name):
+        name = name.hex()
+        return os.path.join(self._objects, name[:2], name[2:])
+
+    def put(self, store_key, data, codec=None):
+        """
+        Store one chunk unless an identical one is already present.
+
+        Args:
+            store_key: Store key (see CryptoHandler); chunks only deduplicate
+                against chunks written with the same key
+            data: Chunk plaintext
+            codec: Optional codec object from compression.get_codec; the chunk
+                is kept uncompressed if compression does not shrink it
+
+        Returns:
+            (SHA-256 digest of data, bytes written; 0 if the chunk existed)
+        """
+        digest = hashlib.sha256(data).digest()
+        name = self._derive(store_key, b'FLCK chunk id', digest)
+        path = self._blob_path(name)
+        aead = AESGCM(self._derive(store_key, b'FLCK chunk key', digest))
+        if path in self._unsynced or self._is_intact(path, name, aead):
+            return digest, 0
+
+        codec_id = CODEC_NONE
+        if codec is not None:
+            compressed = codec.compress(data)
+            if len(compressed) < len(data):
+                data = compressed
+                codec_id = codec.codec_id
+
+        blob = bytes([codec_id]) + aead.encrypt(_ZERO_NONCE, data, name + bytes([codec_id]))
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=TEMP_FILE_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blob)
+            if self.fsync:
+                # Renamed into place by sync(), so the final name never holds unsynced data
+                self._unsynced[path] = temp_path
+            else:
+                os.replace(temp_path, path)
+        except Exception:
+            remove_temp(temp_path)
+            raise
+        return digest, len(blob)
+
+    @staticmethod
+    def _is_intact(path, name, aead):
+        """Whether path holds a complete, authentic blob for the chunk named name."""
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+        except FileNotFoundError:
+            return False
+        try:
+            aead.decrypt(_ZERO_NONCE, blob[1:], name + blob[:1])
+        except InvalidTag:
+            return False
+        return True
+
+    def sync(self):
+        """
+        Flush every chunk written since the last sync to disk, rename them
+        into place and sync their directories.
+        """
+        pending, self._unsynced = self._unsynced, {}
+        try:
+            group_fsync(pending.values(), directories=False)
+            for path, temp_path in pending.items():
+                os.replace(temp_path, path)
+        except BaseException:
+            for temp_path in pending.values():
+                remove_temp(temp_path)
+            raise
+        sync_directories(pending)
+
+    def _discard(self):
+        """Delete the chunks written since the last sync without storing them."""
+        pending, self._unsynced = self._unsynced, {}
+        for temp_path in pending.values():
+            remove_temp(temp_path)
+
+    def write_recipe(self, reader, writer, store_key, codec=None, metrics=None, progress=None):
+        """
+        Chunk everything from reader into the store and write its recipe to writer.
+
+        With metrics, storing each chunk (hashing, compression, sealing and
+        writing new blobs) is timed into the cipher stage. progress, if given,
+        is called with the length of every stored chunk. With fsync, the new
+        chunks are synced before this returns.
+
+        Returns:
+            Dictionary with bytes_in, chunks, new_chunks and bytes_stored
+        """
+        stats = {'bytes_in': 0, 'chunks': 0, 'new_chunks': 0, 'bytes_stored': 0}
+        try:
+            for chunk in cdc_chunks(reader):
+                started = time.perf_counter()
+                digest, stored = self.put(store_key, chunk, codec)
+                if metrics is not None:
+                    metrics.add(STAGE_CIPHER, time.perf_counter() - started, len(chunk))
+                if progress is not None:
+                    progress(len(chunk))
+                writer.write(_RECIPE_ENTRY.pack(digest, len(chunk)))
+                stats['bytes_in'] += len(chunk)
+                stats['chunks'] += 1
+                if stored:
+                    stats['new_chunks'] += 1
+                    stats['bytes_stored'] += stored
+        except BaseException:
+            self._discard()
+            raise
+        if self.fsync:
+            with timed_stage(metrics, STAGE_WRITE):
+                self.sync()
+        return stats
+
+    def get(self, store_key, digest, size):
+        """Read and decrypt the chunk with the given SHA-256 digest and plaintext size."""
+        name = self._derive(store_key, b'FLCK chunk id', digest)
+        try:
+            with open(self._blob_path(name), 'rb') as f:
+                blob = f.read()
+        except FileNotFoundError:
+            raise ValueError(f"Chunk missing from store {self.root}")
+        if not blob:
+            raise ValueError(MSG_CORRUPTED_FILE)
+
+        aead = AESGCM(self._derive(store_key, b'FLCK chunk key', digest))
+        try:
+            data = aead.decrypt(_ZERO_NONCE, blob[1:], name + blob[:1])
+        except InvalidTag:
+            raise ValueError("Decryption failed: Invalid key or corrupted data")
+
+        codec = get_codec(blob[0])
+        if codec is not None:
+            data = codec.decompress(data, size)
+        if len(data) != size or hashlib.sha256(data).digest() != digest:
+            raise ValueError(MSG_CORRUPTED_FILE)
+        return data
+
+
+class ChunkStoreReader(io.RawIOBase):
+    """Plaintext of a recipe file: reads recipe entries and fetches their chunks from a store."""
+
+    def __init__(self, recipe, store, store_key, metrics=None):
+        super().__init__()
+        self._metrics = metrics
+        self.header = recipe.header
+        # Recipe entries straddle cipher chunks; buffering turns short reads into whole entries
+        self._recipe = io.BufferedReader(recipe, CHUNK_SIZE)
+        self._store = store
+        self._store_key = store_key
+        self._buffer = b''
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._pos >= len(self._buffer):
+            entry = self._recipe.read(RECIPE_ENTRY_SIZE)
+            if not entry:
+                return 0
+            if len(entry) != RECIPE_ENTRY_SIZE:
+                raise ValueError(MSG_CORRUPTED_FILE)
+            digest, size = _RECIPE_ENTRY.unpack(entry)
+            started = time.perf_counter()
+            self._buffer = self._store.get(self._store_key, digest, size)
+            if self._metrics is not None:
+                self._metrics.add(STAGE_CIPHER, time.perf_counter() - started, size)
+            self._pos = 0
+
+        n = min(len(b), len(self._buffer) - self._pos)
+        b[:n] = self._buffer[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._recipe.close()
+        super().close()
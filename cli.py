@@ -0,0 +1,380 @@
+"""
+Headless command-line interface for servers and scripts.
+
+Usage:
+    python -m cli encrypt FILE... (--password-stdin | --password-fd N | --key-file KEY)
+    python -m cli decrypt FILE... (--password-stdin | --password-fd N | --key-file KEY)
+    python -m cli inspect FILE...
+    python -m cli search DIRECTORY [--pattern '*.txt'] [--locked]
+    python -m cli list FOLDER.locked (--password-stdin | --password-fd N | --key-file KEY)
+    python -m cli extract FOLDER.locked MEMBER [-o DIR] (--password-stdin | ...)
+
+Passing '-' as the only path encrypts or decrypts stdin to stdout, e.g.
+    pg_dump db | python -m cli encrypt - --key-file backup.key | upload
+
+Progress and results are written to stdout as JSON lines (stderr when
+stdout carries data). This module does not import tkinter, and the crypto
+modules are only loaded once a command runs.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from config import *
+
+
+_SIZE_SUFFIXES = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+_CODECS = {
+    'auto': CODEC_AUTO,
+    'none': CODEC_NONE,
+    'deflate': CODEC_DEFLATE,
+    'zstd': CODEC_ZSTD,
+    'lz4': CODEC_LZ4
+}
+
+
+def _emit(event, out=None, **fields):
+    """Write one JSON event line to out (stdout by default)."""
+    out = out or sys.stdout
+    fields['event'] = event
+    out.write(json.dumps(fields, default=str) + '\n')
+    out.flush()
+
+
+def _parse_size(value):
+    """Parse a byte count such as 65536, 512K or 4M."""
+    value = value.strip().upper().rstrip('B')
+    multiplier = _SIZE_SUFFIXES.get(value[-1:], 1)
+    if value[-1:] in _SIZE_SUFFIXES:
+        value = value[:-1]
+    try:
+        size = int(value) * multiplier
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {value!r}")
+    if not 0 < size <= MAX_CHUNK_SIZE:
+        raise argparse.ArgumentTypeError(f"chunk size must be between 1 and {MAX_CHUNK_SIZE} bytes")
+    return size
+
+
+def _read_password(args):
+    """Read the password from stdin or an inherited file descriptor (never argv)."""
+    if args.password_stdin:
+        line = sys.stdin.readline()
+    else:
+        with os.fdopen(args.password_fd, 'r', closefd=False) as f:
+            line = f.readline()
+    password = line.rstrip('\r\n')
+    if not password:
+        raise ValueError("Empty password")
+    return password
+
+
+def _is_pipe(args):
+    return getattr(args, 'paths', None) == ['-']
+
+
+def _credentials(args):
+    """Resolve (mode, password, key) from the authentication flags."""
+    if _is_pipe(args) and args.password_stdin:
+        raise ValueError("stdin carries the data; use --password-fd or --key-file")
+    if args.key_file:
+        from crypto_handler import CryptoHandler
+        return MODE_KEYFILE, None, CryptoHandler.load_key_file(args.key_file)
+    return MODE_PASSWORD, _read_password(args), None
+
+
+def _open_store(path):
+    if path is None:
+        return None
+    from chunk_store import ChunkStore
+    return ChunkStore(path, create=False)
+
+
+def _batch_processor(args):
+    from file_manager import BatchProcessor
+
+    def progress(info):
+        _emit(
+            'progress', current=info['files_done'], total=info['files_total'], message=info['message'],
+            bytes_done=info['bytes_done'], bytes_total=info['bytes_total'],
+            rate=round(info['rate']) if info['rate'] is not None else None,
+            eta=round(info['eta'], 1) if info['eta'] is not None else None
+        )
+
+    return BatchProcessor(
+        byte_progress_callback=None if args.quiet else progress,
+        max_workers=args.workers,
+        executor=args.executor,
+        metrics=_metrics(args),
+        journal=_journal(args),
+        durability=args.durability
+    )
+
+
+def _journal(args):
+    if args.journal is None:
+        return None
+    from job_journal import JobJournal
+    return JobJournal(args.journal)
+
+
+def _metrics(args):
+    """Metrics collector for the --metrics/--metrics-jsonl/--prometheus flags, or None."""
+    if not (args.metrics or args.metrics_jsonl or args.prometheus):
+        return None
+    from metrics import Metrics
+
+    def on_event(fields):
+        # The summary goes into the result event instead
+        if args.metrics and fields['event'] == 'file':
+            _emit(**fields)
+
+    return Metrics(callback=on_event, jsonl_path=args.metrics_jsonl, prometheus_path=args.prometheus)
+
+
+def _report(results, started):
+    """Emit the batch result and return the exit status."""
+    fields = {}
+    for name in ('metrics', 'resumed'):
+        if name in results:
+            fields[name] = results[name]
+    _emit(
+        'result',
+        success=results['success'],
+        failed=[{'path': path, 'error': error} for path, error in results['failed']],
+        seconds=round(time.perf_counter() - started, 3),
+        **fields
+    )
+    return 1 if results['failed'] else 0
+
+
+def _report_stream(result):
+    """Emit the result of a stdin/stdout run on stderr."""
+    _emit('result', out=sys.stderr, **result)
+    return 0
+
+
+def cmd_encrypt(args):
+    mode, password, key = _credentials(args)
+    if _is_pipe(args):
+        if args.store:
+            raise ValueError("--store needs file paths, not '-'")
+        from crypto_handler import CryptoHandler
+        return _report_stream(CryptoHandler.encrypt_stream(
+            sys.stdin.buffer, sys.stdout.buffer, mode, password=password, key=key,
+            original_filename=args.name, codec=_CODECS[args.codec],
+            workers=args.workers, chunk_size=args.chunk_size
+        ))
+
+    started = time.perf_counter()
+    results = _batch_processor(args).batch_encrypt(
+        args.paths,
+        mode,
+        password=password,
+        key=key,
+        delete_originals=args.delete,
+        session_key=args.session_key,
+        codec=_CODECS[args.codec],
+        chunk_size=args.chunk_size,
+        incremental=args.incremental,
+        chunk_store=args.store
+    )
+    return _report(results, started)
+
+
+def cmd_decrypt(args):
+    mode, password, key = _credentials(args)
+    if _is_pipe(args):
+        from crypto_handler import CryptoHandler
+        return _report_stream(CryptoHandler.decrypt_stream(
+            sys.stdin.buffer, sys.stdout.buffer, password=password, key=key, workers=args.workers,
+            chunk_store=_open_store(args.store)
+        ))
+
+    started = time.perf_counter()
+    results = _batch_processor(args).batch_decrypt(
+        args.paths,
+        password=password,
+        key=key,
+        delete_encrypted=args.delete,
+        chunk_store=args.store
+    )
+    return _report(results, started)
+
+
+def cmd_inspect(args):
+    from crypto_handler import CryptoHandler
+
+    status = 0
+    for result in CryptoHandler.inspect(args.paths, max_workers=args.workers):
+        if 'error' in result:
+            _emit('inspect', path=result['path'], error=result['error'])
+            status = 1
+            continue
+        metadata = result['metadata']
+        _emit(
+            'inspect',
+            path=result['path'],
+            version=metadata['version'],
+            mode='password' if metadata['mode'] == MODE_PASSWORD else 'keyfile',
+            cipher=metadata['cipher'],
+            codec=CODEC_NAMES.get(metadata['codec'], metadata['codec']),
+            payload_type=metadata['payload_type'],
+            original_filename=metadata['original_filename'],
+            chunk_size=metadata['chunk_size'],
+            random_access=EXT_CHUNK_INDEX in metadata['extensions'] and EXT_CHUNK_STORE not in metadata['extensions'],
+            chunk_store=metadata['extensions'].get(EXT_CHUNK_STORE, b'').hex() or None,
+            file_size=metadata['file_size']
+        )
+    return status
+
+
+def cmd_search(args):
+    from file_manager import FileManager
+
+    index = None
+    if args.index:
+        from file_index import FileIndex
+        index = FileIndex(args.index_path)
+
+    started = time.perf_counter()
+    found = 0
+    try:
+        for path in FileManager.iter_search(
+            args.directory,
+            pattern=args.pattern,
+            recursive=not args.no_recursive,
+            only_locked=args.locked,
+            extension_filter=args.extension,
+            index=index,
+            workers=args.workers
+        ):
+            _emit('match', path=path)
+            found += 1
+    finally:
+        if index is not None:
+            index.close()
+
+    _emit('result', found=found, seconds=round(time.perf_counter() - started, 3))
+    return 0
+
+
+def cmd_list(args):
+    from file_manager import FileManager
+
+    _, password, key = _credentials(args)
+    for member in FileManager.list_archive(args.archive, password=password, key=key):
+        _emit('member', **member)
+    return 0
+
+
+def cmd_extract(args):
+    from file_manager import FileManager
+
+    _, password, key = _credentials(args)
+    path = FileManager.extract_member(args.archive, args.member, args.output_dir, password=password, key=key)
+    _emit('result', member=args.member, output_path=path)
+    return 0
+
+
+def _add_auth_arguments(parser):
+    auth = parser.add_mutually_exclusive_group(required=True)
+    auth.add_argument('--password-stdin', action='store_true',
+                      help='read the password from the first line of stdin')
+    auth.add_argument('--password-fd', type=int, metavar='FD',
+                      help='read the password from an inherited file descriptor')
+    auth.add_argument('--key-file', metavar='PATH', help='use a key file instead of a password')
+
+
+def _add_batch_arguments(parser):
+    parser.add_argument('paths', nargs='+', metavar='PATH')
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS,
+                        help='files processed concurrently (default: %(default)s)')
+    parser.add_argument('--executor', choices=[EXECUTOR_AUTO, EXECUTOR_PROCESS, EXECUTOR_THREAD],
+                        default=EXECUTOR_AUTO)
+    parser.add_argument('--delete', action='store_true', help='delete inputs after success')
+    parser.add_argument('--quiet', action='store_true', help='only print the final result')
+    parser.add_argument('--journal', nargs='?', const=JOURNAL_DB_PATH, metavar='DB',
+                        help='record per-file progress so a rerun after a crash resumes (default: %(const)s)')
+    parser.add_argument('--durability', choices=[DURABILITY_FILE, DURABILITY_BATCH, DURABILITY_NONE],
+                        default=DEFAULT_DURABILITY,
+                        help='fsync each output, finished outputs together in groups, or only '
+                             'before --delete removes an input (default: %(default)s)')
+    parser.add_argument('--metrics', action='store_true',
+                        help="print per-file stage timings and add a metrics summary to the result")
+    parser.add_argument('--metrics-jsonl', metavar='PATH', help='append metrics events to a JSON lines file')
+    parser.add_argument('--prometheus', metavar='PATH',
+                        help='write metrics in the Prometheus text format after the batch')
+    _add_auth_arguments(parser)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='file_encryptor', description=f"{APP_NAME} {APP_VERSION} (headless)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    encrypt = commands.add_parser('encrypt', help='encrypt files and folders')
+    _add_batch_arguments(encrypt)
+    encrypt.add_argument('--chunk-size', type=_parse_size, default=CHUNK_SIZE, metavar='SIZE',
+                         help='plaintext bytes per chunk, e.g. 4M (default: 1M)')
+    encrypt.add_argument('--codec', choices=sorted(_CODECS), default='auto')
+    encrypt.add_argument('--session-key', action='store_true',
+                         help='derive the password key once for the whole batch')
+    encrypt.add_argument('--incremental', action='store_true',
+                         help='update existing folder archives with changed files only')
+    encrypt.add_argument('--store', nargs='?', const=CHUNK_STORE_PATH, metavar='DIR',
+                         help='deduplicate files into a chunk store (default store: %(const)s)')
+    encrypt.add_argument('--name', default='', help="filename stored in the header when encrypting '-'")
+    encrypt.set_defaults(func=cmd_encrypt)
+
+    decrypt = commands.add_parser('decrypt', help='decrypt .locked files')
+    _add_batch_arguments(decrypt)
+    decrypt.add_argument('--store', metavar='DIR', help='chunk store of deduplicated files (default: %s)'
+                         % CHUNK_STORE_PATH.replace('%', '%%'))
+    decrypt.set_defaults(func=cmd_decrypt)
+
+    inspect = commands.add_parser('inspect', help='print .locked headers without decrypting')
+    inspect.add_argument('paths', nargs='+', metavar='PATH')
+    inspect.add_argument('--workers', type=int, default=INSPECT_WORKERS)
+    inspect.set_defaults(func=cmd_inspect)
+
+    search = commands.add_parser('search', help='find files below a directory')
+    search.add_argument('directory')
+    search.add_argument('--pattern', default='*')
+    search.add_argument('--no-recursive', action='store_true')
+    search.add_argument('--locked', action='store_true', help='only .locked files')
+    search.add_argument('--extension', metavar='EXT', help="only files ending in EXT, e.g. '.txt'")
+    search.add_argument('--index', action='store_true', help='use the persistent search index')
+    search.add_argument('--index-path', default=INDEX_DB_PATH, metavar='PATH')
+    search.add_argument('--workers', type=int, default=WALK_WORKERS)
+    search.set_defaults(func=cmd_search)
+
+    list_parser = commands.add_parser('list', help='list the members of an encrypted folder')
+    list_parser.add_argument('archive')
+    _add_auth_arguments(list_parser)
+    list_parser.set_defaults(func=cmd_list)
+
+    extract = commands.add_parser('extract', help='decrypt one member of an encrypted folder')
+    extract.add_argument('archive')
+    extract.add_argument('member', help="member path as shown by list, e.g. 'src/main.py'")
+    extract.add_argument('-o', '--output-dir', default='.')
+    _add_auth_arguments(extract)
+    extract.set_defaults(func=cmd_extract)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except Exception as e:
+        _emit('error', out=sys.stderr if _is_pipe(args) else None, message=str(e))
+        return 2
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Compression codecs applied to chunks before encryption.
+
+Deflate is always available. Zstandard and LZ4 are optional and enabled
+when the 'zstandard' and 'lz4' packages are installed.
+"""
+
+import math
+import os
+import zlib
+from collections import Counter
+from config import *
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+class _DeflateCodec:
+    """zlib deflate."""
+
+    codec_id = CODEC_DEFLATE
+
+    def compress(self, data):
+        return zlib.compress(data, DEFLATE_LEVEL)
+
+    def decompress(self, data, max_size):
+        decompressor = zlib.decompressobj()
+        plaintext = decompressor.decompress(data, max_size)
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise ValueError(MSG_CORRUPTED_FILE)
+        return plaintext
+
+
+class _ZstdCodec:
+    """Zstandard (optional 'zstandard' package)."""
+
+    codec_id = CODEC_ZSTD
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+    def decompress(self, data, max_size):
+        try:
+            plaintext = zstandard.ZstdDecompressor().decompress(data, max_output_size=max_size)
+        except zstandard.ZstdError:
+            raise ValueError(MSG_CORRUPTED_FILE)
+        if len(plaintext) > max_size:
+            raise ValueError(MSG_CORRUPTED_FILE)
+        return plaintext
+
+
+class _LZ4Codec:
+    """LZ4 frame format (optional 'lz4' package)."""
+
+    codec_id = CODEC_LZ4
+
+    def compress(self, data):
+        return lz4_frame.compress(data)
+
+    def decompress(self, data, max_size):
+        decompressor = lz4_frame.LZ4FrameDecompressor()
+        try:
+            # One byte over the limit is enough to tell an oversized frame apart
+            plaintext = decompressor.decompress(data, max_length=max_size + 1)
+        except RuntimeError:
+            raise ValueError(MSG_CORRUPTED_FILE)
+        if len(plaintext) > max_size or not decompressor.eof or decompressor.unused_data:
+            raise ValueError(MSG_CORRUPTED_FILE)
+        return plaintext
+
+
+_CODECS = {
+    CODEC_DEFLATE: (_DeflateCodec, lambda: True, None),
+    CODEC_ZSTD: (_ZstdCodec, lambda: zstandard is not None, 'zstandard'),
+    CODEC_LZ4: (_LZ4Codec, lambda: lz4_frame is not None, 'lz4')
+}
+
+
+def is_available(codec_id):
+    """Whether a codec can be used in this installation."""
+    if codec_id == CODEC_NONE:
+        return True
+    return codec_id in _CODECS and _CODECS[codec_id][1]()
+
+
+def available_codecs():
+    """Codec ids usable here, including CODEC_NONE."""
+    return [CODEC_NONE] + [codec_id for codec_id in _CODECS if is_available(codec_id)]
+
+
+def get_codec(codec_id):
+    """Return the codec object for a stored codec id, or None for CODEC_NONE."""
+    if codec_id == CODEC_NONE:
+        return None
+    if codec_id not in _CODECS:
+        raise ValueError(f"Unsupported compression codec: {codec_id}")
+
+    codec_class, available, package = _CODECS[codec_id]
+    if not available():
+        raise ValueError(
+            f"{CODEC_NAMES[codec_id]} compression requires the '{package}' package"
+        )
+    return codec_class()
+
+
+def estimate_entropy(sample):
+    """Shannon entropy of a byte sample in bits per byte (0.0 - 8.0)."""
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(count / total * math.log2(count / total) for count in Counter(sample).values())
+
+
+def is_incompressible(path=None, sample=None):
+    """
+    Guess whether data is already compressed or encrypted.
+
+    Checks the file extension first, then the entropy of a sample.
+    """
+    if path is not None and os.path.splitext(path)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return True
+    if sample is not None and len(sample) >= 1024:
+        return estimate_entropy(sample) > INCOMPRESSIBLE_ENTROPY
+    return False
+
+
+def select_codec(requested, path=None, sample=None):
+    """
+    Resolve the codec to store for new data.
+
+    CODEC_AUTO picks the fastest available codec. Compression is skipped
+    (CODEC_NONE) when is_incompressible() says it would not pay off.
+    """
+    if requested == CODEC_AUTO:
+        requested = next(codec_id for codec_id in CODEC_PREFERENCE if is_available(codec_id))
+    elif requested != CODEC_NONE:
+        # Fail early for unknown or missing codecs
+        get_codec(requested)
+
+    if requested != CODEC_NONE and is_incompressible(path, sample):
+        return CODEC_NONE
+    return requested
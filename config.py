@@ -10,18 +10,49 @@ APP_VERSION = "1.0.0"
 
 # File format constants
 MAGIC_BYTES = b"FLCK"
-FILE_VERSION = 1
+FILE_VERSION = 2
+LEGACY_FILE_VERSION = 1
+SUPPORTED_FILE_VERSIONS = (LEGACY_FILE_VERSION, FILE_VERSION)
 ENCRYPTED_EXTENSION = ".locked"
 
+# Payload types (stored in the compressed flag byte)
+PAYLOAD_FILE = 0
+PAYLOAD_ZIP = 1  # Folder compressed to a ZIP archive (version 1 and later)
+PAYLOAD_TAR = 2  # Folder streamed as a tar archive
+PAYLOAD_ARCHIVE = 3  # Folder as member data followed by a manifest; members readable on their own
+
+# Folder archive trailer: [MEMBER DATA...][MANIFEST JSON][MANIFEST_LENGTH:8][MAGIC:4]
+ARCHIVE_MAGIC = b'FLCM'
+ARCHIVE_TRAILER_SIZE = 12
+ARCHIVE_MANIFEST_VERSION = 1
+ARCHIVE_COMPACT_RATIO = 0.5  # Incremental updates rewrite the archive once more than this share is dead data
+
+# Appending in place overwrites the final chunk and footer; a durable copy is kept in a
+# sibling file, [MAGIC:4][TAIL_OFFSET:8][OLD TAIL...], until the append is on disk
+APPEND_BACKUP_SUFFIX = '.flck_tail'
+APPEND_BACKUP_MAGIC = b'FLCT'
+
 # Encryption modes
 MODE_PASSWORD = 0
 MODE_KEYFILE = 1
 
+# Chunk ciphers (version 2+)
+CIPHER_FERNET = 0
+CIPHER_AES_GCM = 1
+CIPHER_CHACHA20_POLY1305 = 2
+DEFAULT_CIPHER = CIPHER_AES_GCM
+
 # Crypto constants
 SALT_SIZE = 32
 KEY_SIZE = 32
 PBKDF2_ITERATIONS = 480000  # OWASP recommendation for 2023+
 MIN_PASSWORD_LENGTH = 8
+KEY_NONCE_SIZE = 16
+HKDF_FILE_KEY_INFO = b"FLCK file key"
+
+# Derived-key cache
+KEY_CACHE_MAX_ENTRIES = 64
+KEY_CACHE_TTL = 300  # Seconds a derived key may stay cached
 
 # File header structure
 HEADER_MAGIC_SIZE = 4
@@ -30,11 +61,132 @@ HEADER_MODE_SIZE = 1
 HEADER_SALT_SIZE = 32
 HEADER_COMPRESSED_SIZE = 1
 HEADER_FILENAME_LENGTH_SIZE = 2
+HEADER_CIPHER_SIZE = 1
+HEADER_CHUNK_SIZE_SIZE = 4
+HEADER_EXTENSIONS_LENGTH_SIZE = 2
+HEADER_PROBE_SIZE = 4096  # One read covers any header with a normal filename
+MAX_HEADER_SIZE = (
+    HEADER_MAGIC_SIZE + HEADER_VERSION_SIZE + HEADER_MODE_SIZE + HEADER_SALT_SIZE
+    + HEADER_COMPRESSED_SIZE + HEADER_FILENAME_LENGTH_SIZE + 0xFFFF
+    + HEADER_CIPHER_SIZE + HEADER_CHUNK_SIZE_SIZE + HEADER_EXTENSIONS_LENGTH_SIZE + 0xFFFF
+)
+INSPECT_WORKERS = 16
+
+# Chunked payload structure (version 2+)
+CHUNK_SIZE = 1024 * 1024  # Plaintext bytes per chunk
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+FRAME_HEADER_SIZE = 5  # Payload length (4) + flags (1)
+FRAME_FLAG_FINAL = 0x01
+FRAME_FLAG_COMPRESSED = 0x02
+
+# Chunk index footer, appended after the final frame:
+# [OFFSET:8][FRAME_LENGTH:4] per chunk, then [CHUNKS:8][PLAINTEXT_SIZE:8][INDEX_OFFSET:8][MAGIC:4]
+CHUNK_INDEX_ENTRY_SIZE = 12
+FOOTER_MAGIC = b'FLCI'
+FOOTER_SIZE = 28
+
+# Header extension tags (version 2+)
+EXT_KEY_NONCE = 1  # Per-file HKDF nonce for batch session keys
+EXT_CODEC = 2  # Compression codec applied to chunks before sealing
+EXT_CHUNK_INDEX = 3  # Empty; the file ends with a chunk index footer
+EXT_CHUNK_STORE = 4  # Store id; the payload is a recipe of chunks kept in a ChunkStore
+
+# Compression codecs
+CODEC_AUTO = -1  # Pick the fastest available codec; never stored in a header
+CODEC_NONE = 0
+CODEC_DEFLATE = 1
+CODEC_ZSTD = 2
+CODEC_LZ4 = 3
+CODEC_NAMES = {
+    CODEC_AUTO: 'Auto',
+    CODEC_NONE: 'None',
+    CODEC_DEFLATE: 'Deflate',
+    CODEC_ZSTD: 'Zstandard',
+    CODEC_LZ4: 'LZ4'
+}
+CODEC_PREFERENCE = (CODEC_ZSTD, CODEC_LZ4, CODEC_DEFLATE)
+DEFLATE_LEVEL = 6
+ZSTD_LEVEL = 3
+COMPRESSION_SAMPLE_SIZE = 64 * 1024
+INCOMPRESSIBLE_ENTROPY = 7.5  # Bits per byte above which sampled data is skipped
+INCOMPRESSIBLE_EXTENSIONS = frozenset({
+    '.7z', '.aac', '.avi', '.br', '.bz2', '.docx', '.flac', '.gif', '.gz', '.heic',
+    '.jar', '.jpeg', '.jpg', '.locked', '.lz4', '.m4a', '.mkv', '.mov', '.mp3', '.mp4',
+    '.ogg', '.pdf', '.png', '.pptx', '.rar', '.webm', '.webp', '.xlsx', '.xz', '.zip',
+    '.zst'
+})
+PIPELINE_DEPTH = 2  # Chunks in flight per cipher worker
+PARALLEL_MIN_SIZE = 8 * CHUNK_SIZE  # Smaller files are sealed on one thread
+CHUNK_WORKERS = os.cpu_count() or 1
+AEAD_NONCE_SIZE = 12
+AEAD_TAG_SIZE = 16
+
+# Batch execution
+EXECUTOR_AUTO = 'auto'
+EXECUTOR_PROCESS = 'process'
+EXECUTOR_THREAD = 'thread'
+DEFAULT_MAX_WORKERS = os.cpu_count() or 1
+
+# Metrics: stage names, per-file latency histogram bounds (seconds) and exporter prefix
+STAGE_KDF = 'kdf'
+STAGE_ARCHIVE = 'archive'
+STAGE_READ = 'read'
+STAGE_COMPRESS = 'compress'
+STAGE_CIPHER = 'cipher'
+STAGE_WRITE = 'write'
+STAGE_DELETE = 'delete'
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+METRICS_PROMETHEUS_PREFIX = 'file_encryptor'
+
+# Byte progress: seconds between updates and the weight of the newest sample in the smoothed rate
+PROGRESS_INTERVAL = 0.25
+PROGRESS_SMOOTHING = 0.3
+
+# Directory walking (threads overlap the latency of listing directories on network shares)
+WALK_WORKERS = 8
+
+# Deduplicating chunk store: content-defined chunk sizes and the recipe format
+CHUNK_STORE_PATH = os.path.join(os.path.expanduser("~"), ".file_encryptor", "chunks")
+CHUNK_STORE_VERSION = 1
+CHUNK_STORE_ID_SIZE = 16
+CDC_MIN_SIZE = 16 * 1024
+CDC_AVG_SIZE = 64 * 1024  # Must be a power of two
+CDC_MAX_SIZE = 256 * 1024
+RECIPE_ENTRY_SIZE = 36  # [CHUNK_SHA256:32][PLAINTEXT_LENGTH:4]
+
+# Search index
+INDEX_DB_PATH = os.path.join(os.path.expanduser("~"), ".file_encryptor", "index.sqlite3")
+INDEX_REFRESH_BATCH = 64  # Directories refreshed per transaction (and hold of the index lock)
+
+# Durability of output files (always written to a temp sibling and renamed into place):
+# fsync each file before its rename, fsync finished files together in groups, or never fsync
+DURABILITY_FILE = 'file'
+DURABILITY_BATCH = 'batch'
+DURABILITY_NONE = 'none'
+DEFAULT_DURABILITY = DURABILITY_BATCH
+GROUP_COMMIT_WORKERS = 16
+GROUP_COMMIT_FILES = 64  # A group is committed once it has this many files...
+GROUP_COMMIT_INTERVAL = 2.0  # ...or its first file has waited this many seconds
+
+# Batch job journal: per-file states, so an interrupted batch resumes where it stopped
+JOURNAL_DB_PATH = os.path.join(os.path.expanduser("~"), ".file_encryptor", "journal.sqlite3")
+JOB_PENDING = 'pending'
+JOB_WRITING = 'writing'  # Output may be partial
+JOB_COMMITTED = 'committed'  # Output complete and synced to disk
+JOB_ORIGINAL_DELETED = 'original_deleted'
+JOB_FAILED = 'failed'
+JOURNAL_BUSY_TIMEOUT = 60  # Seconds a worker waits for another writer
+
+# Background search: results reach the file list in batches, at most every interval
+SEARCH_BATCH_SIZE = 500
+SEARCH_UPDATE_INTERVAL = 0.1
 
 # UI constants
 WINDOW_WIDTH = 900
 WINDOW_HEIGHT = 700
 PADDING = 10
+FILE_LIST_ROW_HEIGHT = 22
+FILE_LIST_NAME_WIDTH = 220
 
 # Default settings
 DEFAULT_SEARCH_DIR = os.path.expanduser("~")
@@ -47,3 +199,6 @@ MSG_WRONG_PASSWORD = "Incorrect password or corrupted file."
 MSG_INVALID_KEY = "Invalid key file."
 MSG_FILE_NOT_FOUND = "File not found."
 MSG_CORRUPTED_FILE = "File appears to be corrupted."
+MSG_TRUNCATED_FILE = "Encrypted file is truncated."
+MSG_APPEND_PENDING = "An update of this file is in progress or was interrupted; run the update again to roll it back."
+MSG_FILE_BUSY = "File is being updated by another process."
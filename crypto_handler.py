@@ -2,14 +2,784 @@
 Encryption and decryption logic using AES-256.
 """
 
+import hashlib
+import io
+import mmap
 import os
+import queue
+import shutil
 import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
 from cryptography.fernet import Fernet, InvalidToken
+from cryptography.exceptions import InvalidTag
 import base64
 from config import *
+from compression import get_codec, select_codec
+from chunk_store import ChunkStore, ChunkStoreReader
+from metrics import timed_io, timed_stage
+from durability import fsync_path, lock_exclusive, open_temp_sibling, remove_temp, replace_durably
+
+
+_FRAME_HEADER = struct.Struct('>IB')
+_INDEX_ENTRY = struct.Struct('>QI')
+_FOOTER = struct.Struct('>QQQ4s')
+_APPEND_BACKUP = struct.Struct('>4sQ')
+
+
+def _read_exact(f, size):
+    """Read up to size bytes, looping over short reads until EOF."""
+    data = f.read(size)
+    if data is None:
+        data = b''
+    if len(data) == size or not data:
+        return data
+    parts = [data]
+    remaining = size - len(data)
+    while remaining:
+        part = f.read(remaining)
+        if not part:
+            break
+        parts.append(part)
+        remaining -= len(part)
+    return b''.join(parts)
+
+
+class _FernetChunkCipher:
+    """
+    Seals chunks as Fernet tokens with a digest of the file header, the chunk
+    index and the flags inside the token.
+    """
+
+    _PREFIX = struct.Struct('>32sQB')
+
+    def __init__(self, key, header_bytes):
+        self._fernet = Fernet(key)
+        self._header_digest = hashlib.sha256(header_bytes).digest()
+
+    def seal(self, index, flags, data):
+        prefix = self._PREFIX.pack(self._header_digest, index, flags)
+        return self._fernet.encrypt(prefix + bytes(data))
+
+    def open(self, index, flags, payload):
+        try:
+            plaintext = self._fernet.decrypt(bytes(payload))
+        except InvalidToken:
+            raise ValueError("Decryption failed: Invalid key or corrupted data")
+
+        # A chunk moved, dropped, re-flagged or put under another header fails here
+        expected = (self._header_digest, index, flags)
+        if len(plaintext) < self._PREFIX.size or self._PREFIX.unpack_from(plaintext) != expected:
+            raise ValueError(MSG_CORRUPTED_FILE)
+        return plaintext[self._PREFIX.size:]
+
+
+class _AEADChunkCipher:
+    """
+    Seals chunks as raw binary AEAD ciphertext: [NONCE:12][CIPHERTEXT][TAG:16].
+
+    The file header, chunk index and flags are authenticated as associated
+    data, so per-chunk overhead is a constant AEAD_NONCE_SIZE + AEAD_TAG_SIZE.
+    """
+
+    _POSITION = struct.Struct('>QB')
+
+    def __init__(self, aead_class, key, header_bytes):
+        self._aead = aead_class(base64.urlsafe_b64decode(key))
+        self._header_bytes = header_bytes
+
+    def _associated_data(self, index, flags):
+        return self._header_bytes + self._POSITION.pack(index, flags)
+
+    def seal(self, index, flags, data):
+        nonce = os.urandom(AEAD_NONCE_SIZE)
+        return nonce + self._aead.encrypt(nonce, data, self._associated_data(index, flags))
+
+    def open(self, index, flags, payload):
+        if len(payload) < AEAD_NONCE_SIZE + AEAD_TAG_SIZE:
+            raise ValueError(MSG_CORRUPTED_FILE)
+        try:
+            return self._aead.decrypt(
+                payload[:AEAD_NONCE_SIZE],
+                payload[AEAD_NONCE_SIZE:],
+                self._associated_data(index, flags)
+            )
+        except InvalidTag:
+            raise ValueError("Decryption failed: Invalid key or corrupted data")
+
+
+def _read_ahead(reader, size, depth):
+    """
+    Yield blocks of up to size bytes read by a background thread.
+
+    At most depth blocks are buffered, so the reader thread overlaps disk
+    reads with the consumer without letting memory grow.
+    """
+    blocks = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            while not stop.is_set():
+                block = _read_exact(reader, size)
+                while not stop.is_set():
+                    try:
+                        blocks.put(block, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if not block:
+                    return
+        except Exception as e:
+            blocks.put(e)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                return
+            yield block
+    finally:
+        stop.set()
+        while thread.is_alive():
+            try:
+                blocks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
+
+def _map_input(f):
+    """Memory-map an open file read-only, or return None if it can't be mapped."""
+    try:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        return None
+
+
+def _close_map(mm):
+    """Close an mmap, leaving it to the GC if memoryview slices are still alive."""
+    try:
+        mm.close()
+    except BufferError:
+        pass
+
+
+def _preallocate(f, size):
+    """Reserve size bytes for f up front; the caller truncates to the real size later."""
+    try:
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(f.fileno(), 0, size)
+        else:
+            f.truncate(size)
+        return True
+    except OSError:
+        return False
+
+
+class _MappedReader:
+    """
+    Sequential reader over a memory-mapped file.
+
+    read() returns memoryview slices of the mapping, so ciphertext reaches
+    the cipher without being copied into intermediate bytes objects.
+    """
+
+    def __init__(self, f, mm, offset):
+        self._file = f
+        self._mm = mm
+        self._view = memoryview(mm)
+        self._pos = offset
+
+    def read(self, size=-1):
+        end = len(self._view) if size < 0 else self._pos + size
+        data = self._view[self._pos:end]
+        self._pos += len(data)
+        return data
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._view.release()
+        _close_map(self._mm)
+        self._file.close()
+
+
+class _LazyHeader(dict):
+    """Header dictionary that reads 'encrypted_data' from disk on first access."""
+
+    def __init__(self, filepath, metadata):
+        super().__init__(metadata)
+        self._filepath = filepath
+
+    def __missing__(self, key):
+        if key != 'encrypted_data':
+            raise KeyError(key)
+        with open(self._filepath, 'rb') as f:
+            f.seek(self['data_offset'])
+            self['encrypted_data'] = f.read()
+        return self['encrypted_data']
+
+
+def _throughput(nbytes, seconds):
+    """Throughput in MB/s (MiB per second)."""
+    return nbytes / (1024 * 1024) / seconds if seconds > 0 else 0.0
+
+
+class EncryptingWriter(io.RawIOBase):
+    """
+    Writable stream that encrypts everything written to it as framed chunks.
+
+    Each frame is [LENGTH:4][FLAGS:1][SEALED_CHUNK]. Up to one chunk of
+    plaintext is held back so the last chunk can carry FRAME_FLAG_FINAL,
+    which keeps memory use at about two chunks for any input size. Chunks
+    are compressed with the codec first, and stored raw whenever that does
+    not make them smaller. Closing the writer seals the final chunk; leaving
+    a with-block on an exception calls abort() instead, so a failed stream
+    never looks complete.
+
+    With workers > 1, chunks are compressed and sealed on a thread pool
+    (the AEAD ciphers and zlib release the GIL) and written back in order.
+    At most workers * PIPELINE_DEPTH chunks are in flight, which caps memory.
+
+    With chunk_index, the offset and length of every frame is recorded and
+    written as a footer after the final frame, for RandomAccessReader.
+
+    resume=(chunk_count, offset, index_entries) continues an existing file
+    whose first chunk_count frames (all full, none final) end at offset and
+    are already in place; the header is not written again.
+
+    With metrics, compression, sealing and frame writes are timed into the
+    compress, cipher and write stages. progress, if given, is called with the
+    plaintext size of every chunk once its frame is written, always on the
+    thread writing to the stream.
+
+    With output_path and temp_path, raw is the temporary file: a clean
+    close renames it to output_path (fsync'ed first if fsync), and abort
+    deletes it.
+    """
+
+    def __init__(self, raw, header, chunk_cipher, chunk_size, output_path=None, codec=None, workers=1,
+                 preallocated=False, chunk_index=False, resume=None, metrics=None, progress=None,
+                 temp_path=None, fsync=False):
+        super().__init__()
+        self._temp_path = temp_path
+        self._fsync = fsync
+        self._metrics = metrics
+        self._progress = progress
+        self._raw = raw
+        self._preallocated = preallocated
+        self._cipher = chunk_cipher
+        self._codec = codec
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._output_path = output_path
+        self._pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self._max_inflight = workers * PIPELINE_DEPTH
+        self._pending = deque()
+        self._started = time.perf_counter()
+        self._index_entries = bytearray() if chunk_index else None
+        self.header = header
+        self.bytes_in = 0
+        if resume is None:
+            self.chunk_count = 0
+            self.bytes_out = len(header)
+            raw.write(header)
+        else:
+            self.chunk_count, self.bytes_out, index_entries = resume
+            self._index_entries = bytearray(index_entries)
+        self._plaintext_base = self.chunk_count * chunk_size
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        return self._write(data, stable=False)
+
+    def write_buffer(self, data):
+        """
+        Write from a buffer that stays valid and unchanged until close().
+
+        Whole chunks are sealed straight from memoryview slices of data (for
+        example a read-only mmap of the input) without being copied.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        return self._write(data, stable=True)
+
+    def _write(self, data, stable):
+        view = memoryview(data).cast('B')
+        size = len(view)
+        self.bytes_in += size
+        pos = 0
+
+        # Top up the held-back partial chunk first
+        if self._buffer:
+            pos = min(size, self._chunk_size - len(self._buffer))
+            self._buffer += view[:pos]
+            if pos < size:
+                self._emit(self._buffer, 0)
+                self._buffer = bytearray()
+
+        # Only emit a chunk once more data follows it, so it can't be the final one.
+        # Worker threads may still hold a chunk after write() returns, so slices
+        # of a caller's buffer are copied unless the caller guarantees it is stable.
+        while size - pos > self._chunk_size:
+            chunk = view[pos:pos + self._chunk_size]
+            self._emit(chunk if stable or self._pool is None else bytes(chunk), 0)
+            pos += self._chunk_size
+
+        if pos < size:
+            self._buffer += view[pos:]
+        return size
+
+    def _seal_frame(self, index, flags, chunk):
+        """Compress and seal one chunk; safe to run on a worker thread."""
+        size = len(chunk)
+        if self._codec is not None and chunk:
+            with timed_stage(self._metrics, STAGE_COMPRESS, size):
+                compressed = self._codec.compress(chunk)
+            if len(compressed) < len(chunk):
+                chunk = compressed
+                flags |= FRAME_FLAG_COMPRESSED
+        with timed_stage(self._metrics, STAGE_CIPHER, size):
+            sealed = self._cipher.seal(index, flags, chunk)
+        return _FRAME_HEADER.pack(len(sealed), flags), sealed, size
+
+    def _write_frame(self, frame):
+        frame_header, sealed, size = frame
+        length = len(frame_header) + len(sealed)
+        if self._index_entries is not None:
+            self._index_entries += _INDEX_ENTRY.pack(self.bytes_out, length)
+        with timed_stage(self._metrics, STAGE_WRITE, length):
+            self._raw.write(frame_header)
+            self._raw.write(sealed)
+        self.bytes_out += length
+        if self._progress is not None and size:
+            self._progress(size)
+
+    def _emit(self, chunk, flags):
+        index = self.chunk_count
+        self.chunk_count += 1
+        if self._pool is None:
+            self._write_frame(self._seal_frame(index, flags, chunk))
+            return
+
+        self._pending.append(self._pool.submit(self._seal_frame, index, flags, chunk))
+        while len(self._pending) >= self._max_inflight:
+            self._write_frame(self._pending.popleft().result())
+
+    def _shutdown_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def close(self):
+        """Seal the final chunk and close the output."""
+        if self.closed:
+            return
+        try:
+            self._emit(self._buffer, FRAME_FLAG_FINAL)
+            self._buffer = bytearray()
+            while self._pending:
+                self._write_frame(self._pending.popleft().result())
+            if self._index_entries is not None:
+                self._write_index()
+            if self._preallocated:
+                # Drop the unused tail of the preallocated space
+                self._raw.truncate(self._raw.tell())
+        except BaseException:
+            self._shutdown_pool()
+            super().close()
+            if self._temp_path is not None:
+                self._raw.close()
+                remove_temp(self._temp_path)
+            elif self._output_path is not None:
+                self._raw.close()
+            raise
+
+        self._shutdown_pool()
+        super().close()
+        if self._temp_path is not None:
+            try:
+                replace_durably(self._temp_path, self._output_path, self._raw, self._fsync)
+            except BaseException:
+                self._raw.close()
+                remove_temp(self._temp_path)
+                raise
+        elif self._output_path is not None:
+            self._raw.close()
+
+    def _write_index(self):
+        """Append the chunk index footer (offsets are relative to the start of the header)."""
+        index_offset = self.bytes_out
+        self._raw.write(self._index_entries)
+        self._raw.write(_FOOTER.pack(
+            self.chunk_count, self._plaintext_base + self.bytes_in, index_offset, FOOTER_MAGIC
+        ))
+        self.bytes_out += len(self._index_entries) + FOOTER_SIZE
+
+    def abort(self):
+        """Close without a final chunk and delete the output file."""
+        if self.closed:
+            return
+        self._pending.clear()
+        self._shutdown_pool()
+        super().close()
+        if self._output_path is not None:
+            self._raw.close()
+            if self._temp_path is not None:
+                remove_temp(self._temp_path)
+            elif os.path.exists(self._output_path):
+                os.remove(self._output_path)
+
+    def stats(self):
+        """Bytes processed, elapsed seconds and plaintext throughput in MB/s."""
+        seconds = time.perf_counter() - self._started
+        return {
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'seconds': seconds,
+            'throughput_mbps': _throughput(self.bytes_in, seconds)
+        }
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+def _restore_tail(raw, tail_offset, saved_tail):
+    """Put an appended file's original final frame and footer back, and flush them to disk."""
+    raw.seek(tail_offset)
+    raw.truncate()
+    raw.write(saved_tail)
+    raw.flush()
+    os.fsync(raw.fileno())
+
+
+class _AppendingWriter(EncryptingWriter):
+    """
+    EncryptingWriter continuing an existing file in place.
+
+    The original final frame and footer are kept in memory and in a backup
+    file next to it; abort() or a failed close() puts them back, so a failed
+    append leaves the file as it was, and after a crash the next append
+    restores them (CryptoHandler.recover_append). The backup is removed
+    only once the appended data is on disk. raw is locked (see
+    durability.lock_exclusive) until the writer is closed.
+    """
+
+    def __init__(self, raw, header, chunk_cipher, chunk_size, codec, workers, resume, saved_tail, backup_path):
+        super().__init__(raw, header, chunk_cipher, chunk_size, codec=codec, workers=workers,
+                         chunk_index=True, resume=resume)
+        self._tail_offset = resume[1]
+        self._saved_tail = saved_tail
+        self._backup_path = backup_path
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super().close()
+            self._raw.flush()
+            os.fsync(self._raw.fileno())
+        except BaseException:
+            self._restore()
+            raise
+        try:
+            self._remove_backup()
+        finally:
+            self._raw.close()
+
+    def abort(self):
+        if self.closed:
+            return
+        super().abort()
+        self._restore()
+
+    def _restore(self):
+        try:
+            _restore_tail(self._raw, self._tail_offset, self._saved_tail)
+            # Only once the tail is back; otherwise the next append restores it from the backup
+            self._remove_backup()
+        finally:
+            self._raw.close()
+
+    def _remove_backup(self):
+        # While the file is still locked, so no other process mistakes the append for an interrupted one
+        os.remove(self._backup_path)
+        fsync_path(os.path.dirname(os.path.abspath(self._backup_path)))
+
+
+def _open_chunk(chunk_cipher, codec, chunk_size, index, flags, payload, metrics=None):
+    """Authenticate, decrypt and decompress the payload of frame number index."""
+    started = time.perf_counter()
+    chunk = chunk_cipher.open(index, flags, payload)
+    opened = time.perf_counter()
+    if flags & FRAME_FLAG_COMPRESSED:
+        if codec is None:
+            raise ValueError(MSG_CORRUPTED_FILE)
+        chunk = codec.decompress(chunk, chunk_size)
+        if metrics is not None:
+            metrics.add(STAGE_COMPRESS, time.perf_counter() - opened, len(chunk))
+    if metrics is not None:
+        metrics.add(STAGE_CIPHER, opened - started, len(chunk))
+    return chunk
+
+
+class DecryptingReader(io.RawIOBase):
+    """
+    Readable stream of plaintext decrypted chunk by chunk from a .locked file.
+
+    Reading past the end raises ValueError if the final chunk never arrives,
+    so truncated input cannot pass for a complete file. The parsed header is
+    available as the header attribute.
+
+    With workers > 1, frames are read ahead and opened on a thread pool,
+    bounded like EncryptingWriter. With metrics, frame reads, decryption
+    and decompression are timed into the read, cipher and compress stages.
+    progress, if given, is called with the size of every frame read.
+    """
+
+    def __init__(self, raw, header, chunk_cipher, plaintext=None, owns_raw=True, workers=1, metrics=None,
+                 progress=None):
+        super().__init__()
+        self._metrics = metrics
+        self._progress = progress
+        self._raw = raw
+        self._cipher = chunk_cipher
+        self._owns_raw = owns_raw
+        self._chunk_size = header['chunk_size'] or 0
+        self._max_payload = self._chunk_size * 2 + 1024
+        self._codec = get_codec(header['codec'])
+        self._pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self._max_inflight = workers * PIPELINE_DEPTH
+        self._pending = deque()
+        self._index = 0
+        self._chunk = plaintext or b''
+        self._pos = 0
+        # Version 1 payloads are decrypted up front and handed in as plaintext
+        self._finished = plaintext is not None
+        self._all_frames_read = self._finished
+        self.header = header
+
+    def readable(self):
+        return True
+
+    def _read_frame(self):
+        started = time.perf_counter()
+        frame = _read_exact(self._raw, FRAME_HEADER_SIZE)
+        if len(frame) != FRAME_HEADER_SIZE:
+            raise ValueError(MSG_TRUNCATED_FILE)
+
+        length, flags = _FRAME_HEADER.unpack(frame)
+        if length > self._max_payload:
+            raise ValueError(MSG_CORRUPTED_FILE)
+
+        payload = _read_exact(self._raw, length)
+        if len(payload) != length:
+            raise ValueError(MSG_TRUNCATED_FILE)
+        if self._metrics is not None:
+            self._metrics.add(STAGE_READ, time.perf_counter() - started, FRAME_HEADER_SIZE + length)
+        if self._progress is not None:
+            self._progress(FRAME_HEADER_SIZE + length)
+
+        index = self._index
+        self._index += 1
+        if flags & FRAME_FLAG_FINAL:
+            self._all_frames_read = True
+        return index, flags, payload
+
+    def _open_frame(self, index, flags, payload):
+        """Open and decompress one chunk; safe to run on a worker thread."""
+        return _open_chunk(self._cipher, self._codec, self._chunk_size, index, flags, payload, self._metrics), flags
+
+    def _next_chunk(self):
+        if self._pool is None:
+            chunk, flags = self._open_frame(*self._read_frame())
+        else:
+            while not self._all_frames_read and len(self._pending) < self._max_inflight:
+                self._pending.append(self._pool.submit(self._open_frame, *self._read_frame()))
+            chunk, flags = self._pending.popleft().result()
+
+        if flags & FRAME_FLAG_FINAL:
+            self._finished = True
+        return chunk
+
+    def readinto(self, b):
+        while self._pos >= len(self._chunk):
+            if self._finished:
+                return 0
+            self._chunk = self._next_chunk()
+            self._pos = 0
+
+        n = min(len(b), len(self._chunk) - self._pos)
+        b[:n] = self._chunk[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+            if self._owns_raw:
+                self._raw.close()
+        super().close()
+
+
+class RandomAccessReader(io.RawIOBase):
+    """
+    Seekable plaintext view of a version 2 .locked file.
+
+    Only the chunks covering the bytes actually read are decrypted. Frame
+    positions come from the chunk index footer, or from a scan of the frame
+    headers for files written without one. The footer is only a hint: every
+    chunk is authenticated with its index and final flag, and the plaintext
+    size is taken from the final chunk, so a tampered footer causes errors,
+    not wrong data.
+    """
+
+    def __init__(self, raw, header, chunk_cipher, owns_raw=True):
+        super().__init__()
+        self._raw = raw
+        self._cipher = chunk_cipher
+        self._owns_raw = owns_raw
+        self._chunk_size = header['chunk_size']
+        self._codec = get_codec(header['codec'])
+        self._data_offset = raw.tell()
+        self._cached = (None, b'')
+        self._pos = 0
+        self.header = header
+        try:
+            self._offsets, self._lengths, size_hint = self._load_index()
+            last = self._chunk(len(self._offsets) - 1)
+            self.size = (len(self._offsets) - 1) * self._chunk_size + len(last)
+            if size_hint is not None and size_hint != self.size:
+                raise ValueError(MSG_CORRUPTED_FILE)
+        except Exception:
+            self.close()
+            raise
+
+    def _load_index(self):
+        """Return (frame offsets, frame lengths, plaintext size or None)."""
+        file_size = self._raw.seek(0, os.SEEK_END)
+
+        if EXT_CHUNK_INDEX in self.header['extensions']:
+            if file_size < self._data_offset + FOOTER_SIZE:
+                raise ValueError(MSG_TRUNCATED_FILE)
+            self._raw.seek(file_size - FOOTER_SIZE)
+            count, plaintext_size, index_offset, magic = _FOOTER.unpack(_read_exact(self._raw, FOOTER_SIZE))
+            if magic != FOOTER_MAGIC:
+                raise ValueError(MSG_TRUNCATED_FILE)
+            if count == 0 or index_offset + count * CHUNK_INDEX_ENTRY_SIZE != file_size - FOOTER_SIZE:
+                raise ValueError(MSG_CORRUPTED_FILE)
+            self._raw.seek(index_offset)
+            entries = _read_exact(self._raw, count * CHUNK_INDEX_ENTRY_SIZE)
+            offsets, lengths = [], []
+            for offset, length in _INDEX_ENTRY.iter_unpack(entries):
+                offsets.append(offset)
+                lengths.append(length)
+            return offsets, lengths, plaintext_size
+
+        # No footer: walk the frame headers, seeking over each payload
+        offsets, lengths = [], []
+        pos = self._data_offset
+        while True:
+            self._raw.seek(pos)
+            frame = _read_exact(self._raw, FRAME_HEADER_SIZE)
+            if len(frame) != FRAME_HEADER_SIZE:
+                raise ValueError(MSG_TRUNCATED_FILE)
+            length, flags = _FRAME_HEADER.unpack(frame)
+            offsets.append(pos)
+            lengths.append(FRAME_HEADER_SIZE + length)
+            pos += FRAME_HEADER_SIZE + length
+            if pos > file_size:
+                raise ValueError(MSG_TRUNCATED_FILE)
+            if flags & FRAME_FLAG_FINAL:
+                return offsets, lengths, None
+
+    def _chunk(self, index):
+        """Decrypt chunk number index (the last one is kept)."""
+        if self._cached[0] == index:
+            return self._cached[1]
+
+        self._raw.seek(self._offsets[index])
+        frame = _read_exact(self._raw, self._lengths[index])
+        if len(frame) != self._lengths[index] or len(frame) < FRAME_HEADER_SIZE:
+            raise ValueError(MSG_TRUNCATED_FILE)
+        length, flags = _FRAME_HEADER.unpack_from(frame)
+        if FRAME_HEADER_SIZE + length != len(frame):
+            raise ValueError(MSG_CORRUPTED_FILE)
+
+        # Only the last chunk may (and must) be final, and all others are full
+        is_last = index == len(self._offsets) - 1
+        if bool(flags & FRAME_FLAG_FINAL) != is_last:
+            raise ValueError(MSG_CORRUPTED_FILE)
+        chunk = _open_chunk(self._cipher, self._codec, self._chunk_size, index, flags,
+                            memoryview(frame)[FRAME_HEADER_SIZE:])
+        if not is_last and len(chunk) != self._chunk_size:
+            raise ValueError(MSG_CORRUPTED_FILE)
+
+        self._cached = (index, chunk)
+        return chunk
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        elif whence != os.SEEK_SET:
+            raise ValueError(f"Invalid whence: {whence}")
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def readinto(self, b):
+        # Fill b across chunk boundaries so read(n) returns n bytes before EOF
+        view = memoryview(b).cast('B')
+        filled = 0
+        while filled < len(view) and self._pos < self.size:
+            index, within = divmod(self._pos, self._chunk_size)
+            chunk = self._chunk(index)
+            n = min(len(view) - filled, len(chunk) - within)
+            view[filled:filled + n] = chunk[within:within + n]
+            filled += n
+            self._pos += n
+        return filled
+
+    def close(self):
+        if not self.closed and self._owns_raw:
+            self._raw.close()
+        super().close()
 
 
 class CryptoHandler:
@@ -56,8 +826,48 @@ class CryptoHandler:
         return key, salt
 
     @staticmethod
-    def create_file_header(mode, salt, is_compressed, original_filename):
-        """Create file header with metadata."""
+    def derive_file_subkey(master_key, nonce):
+        """Derive a per-file key from a session master key with HKDF-SHA256."""
+        hkdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=KEY_SIZE,
+            salt=nonce,
+            info=HKDF_FILE_KEY_INFO,
+            backend=default_backend()
+        )
+        return base64.urlsafe_b64encode(hkdf.derive(base64.urlsafe_b64decode(master_key)))
+
+    @staticmethod
+    def derive_key_cached(password, salt, key_cache=None):
+        """Derive a key for an existing salt, going through key_cache if given."""
+        if key_cache is None:
+            return CryptoHandler.derive_key_from_password(password, salt)[0]
+        return key_cache.get_or_derive(
+            password, salt,
+            lambda: CryptoHandler.derive_key_from_password(password, salt)[0]
+        )
+
+    @staticmethod
+    def create_file_header(mode, salt, is_compressed, original_filename,
+                           cipher=CIPHER_FERNET, chunk_size=CHUNK_SIZE, extensions=None,
+                           payload_type=None):
+        """
+        Create file header with metadata.
+
+        Args:
+            mode: MODE_PASSWORD or MODE_KEYFILE
+            salt: PBKDF2 salt (ignored in key file mode)
+            is_compressed: Whether the payload is a compressed folder
+            original_filename: Name restored on decryption
+            cipher: Chunk cipher id (CIPHER_*)
+            chunk_size: Plaintext bytes per chunk
+            extensions: Optional dict of {tag: bytes} header extensions
+            payload_type: PAYLOAD_* value; defaults to PAYLOAD_ZIP if is_compressed
+                else PAYLOAD_FILE
+        """
+        if payload_type is None:
+            payload_type = PAYLOAD_ZIP if is_compressed else PAYLOAD_FILE
+
         header = bytearray()
 
         # Magic bytes
@@ -75,8 +885,8 @@ class CryptoHandler:
         else:
             header.extend(b'\x00' * HEADER_SALT_SIZE)
 
-        # Compressed flag
-        header.append(1 if is_compressed else 0)
+        # Payload type (compressed flag in version 1)
+        header.append(payload_type)
 
         # Original filename
         filename_bytes = original_filename.encode('utf-8')
@@ -84,48 +894,179 @@ class CryptoHandler:
         header.extend(struct.pack('>H', filename_length))
         header.extend(filename_bytes)
 
+        # Chunk cipher and chunk size
+        header.append(cipher)
+        header.extend(struct.pack('>I', chunk_size))
+
+        # Extensions as tag/length/value records
+        ext = bytearray()
+        for tag, value in sorted((extensions or {}).items()):
+            ext.append(tag)
+            ext.extend(struct.pack('>H', len(value)))
+            ext.extend(value)
+        header.extend(struct.pack('>H', len(ext)))
+        header.extend(ext)
+
         return bytes(header)
 
     @staticmethod
-    def parse_file_header(filepath):
-        """Parse header from encrypted file."""
-        with open(filepath, 'rb') as f:
-            # Read magic bytes
-            magic = f.read(HEADER_MAGIC_SIZE)
-            if magic != MAGIC_BYTES:
-                raise ValueError("Not a valid encrypted file")
+    def _read_header(f):
+        """Read the header from an open file, leaving it positioned at the payload."""
+        header = bytearray()
 
-            # Read version
-            version = f.read(HEADER_VERSION_SIZE)[0]
-            if version != FILE_VERSION:
-                raise ValueError(f"Unsupported file version: {version}")
+        def take(size):
+            data = _read_exact(f, size)
+            if len(data) != size:
+                raise ValueError(MSG_TRUNCATED_FILE)
+            header.extend(data)
+            return data
 
-            # Read mode
-            mode = f.read(HEADER_MODE_SIZE)[0]
+        # Read magic bytes
+        magic = _read_exact(f, HEADER_MAGIC_SIZE)
+        if magic != MAGIC_BYTES:
+            raise ValueError("Not a valid encrypted file")
+        header.extend(magic)
 
-            # Read salt
-            salt = f.read(HEADER_SALT_SIZE)
-            if mode != MODE_PASSWORD:
-                salt = None
+        # Read version
+        version = take(HEADER_VERSION_SIZE)[0]
+        if version not in SUPPORTED_FILE_VERSIONS:
+            raise ValueError(f"Unsupported file version: {version}")
 
-            # Read compressed flag
-            is_compressed = f.read(HEADER_COMPRESSED_SIZE)[0] == 1
+        # Read mode
+        mode = take(HEADER_MODE_SIZE)[0]
 
-            # Read original filename
-            filename_length = struct.unpack('>H', f.read(HEADER_FILENAME_LENGTH_SIZE))[0]
-            original_filename = f.read(filename_length).decode('utf-8')
+        # Read salt
+        salt = take(HEADER_SALT_SIZE)
+        if mode != MODE_PASSWORD:
+            salt = None
 
-            # Read encrypted data
-            encrypted_data = f.read()
+        # Read payload type (compressed flag in version 1)
+        payload_type = take(HEADER_COMPRESSED_SIZE)[0]
 
-        return {
+        # Read original filename
+        filename_length = struct.unpack('>H', take(HEADER_FILENAME_LENGTH_SIZE))[0]
+        original_filename = take(filename_length).decode('utf-8')
+
+        result = {
+            'version': version,
             'mode': mode,
             'salt': salt,
-            'is_compressed': is_compressed,
+            'is_compressed': payload_type != PAYLOAD_FILE,
+            'payload_type': payload_type,
             'original_filename': original_filename,
-            'encrypted_data': encrypted_data
+            'cipher': None,
+            'chunk_size': None,
+            'extensions': {}
         }
 
+        if version >= 2:
+            result['cipher'] = take(HEADER_CIPHER_SIZE)[0]
+            result['chunk_size'] = struct.unpack('>I', take(HEADER_CHUNK_SIZE_SIZE))[0]
+            if not 0 < result['chunk_size'] <= MAX_CHUNK_SIZE:
+                raise ValueError(MSG_CORRUPTED_FILE)
+
+            ext_length = struct.unpack('>H', take(HEADER_EXTENSIONS_LENGTH_SIZE))[0]
+            ext = take(ext_length)
+            pos = 0
+            while pos < ext_length:
+                if pos + 3 > ext_length:
+                    raise ValueError(MSG_CORRUPTED_FILE)
+                tag = ext[pos]
+                value_length = struct.unpack_from('>H', ext, pos + 1)[0]
+                pos += 3
+                if pos + value_length > ext_length:
+                    raise ValueError(MSG_CORRUPTED_FILE)
+                result['extensions'][tag] = ext[pos:pos + value_length]
+                pos += value_length
+
+        codec = result['extensions'].get(EXT_CODEC)
+        if codec is not None and len(codec) != 1:
+            raise ValueError(MSG_CORRUPTED_FILE)
+        result['codec'] = codec[0] if codec else CODEC_NONE
+
+        result['header_bytes'] = bytes(header)
+        return result
+
+    @staticmethod
+    def read_file_metadata(filepath):
+        """
+        Parse only the header of an encrypted file.
+
+        Reads HEADER_PROBE_SIZE bytes in one go, and at most MAX_HEADER_SIZE
+        for headers with very long filenames or extensions; the ciphertext is
+        never read.
+
+        Returns:
+            Header dictionary plus data_offset (start of the payload) and file_size
+        """
+        with open(filepath, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            prefix = f.read(HEADER_PROBE_SIZE)
+            try:
+                result = CryptoHandler._read_header(io.BytesIO(prefix))
+            except ValueError as e:
+                if str(e) != MSG_TRUNCATED_FILE or len(prefix) < HEADER_PROBE_SIZE:
+                    raise
+                prefix += f.read(MAX_HEADER_SIZE - len(prefix))
+                result = CryptoHandler._read_header(io.BytesIO(prefix))
+
+        result['data_offset'] = len(result['header_bytes'])
+        result['file_size'] = file_size
+        return result
+
+    @staticmethod
+    def open_payload(filepath, metadata):
+        """Open an encrypted file positioned at its payload (after the header)."""
+        f = open(filepath, 'rb')
+        f.seek(metadata['data_offset'])
+        return f
+
+    @staticmethod
+    def parse_file_header(filepath):
+        """
+        Parse header from encrypted file.
+
+        The header is parsed eagerly; 'encrypted_data' is only read from disk
+        when that key is first accessed.
+        """
+        return _LazyHeader(filepath, CryptoHandler.read_file_metadata(filepath))
+
+    @staticmethod
+    def inspect(paths, max_workers=INSPECT_WORKERS):
+        """
+        Read the metadata of many encrypted files concurrently.
+
+        Args:
+            paths: Iterable of .locked file paths
+            max_workers: Threads reading headers in parallel
+
+        Returns:
+            List in input order of dicts with 'path' and either 'metadata'
+            (see read_file_metadata) or 'error'
+        """
+        def inspect_one(path):
+            try:
+                return {'path': path, 'metadata': CryptoHandler.read_file_metadata(path)}
+            except (OSError, ValueError, UnicodeDecodeError) as e:
+                return {'path': path, 'error': str(e)}
+
+        paths = list(paths)
+        if max_workers <= 1 or len(paths) <= 1:
+            return [inspect_one(path) for path in paths]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(inspect_one, paths))
+
+    @staticmethod
+    def _get_chunk_cipher(cipher, key, header_bytes):
+        """Create the chunk cipher recorded in a version 2 header."""
+        if cipher == CIPHER_FERNET:
+            return _FernetChunkCipher(key, header_bytes)
+        if cipher == CIPHER_AES_GCM:
+            return _AEADChunkCipher(AESGCM, key, header_bytes)
+        if cipher == CIPHER_CHACHA20_POLY1305:
+            return _AEADChunkCipher(ChaCha20Poly1305, key, header_bytes)
+        raise ValueError(f"Unsupported cipher: {cipher}")
+
     @staticmethod
     def encrypt_data(data, key):
         """Encrypt data using Fernet."""
@@ -142,7 +1083,507 @@ class CryptoHandler:
             raise ValueError("Decryption failed: Invalid key or corrupted data")
 
     @staticmethod
-    def encrypt_file(input_path, output_path, mode, password=None, key=None, is_compressed=False):
+    def _resolve_master_key(header_data, password, key, key_cache, metrics=None):
+        """Return the password-derived or key file key for header_data, before any per-file subkey."""
+        if header_data['mode'] == MODE_PASSWORD:
+            if not password:
+                raise ValueError("Password required to decrypt this file")
+            with timed_stage(metrics, STAGE_KDF):
+                key = CryptoHandler.derive_key_cached(password, header_data['salt'], key_cache)
+        elif header_data['mode'] == MODE_KEYFILE:
+            if not key:
+                raise ValueError("Key file required to decrypt this file")
+        return key
+
+    @staticmethod
+    def _file_key(header_data, master_key):
+        """Batch session files use a per-file subkey of the derived key."""
+        nonce = header_data['extensions'].get(EXT_KEY_NONCE)
+        if nonce is not None:
+            return CryptoHandler.derive_file_subkey(master_key, nonce)
+        return master_key
+
+    @staticmethod
+    def _resolve_key(header_data, password, key, key_cache):
+        """Return the key that decrypts the file described by header_data."""
+        return CryptoHandler._file_key(
+            header_data, CryptoHandler._resolve_master_key(header_data, password, key, key_cache)
+        )
+
+    @staticmethod
+    def _prepare_key(mode, password, key, session_key, metrics=None):
+        """Return (key, salt, header extensions) for a new encrypted file."""
+        salt = None
+        extensions = {}
+        if mode == MODE_PASSWORD:
+            if session_key is not None:
+                master_key, salt = session_key
+                nonce = os.urandom(KEY_NONCE_SIZE)
+                key = CryptoHandler.derive_file_subkey(master_key, nonce)
+                extensions[EXT_KEY_NONCE] = nonce
+            elif not password:
+                raise ValueError("Password required for password mode")
+            else:
+                with timed_stage(metrics, STAGE_KDF):
+                    key, salt = CryptoHandler.derive_key_from_password(password)
+        elif mode == MODE_KEYFILE:
+            if not key:
+                raise ValueError("Key required for key file mode")
+        else:
+            raise ValueError("Invalid encryption mode")
+        return key, salt, extensions
+
+    @staticmethod
+    def open_encrypt_stream(writer, mode, original_filename='', password=None, key=None,
+                            payload_type=PAYLOAD_FILE, cipher=DEFAULT_CIPHER, session_key=None,
+                            codec=CODEC_NONE, workers=1, size_hint=None, chunk_size=CHUNK_SIZE,
+                            output_path=None, chunk_index=True, extensions=None, metrics=None,
+                            progress=None, temp_path=None, fsync=False):
+        """
+        Wrap a writable binary stream so that everything written to it is encrypted.
+
+        The output is written strictly sequentially, so pipes and sockets work.
+        Use it as a context manager: a clean exit seals the final chunk, an
+        exception leaves the output without one so it cannot pass as complete.
+
+        Args:
+            writer: Writable binary file object; left open unless output_path is set
+            mode: MODE_PASSWORD or MODE_KEYFILE
+            original_filename: Name restored on decryption
+            password: Password (if mode is MODE_PASSWORD)
+            key: Encryption key (if mode is MODE_KEYFILE)
+            payload_type: PAYLOAD_* value recorded in the header
+            cipher: Chunk cipher id (CIPHER_*)
+            session_key: Optional batch session key (see encrypt_file)
+            codec: Compression codec (CODEC_*) applied to chunks before sealing;
+                CODEC_AUTO picks the fastest available one
+            workers: Cipher worker threads for sealing chunks
+            size_hint: Expected plaintext size; used to preallocate the output
+            chunk_size: Plaintext bytes per chunk (at most MAX_CHUNK_SIZE)
+            output_path: Path of the file behind writer; it is then closed with
+                the stream and deleted on abort
+            temp_path: With output_path, the temporary file behind writer; it
+                is renamed to output_path on a clean close instead
+            fsync: With temp_path, flush the data to disk before the rename
+                and the directory entry after it
+            chunk_index: Append a chunk index footer so the file supports
+                random access (see open_random_access)
+            extensions: Extra header extensions ({EXT_* tag: bytes})
+            metrics: Optional Metrics to record key derivation and chunk work in
+            progress: Optional callable taking a byte count, called with the
+                plaintext size of every chunk once it is sealed
+
+        Returns:
+            EncryptingWriter
+        """
+        if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise ValueError(f"Chunk size must be between 1 and {MAX_CHUNK_SIZE} bytes")
+
+        key, salt, key_extensions = CryptoHandler._prepare_key(mode, password, key, session_key, metrics)
+        extensions = {**(extensions or {}), **key_extensions}
+
+        codec = select_codec(codec)
+        if codec != CODEC_NONE:
+            extensions[EXT_CODEC] = bytes([codec])
+        if chunk_index:
+            extensions[EXT_CHUNK_INDEX] = b''
+
+        # Create header
+        header = CryptoHandler.create_file_header(
+            mode, salt or b'', payload_type != PAYLOAD_FILE, original_filename,
+            cipher=cipher, chunk_size=chunk_size, extensions=extensions, payload_type=payload_type
+        )
+        chunk_cipher = CryptoHandler._get_chunk_cipher(cipher, key, header)
+
+        # Binary AEAD output size is known up to a constant per chunk
+        preallocated = False
+        if size_hint and cipher != CIPHER_FERNET:
+            chunks = size_hint // chunk_size + 1
+            overhead = FRAME_HEADER_SIZE + AEAD_NONCE_SIZE + AEAD_TAG_SIZE + CHUNK_INDEX_ENTRY_SIZE
+            preallocated = _preallocate(writer, len(header) + size_hint + chunks * overhead + FOOTER_SIZE)
+
+        return EncryptingWriter(
+            writer, header, chunk_cipher, chunk_size,
+            output_path=output_path, codec=get_codec(codec), workers=workers,
+            preallocated=preallocated, chunk_index=chunk_index, metrics=metrics, progress=progress,
+            temp_path=temp_path, fsync=fsync
+        )
+
+    @staticmethod
+    def open_encrypt_writer(output_path, mode, original_filename, password=None, key=None,
+                            payload_type=PAYLOAD_FILE, cipher=DEFAULT_CIPHER, session_key=None,
+                            codec=CODEC_NONE, workers=1, size_hint=None, chunk_size=CHUNK_SIZE,
+                            extensions=None, metrics=None, progress=None, fsync=True):
+        """
+        Open an encrypted output file as a writable stream.
+
+        Same as open_encrypt_stream, except that the output is written to a
+        temporary file next to output_path and renamed over it on a clean
+        close, so output_path never holds a partial file; an exception
+        deletes the temporary file. With fsync, the data is on disk before
+        the rename (see durability.replace_durably).
+
+        Returns:
+            EncryptingWriter
+        """
+        raw, temp_path = open_temp_sibling(output_path)
+        try:
+            return CryptoHandler.open_encrypt_stream(
+                raw, mode, original_filename, password=password, key=key,
+                payload_type=payload_type, cipher=cipher, session_key=session_key,
+                codec=codec, workers=workers, size_hint=size_hint, chunk_size=chunk_size,
+                output_path=output_path, extensions=extensions, metrics=metrics, progress=progress,
+                temp_path=temp_path, fsync=fsync
+            )
+        except Exception:
+            raw.close()
+            remove_temp(temp_path)
+            raise
+
+    @staticmethod
+    def encrypt_stream(reader, writer, mode, password=None, key=None, original_filename='',
+                       cipher=DEFAULT_CIPHER, session_key=None, codec=CODEC_AUTO, workers=1,
+                       chunk_size=CHUNK_SIZE):
+        """
+        Encrypt everything from a readable binary stream into a writable one.
+
+        Neither stream needs to be seekable, and memory use is bounded by the
+        chunk size and worker count, so this works between pipes.
+
+        Args:
+            reader: Readable binary file object with the plaintext
+            writer: Writable binary file object for the encrypted output (not closed)
+            original_filename: Name restored by decrypt_file; also used, with a
+                sample of the data, to decide whether compression pays off
+
+        Other arguments are as for encrypt_file.
+
+        Returns:
+            Dictionary with bytes_in, bytes_out, seconds and throughput_mbps
+        """
+        first = _read_exact(reader, chunk_size)
+        if codec != CODEC_NONE:
+            codec = select_codec(codec, path=original_filename or None, sample=first[:COMPRESSION_SAMPLE_SIZE])
+
+        with CryptoHandler.open_encrypt_stream(
+            writer, mode, original_filename, password=password, key=key, cipher=cipher,
+            session_key=session_key, codec=codec, workers=workers, chunk_size=chunk_size
+        ) as stream:
+            stream.write(first)
+            if len(first) == chunk_size:
+                if workers > 1:
+                    for block in _read_ahead(reader, chunk_size, workers * PIPELINE_DEPTH):
+                        stream.write(block)
+                else:
+                    shutil.copyfileobj(reader, stream, chunk_size)
+        writer.flush()
+        return stream.stats()
+
+    @staticmethod
+    def _open_decrypting_reader(raw, header_data, password, key, key_cache, workers, owns_raw,
+                                chunk_store=None, metrics=None, progress=None):
+        """Resolve the key for a parsed header and wrap raw (positioned at the payload)."""
+        master_key = CryptoHandler._resolve_master_key(header_data, password, key, key_cache, metrics)
+        key = CryptoHandler._file_key(header_data, master_key)
+
+        if header_data['version'] == LEGACY_FILE_VERSION:
+            # Version 1 files are a single Fernet token
+            plaintext = CryptoHandler.decrypt_data(bytes(raw.read()), key)
+            return DecryptingReader(raw, header_data, None, plaintext=plaintext, owns_raw=owns_raw)
+
+        chunk_cipher = CryptoHandler._get_chunk_cipher(
+            header_data['cipher'], key, header_data['header_bytes']
+        )
+        store_id = header_data['extensions'].get(EXT_CHUNK_STORE)
+        # For recipe files the chunk store reader does the measuring
+        reader = DecryptingReader(
+            raw, header_data, chunk_cipher, owns_raw=owns_raw, workers=workers,
+            metrics=metrics if store_id is None else None, progress=progress
+        )
+        if store_id is None:
+            return reader
+        try:
+            if chunk_store is None:
+                chunk_store = ChunkStore(create=False)
+            if chunk_store.store_id != store_id:
+                raise ValueError(f"File was encrypted into a different chunk store than {chunk_store.root}")
+            # The decrypted payload is a recipe; the store key is the key before any per-file subkey
+            return ChunkStoreReader(reader, chunk_store, master_key, metrics)
+        except Exception:
+            reader.close()
+            raise
+
+    @staticmethod
+    def open_decrypt_stream(reader, password=None, key=None, key_cache=None, workers=1, chunk_store=None):
+        """
+        Wrap a readable binary stream of encrypted data as a stream of plaintext.
+
+        The input is read strictly sequentially, so pipes work. The returned
+        reader does not close the underlying stream.
+
+        Returns:
+            DecryptingReader (ChunkStoreReader for recipe files); its header
+            attribute holds the parsed header
+        """
+        header_data = CryptoHandler._read_header(reader)
+        return CryptoHandler._open_decrypting_reader(
+            reader, header_data, password, key, key_cache, workers, owns_raw=False, chunk_store=chunk_store
+        )
+
+    @staticmethod
+    def open_decrypt_reader(input_path, password=None, key=None, key_cache=None, workers=1, chunk_store=None,
+                            metrics=None, progress=None):
+        """
+        Open an encrypted file as a readable stream of plaintext.
+
+        Args:
+            input_path: Path to encrypted file
+            password: Password (if file was encrypted with password)
+            key: Encryption key (if file was encrypted with key)
+            key_cache: Optional DerivedKeyCache to reuse password-derived keys
+            workers: Cipher worker threads for opening chunks
+            chunk_store: ChunkStore holding the chunks of a recipe file; the
+                default store at CHUNK_STORE_PATH is opened if needed
+            metrics: Optional Metrics to record key derivation and chunk work in
+            progress: Optional callable taking a byte count, called with the
+                size of every frame read from input_path (for recipe files,
+                frames of the recipe)
+
+        Returns:
+            DecryptingReader (ChunkStoreReader for recipe files); its header
+            attribute holds the parsed header
+        """
+        CryptoHandler._check_no_append(input_path)
+        raw = open(input_path, 'rb')
+        try:
+            # Parse header
+            header_data = CryptoHandler._read_header(raw)
+
+            # Read frames as zero-copy slices of a memory map when possible
+            if header_data['version'] != LEGACY_FILE_VERSION:
+                mm = _map_input(raw)
+                if mm is not None:
+                    raw = _MappedReader(raw, mm, raw.tell())
+
+            return CryptoHandler._open_decrypting_reader(
+                raw, header_data, password, key, key_cache, workers, owns_raw=True, chunk_store=chunk_store,
+                metrics=metrics, progress=progress
+            )
+        except Exception:
+            raw.close()
+            raise
+
+    @staticmethod
+    def decrypt_stream(reader, writer, password=None, key=None, key_cache=None, workers=1, chunk_store=None):
+        """
+        Decrypt a readable binary stream into a writable one.
+
+        Unlike decrypt_file, the output name stored in the header is not used;
+        it is returned for the caller to act on. Neither stream needs to be
+        seekable, and the writer is not closed. Nothing written can be trusted
+        unless this returns: an error raised part-way means the input was
+        tampered with or truncated.
+
+        Returns:
+            Dictionary with original_filename, is_compressed, payload_type,
+            bytes, seconds and throughput_mbps
+        """
+        started = time.perf_counter()
+        nbytes = 0
+        with CryptoHandler.open_decrypt_stream(reader, password, key, key_cache, workers, chunk_store) as plain:
+            header_data = plain.header
+            while True:
+                chunk = plain.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                nbytes += len(chunk)
+        writer.flush()
+        seconds = time.perf_counter() - started
+
+        return {
+            'original_filename': header_data['original_filename'],
+            'is_compressed': header_data['is_compressed'],
+            'payload_type': header_data['payload_type'],
+            'bytes': nbytes,
+            'seconds': seconds,
+            'throughput_mbps': _throughput(nbytes, seconds)
+        }
+
+    @staticmethod
+    def open_random_access(input_path, password=None, key=None, key_cache=None):
+        """
+        Open an encrypted file as a seekable, read-only plaintext file object.
+
+        Returns:
+            RandomAccessReader; its size attribute is the plaintext size
+        """
+        CryptoHandler._check_no_append(input_path)
+        raw = open(input_path, 'rb')
+        try:
+            header_data = CryptoHandler._read_header(raw)
+            if header_data['version'] == LEGACY_FILE_VERSION:
+                raise ValueError("Random access needs a version 2 file; re-encrypt it first")
+            if EXT_CHUNK_STORE in header_data['extensions']:
+                raise ValueError("Random access is not supported for files kept in a chunk store")
+
+            key = CryptoHandler._resolve_key(header_data, password, key, key_cache)
+            chunk_cipher = CryptoHandler._get_chunk_cipher(
+                header_data['cipher'], key, header_data['header_bytes']
+            )
+            return RandomAccessReader(raw, header_data, chunk_cipher)
+        except Exception:
+            raw.close()
+            raise
+
+    @staticmethod
+    def open_append_writer(input_path, password=None, key=None, key_cache=None, workers=1):
+        """
+        Reopen an encrypted file with a chunk index to append plaintext to it.
+
+        The final chunk is decrypted and re-sealed as an ordinary chunk,
+        followed by whatever is written; everything before it is left
+        untouched, so the cost is proportional to the appended data. The
+        header (and with it the key, cipher, codec and chunk size) is kept.
+        Use it as a context manager: an exception restores the original file.
+
+        The bytes overwritten in place are first saved, and synced, to a
+        backup next to the file (APPEND_BACKUP_SUFFIX). The appended data is
+        always synced before the backup is removed, so if a crash interrupts
+        the append, the next append rolls it back; until then the file
+        cannot be read. The file is locked while the writer is open, so an
+        append still running elsewhere is never rolled back.
+
+        Returns:
+            EncryptingWriter; plaintext offsets continue from the old size
+        """
+        backup_path = input_path + APPEND_BACKUP_SUFFIX
+        raw = open(input_path, 'r+b')
+        backed_up = False
+        try:
+            CryptoHandler._lock_for_append(raw)
+            CryptoHandler._restore_backup(raw, backup_path)
+
+            with CryptoHandler.open_random_access(input_path, password, key, key_cache) as reader:
+                header_data = reader.header
+                if EXT_CHUNK_INDEX not in header_data['extensions']:
+                    raise ValueError("Only files with a chunk index can be appended to")
+                last = len(reader._offsets) - 1
+                tail = reader._chunk(last)
+                tail_offset = reader._offsets[last]
+                index_entries = b''.join(
+                    _INDEX_ENTRY.pack(offset, length)
+                    for offset, length in zip(reader._offsets[:last], reader._lengths[:last])
+                )
+                chunk_cipher = reader._cipher
+
+            raw.seek(tail_offset)
+            saved_tail = raw.read()
+            backup, temp_path = open_temp_sibling(backup_path)
+            try:
+                backup.write(_APPEND_BACKUP.pack(APPEND_BACKUP_MAGIC, tail_offset))
+                backup.write(saved_tail)
+                replace_durably(temp_path, backup_path, backup)
+            except BaseException:
+                backup.close()
+                remove_temp(temp_path)
+                raise
+            backed_up = True
+            raw.seek(tail_offset)
+            raw.truncate()
+        except Exception:
+            raw.close()
+            if backed_up:
+                os.remove(backup_path)
+            raise
+
+        writer = _AppendingWriter(
+            raw, header_data['header_bytes'], chunk_cipher, header_data['chunk_size'],
+            get_codec(header_data['codec']), workers, (last, tail_offset, index_entries), saved_tail, backup_path
+        )
+        try:
+            writer.write(tail)
+        except Exception:
+            writer.abort()
+            raise
+        return writer
+
+    @staticmethod
+    def recover_append(input_path):
+        """
+        Roll back an append to input_path that a crash interrupted.
+
+        open_append_writer does this itself; a file without an append backup
+        is left alone.
+
+        Returns:
+            True if an interrupted append was rolled back
+
+        Raises:
+            ValueError: The append is still running in another process
+        """
+        backup_path = input_path + APPEND_BACKUP_SUFFIX
+        if not os.path.exists(backup_path):
+            return False
+        with open(input_path, 'r+b') as raw:
+            CryptoHandler._lock_for_append(raw)
+            return CryptoHandler._restore_backup(raw, backup_path)
+
+    @staticmethod
+    def _lock_for_append(raw):
+        try:
+            lock_exclusive(raw)
+        except OSError:
+            raise ValueError(MSG_FILE_BUSY)
+
+    @staticmethod
+    def _restore_backup(raw, backup_path):
+        """Put back the tail saved at backup_path into raw, which the caller has locked."""
+        try:
+            with open(backup_path, 'rb') as f:
+                backup = f.read()
+        except FileNotFoundError:
+            return False
+        if len(backup) < _APPEND_BACKUP.size:
+            raise ValueError(MSG_CORRUPTED_FILE)
+        magic, tail_offset = _APPEND_BACKUP.unpack_from(backup)
+        if magic != APPEND_BACKUP_MAGIC:
+            raise ValueError(MSG_CORRUPTED_FILE)
+        _restore_tail(raw, tail_offset, backup[_APPEND_BACKUP.size:])
+        os.remove(backup_path)
+        fsync_path(os.path.dirname(os.path.abspath(backup_path)))
+        return True
+
+    @staticmethod
+    def _check_no_append(input_path):
+        """Refuse to read a file whose append is running or was interrupted (it may be truncated)."""
+        if os.path.exists(input_path + APPEND_BACKUP_SUFFIX):
+            raise ValueError(MSG_APPEND_PENDING)
+
+    @staticmethod
+    def read_range(input_path, offset, length, password=None, key=None, key_cache=None):
+        """
+        Decrypt length plaintext bytes starting at offset, touching only the chunks needed.
+
+        Returns:
+            bytes (shorter than length if the range runs past the end)
+        """
+        with CryptoHandler.open_random_access(input_path, password, key, key_cache) as f:
+            f.seek(offset)
+            return f.read(length)
+
+    @staticmethod
+    def resolve_chunk_workers(input_path, workers):
+        """Resolve workers=None to a worker count suited to the file size."""
+        if workers is not None:
+            return max(1, workers)
+        return CHUNK_WORKERS if os.path.getsize(input_path) >= PARALLEL_MIN_SIZE else 1
+
+    @staticmethod
+    def encrypt_file(input_path, output_path, mode, password=None, key=None, is_compressed=False,
+                     cipher=DEFAULT_CIPHER, session_key=None, codec=CODEC_AUTO, workers=None,
+                     chunk_size=CHUNK_SIZE, chunk_store=None, key_cache=None, metrics=None, progress=None,
+                     fsync=True):
         """
         Encrypt a file.
 
@@ -153,37 +1594,141 @@ class CryptoHandler:
             password: Password (if mode is MODE_PASSWORD)
             key: Encryption key (if mode is MODE_KEYFILE)
             is_compressed: Whether the input is a compressed folder
+            cipher: Chunk cipher id (CIPHER_*)
+            session_key: Optional (master_key, salt) from derive_key_from_password,
+                shared by a batch; the file then gets an HKDF subkey from a random
+                per-file nonce instead of running PBKDF2 again
+            codec: Compression codec (CODEC_*); skipped for data that looks
+                incompressible (by extension or sampled entropy)
+            workers: Cipher worker threads; None uses CHUNK_WORKERS for files of
+                at least PARALLEL_MIN_SIZE bytes and one thread otherwise
+            chunk_size: Plaintext bytes per chunk
+            chunk_store: Optional ChunkStore; the data is then split into
+                content-defined chunks kept in the store, and output_path only
+                holds the recipe (see encrypt_to_store)
+            key_cache: Optional DerivedKeyCache for the store key in password mode
+            metrics: Optional Metrics; key derivation, reads (unless the input is
+                memory-mapped, where page faults count as cipher time),
+                compression, sealing and writes are timed into it
+            progress: Optional callable taking a byte count, called as input
+                bytes are encrypted (at most a chunk at a time); the counts
+                add up to the input size
+            fsync: Flush the output to disk before it replaces output_path;
+                without it the output is still only renamed into place once
+                complete, but may not survive a power cut
+
+        Returns:
+            Dictionary with bytes_in, bytes_out, seconds and throughput_mbps
         """
-        # Read input file
-        with open(input_path, 'rb') as f:
-            plaintext = f.read()
+        if chunk_store is not None:
+            return CryptoHandler.encrypt_to_store(
+                input_path, output_path, chunk_store, mode, password=password, key=key,
+                cipher=cipher, codec=codec, key_cache=key_cache, metrics=metrics, progress=progress,
+                fsync=fsync
+            )
 
-        # Get encryption key
-        salt = None
+        workers = CryptoHandler.resolve_chunk_workers(input_path, workers)
+
+        with open(input_path, 'rb') as reader:
+            size = os.fstat(reader.fileno()).st_size
+            mm = _map_input(reader)
+            try:
+                if codec != CODEC_NONE:
+                    sample = mm[:COMPRESSION_SAMPLE_SIZE] if mm is not None else reader.read(COMPRESSION_SAMPLE_SIZE)
+                    reader.seek(0)
+                    codec = select_codec(codec, path=input_path, sample=sample)
+
+                with CryptoHandler.open_encrypt_writer(
+                    output_path,
+                    mode,
+                    os.path.basename(input_path),
+                    password=password,
+                    key=key,
+                    payload_type=PAYLOAD_ZIP if is_compressed else PAYLOAD_FILE,
+                    cipher=cipher,
+                    session_key=session_key,
+                    codec=codec,
+                    workers=workers,
+                    size_hint=size,
+                    chunk_size=chunk_size,
+                    metrics=metrics,
+                    progress=progress,
+                    fsync=fsync
+                ) as writer:
+                    source = timed_io(reader, metrics, STAGE_READ)
+                    if mm is not None:
+                        # Seal straight out of the page cache, no read() copies
+                        with memoryview(mm) as view:
+                            writer.write_buffer(view)
+                    elif workers > 1:
+                        # Pipeline: reader thread -> cipher workers -> ordered writer
+                        for block in _read_ahead(source, chunk_size, workers * PIPELINE_DEPTH):
+                            writer.write(block)
+                    else:
+                        shutil.copyfileobj(source, writer, chunk_size)
+            finally:
+                if mm is not None:
+                    _close_map(mm)
+
+        return writer.stats()
+
+    @staticmethod
+    def encrypt_to_store(input_path, output_path, chunk_store, mode, password=None, key=None,
+                         cipher=DEFAULT_CIPHER, codec=CODEC_AUTO, key_cache=None, metrics=None, progress=None,
+                         fsync=True):
+        """
+        Encrypt a file into a deduplicating ChunkStore.
+
+        Each distinct content-defined chunk is compressed and encrypted once
+        with a convergent key; chunks already in the store are only
+        referenced. output_path gets an ordinary encrypted file whose payload
+        is the recipe (chunk hashes and lengths) and whose header records the
+        store id. The store key is the key file key, or in password mode the
+        key derived from the password and the store salt, so only files
+        encrypted with the same key file or password share chunks. Password
+        files then use a per-file subkey of that key, like batch session keys.
+
+        Returns:
+            Dictionary with bytes_in, bytes_out (recipe plus new chunk bytes),
+            chunks, new_chunks, seconds and throughput_mbps
+        """
+        started = time.perf_counter()
+        session_key = None
+        store_key = key
         if mode == MODE_PASSWORD:
             if not password:
                 raise ValueError("Password required for password mode")
-            key, salt = CryptoHandler.derive_key_from_password(password)
-        elif mode == MODE_KEYFILE:
-            if not key:
-                raise ValueError("Key required for key file mode")
-        else:
-            raise ValueError("Invalid encryption mode")
+            with timed_stage(metrics, STAGE_KDF):
+                store_key = CryptoHandler.derive_key_cached(password, chunk_store.salt, key_cache)
+            session_key = (store_key, chunk_store.salt)
 
-        # Encrypt data
-        encrypted_data = CryptoHandler.encrypt_data(plaintext, key)
+        with open(input_path, 'rb') as reader:
+            if codec != CODEC_NONE:
+                codec = select_codec(codec, path=input_path, sample=reader.read(COMPRESSION_SAMPLE_SIZE))
+                reader.seek(0)
 
-        # Create header
-        original_filename = os.path.basename(input_path)
-        header = CryptoHandler.create_file_header(mode, salt or b'', is_compressed, original_filename)
+            with CryptoHandler.open_encrypt_writer(
+                output_path, mode, os.path.basename(input_path), password=password, key=key,
+                cipher=cipher, session_key=session_key, codec=CODEC_NONE,
+                extensions={EXT_CHUNK_STORE: chunk_store.store_id}, fsync=fsync
+            ) as writer:
+                stats = chunk_store.write_recipe(
+                    timed_io(reader, metrics, STAGE_READ), writer, store_key, get_codec(codec), metrics, progress
+                )
 
-        # Write to output file
-        with open(output_path, 'wb') as f:
-            f.write(header)
-            f.write(encrypted_data)
+        seconds = time.perf_counter() - started
+        return {
+            'bytes_in': stats['bytes_in'],
+            'bytes_out': writer.bytes_out + stats['bytes_stored'],
+            'chunks': stats['chunks'],
+            'new_chunks': stats['new_chunks'],
+            'seconds': seconds,
+            'throughput_mbps': _throughput(stats['bytes_in'], seconds)
+        }
 
     @staticmethod
-    def decrypt_file(input_path, output_dir, password=None, key=None):
+    def decrypt_file(input_path, output_dir, password=None, key=None, key_cache=None, workers=None,
+                     chunk_store=None, metrics=None, progress=None, fsync=True):
         """
         Decrypt a file.
 
@@ -192,24 +1737,38 @@ class CryptoHandler:
             output_dir: Directory for decrypted output
             password: Password (if file was encrypted with password)
             key: Encryption key (if file was encrypted with key)
+            key_cache: Optional DerivedKeyCache to reuse password-derived keys
+            workers: Cipher worker threads (None chooses by file size, see encrypt_file)
+            chunk_store: ChunkStore for recipe files (see open_decrypt_reader)
+            metrics: Optional Metrics to record key derivation, reads,
+                decryption and writes in
+            progress: Optional callable taking a byte count, called as the
+                encrypted input is read (see open_decrypt_reader)
+            fsync: Flush the output to disk before it is renamed into place
+                (see save_decrypted)
 
         Returns:
             Dictionary with decryption results including output path and whether it was compressed
         """
-        # Parse header
-        header_data = CryptoHandler.parse_file_header(input_path)
+        workers = CryptoHandler.resolve_chunk_workers(input_path, workers)
+        with CryptoHandler.open_decrypt_reader(
+            input_path, password, key, key_cache, workers, chunk_store, metrics, progress
+        ) as reader:
+            return CryptoHandler.save_decrypted(reader, output_dir, metrics, fsync)
 
-        # Get decryption key
-        if header_data['mode'] == MODE_PASSWORD:
-            if not password:
-                raise ValueError("Password required to decrypt this file")
-            key, _ = CryptoHandler.derive_key_from_password(password, header_data['salt'])
-        elif header_data['mode'] == MODE_KEYFILE:
-            if not key:
-                raise ValueError("Key file required to decrypt this file")
+    @staticmethod
+    def save_decrypted(reader, output_dir, metrics=None, fsync=True):
+        """
+        Write the plaintext of an open DecryptingReader into output_dir.
 
-        # Decrypt data
-        decrypted_data = CryptoHandler.decrypt_data(header_data['encrypted_data'], key)
+        The plaintext goes to a temporary file that is renamed to the output
+        name only once it decrypted completely (after an fsync if fsync), so
+        a failure or crash never leaves a partial file under that name.
+
+        Returns:
+            Dictionary with decryption results including output path and whether it was compressed
+        """
+        header_data = reader.header
 
         # Write to output file
         output_path = os.path.join(output_dir, header_data['original_filename'])
@@ -222,11 +1781,25 @@ class CryptoHandler:
                 output_path = f"{base}_{counter}{ext}"
                 counter += 1
 
-        with open(output_path, 'wb') as f:
-            f.write(decrypted_data)
+        started = time.perf_counter()
+        writer, temp_path = open_temp_sibling(output_path)
+        try:
+            shutil.copyfileobj(reader, timed_io(writer, metrics, STAGE_WRITE), CHUNK_SIZE)
+            nbytes = writer.tell()
+            replace_durably(temp_path, output_path, writer, fsync)
+        except BaseException:
+            # Never leave a partially decrypted file behind
+            writer.close()
+            remove_temp(temp_path)
+            raise
+        seconds = time.perf_counter() - started
 
         return {
             'output_path': output_path,
             'is_compressed': header_data['is_compressed'],
-            'original_filename': header_data['original_filename']
+            'payload_type': header_data['payload_type'],
+            'original_filename': header_data['original_filename'],
+            'bytes': nbytes,
+            'seconds': seconds,
+            'throughput_mbps': _throughput(nbytes, seconds)
         }
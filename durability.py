@@ -0,0 +1,178 @@
+"""
+Atomic, durable output files.
+
+Outputs are written to a temporary sibling and renamed over the final name
+only once complete, so a crash never leaves a truncated file under that
+name. Whether data is also forced to disk, per file or per group of files, is
+the durability policy (DURABILITY_* in config).
+
+Incremental archive updates are the exception: they append to the existing
+file in place. That path keeps its own synced backup of the bytes it
+overwrites and rolls an interrupted append back before the next update
+(see CryptoHandler.open_append_writer), so it is always synced regardless
+of the policy.
+"""
+
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from config import *
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Windows byte-range locks are mandatory; locking one byte far past any data keeps readers unaffected
+_LOCK_OFFSET = 1 << 62
+
+
+def temp_sibling(path):
+    """Unused temporary name in the same directory as path (so a rename stays atomic)."""
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f"{TEMP_FILE_PREFIX}{os.urandom(6).hex()}_{name}")
+
+
+def open_temp_sibling(path):
+    """
+    Create a temporary sibling of path for writing.
+
+    Returns:
+        (binary file object, temporary path)
+    """
+    temp_path = temp_sibling(path)
+    return open(temp_path, 'xb'), temp_path
+
+
+def fsync_path(path):
+    """Flush one file or directory entry to disk."""
+    if os.path.isdir(path):
+        if os.name == 'nt':
+            # Directories cannot be opened on Windows; NTFS journals metadata itself
+            return
+        fd = os.open(path, os.O_RDONLY)
+    else:
+        # FlushFileBuffers needs write access on Windows
+        fd = os.open(path, os.O_RDWR if os.name == 'nt' else os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_tree(path, parent=True):
+    """Flush a file, or a folder with everything below it, and (if parent) its directory to disk."""
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            for name in files + dirs:
+                fsync_path(os.path.join(root, name))
+    fsync_path(path)
+    if parent:
+        fsync_path(os.path.dirname(os.path.abspath(path)))
+
+
+def replace_durably(temp_path, path, fileobj=None, fsync=True):
+    """
+    Move a finished temporary file (or folder) over path.
+
+    With fsync, its data is flushed before the rename and the directory
+    entry after it, so path holds either the old or the complete new
+    content after a crash. fileobj, if given, is the open temporary file;
+    it is flushed and closed first.
+    """
+    if fileobj is not None:
+        fileobj.flush()
+        if fsync:
+            os.fsync(fileobj.fileno())
+        fileobj.close()
+    elif fsync:
+        fsync_tree(temp_path, parent=False)
+    os.replace(temp_path, path)
+    if fsync:
+        fsync_path(os.path.dirname(os.path.abspath(path)))
+
+
+def lock_exclusive(fileobj):
+    """
+    Take an exclusive lock on an open file without waiting for it.
+
+    The lock is held until the file is closed, or its process dies, so a
+    file left locked is one another process is still working on.
+
+    Raises:
+        OSError: Another process holds the lock
+    """
+    if fcntl is not None:
+        fcntl.flock(fileobj.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return
+    position = fileobj.tell()
+    fileobj.seek(_LOCK_OFFSET)
+    try:
+        msvcrt.locking(fileobj.fileno(), msvcrt.LK_NBLCK, 1)
+    finally:
+        fileobj.seek(position)
+
+
+def remove_temp(temp_path):
+    """Delete a temporary file or folder, ignoring one that is already gone."""
+    try:
+        if os.path.isdir(temp_path):
+            shutil.rmtree(temp_path, ignore_errors=True)
+        else:
+            os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+
+
+def remove_temp_siblings(path):
+    """
+    Delete temporary siblings of path, or of the name_1, name_2... variants
+    used when path exists, that a crash left behind.
+
+    Returns:
+        Number of entries removed
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    stem, ext = os.path.splitext(name)
+    pattern = re.compile(
+        re.escape(TEMP_FILE_PREFIX) + r'[0-9a-f]{12}_'
+        + rf"(?:{re.escape(stem)}(?:_\d+)?{re.escape(ext)}|{re.escape(name)}(?:_\d+)?)"
+    )
+    try:
+        with os.scandir(directory) as entries:
+            leftovers = [entry.path for entry in entries if pattern.fullmatch(entry.name)]
+    except OSError:
+        return 0
+    for leftover in leftovers:
+        remove_temp(leftover)
+    return len(leftovers)
+
+
+def group_fsync(paths, workers=GROUP_COMMIT_WORKERS, directories=True):
+    """
+    Flush many outputs to disk in one pass (group commit).
+
+    Files are synced concurrently, which lets the filesystem combine their
+    journal commits, and (if directories) every directory holding an
+    output is synced once afterwards instead of once per file. Temporary
+    files that are renamed into place afterwards skip the directories and
+    sync them after the renames (see sync_directories).
+    """
+    paths = list(paths)
+    if not paths:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(paths)))) as pool:
+        list(pool.map(lambda path: fsync_tree(path, parent=False), paths))
+    if directories:
+        sync_directories(paths, workers)
+
+
+def sync_directories(paths, workers=GROUP_COMMIT_WORKERS):
+    """Flush the directory entries of many paths, syncing each directory once."""
+    directories = {os.path.dirname(os.path.abspath(path)) for path in paths}
+    if not directories:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(directories)))) as pool:
+        list(pool.map(fsync_path, directories))
@@ -0,0 +1,263 @@
+"""
+Persistent on-disk index of files used to answer searches without rescanning.
+"""
+
+import fnmatch
+import os
+import sqlite3
+import threading
+from config import *
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    locked INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files(dir);
+"""
+
+
+def split_pattern(pattern):
+    """
+    Components of a search pattern. A pattern with a directory part, such as
+    'sub/*.txt', has one per level; a plain name pattern has one.
+    """
+    return [part for part in pattern.replace(os.sep, '/').split('/') if part] or [pattern]
+
+
+def match_relative(relative, parts, recursive=True):
+    """
+    Whether a path relative to the search root matches the components of a
+    pattern (see split_pattern), one level each: its last components if
+    recursive, like Path.glob('**/' + pattern), or all of them otherwise.
+    """
+    names = relative.split(os.sep)
+    if len(names) < len(parts) or (not recursive and len(names) != len(parts)):
+        return False
+    return all(fnmatch.fnmatch(name, part) for name, part in zip(names[len(names) - len(parts):], parts))
+
+
+class FileIndex:
+    """
+    SQLite index of paths, sizes, mtimes and encrypted state.
+
+    A directory is only re-listed when its mtime differs from the one seen
+    at the last refresh, so refreshing an unchanged tree costs one stat per
+    directory instead of one per file. Adding, removing or renaming an entry
+    updates its directory's mtime; changes to the contents of an existing
+    file do not, so sizes and mtimes of such files can be stale until their
+    directory changes or is invalidated.
+    """
+
+    def __init__(self, db_path=INDEX_DB_PATH):
+        """
+        Open (or create) an index.
+
+        Args:
+            db_path: SQLite database file, or ':memory:' for a throwaway index
+        """
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def _normalize(path):
+        return os.path.normpath(os.path.abspath(path))
+
+    @staticmethod
+    def _subtree_bounds(directory):
+        """Key range [low, high) covering every path below directory."""
+        prefix = directory if directory.endswith(os.sep) else directory + os.sep
+        return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+    def refresh(self, root, recursive=True, cancel=None):
+        """
+        Bring the index up to date for root (and its subtree if recursive).
+
+        Directories are refreshed and committed INDEX_REFRESH_BATCH at a
+        time, releasing the index in between, so searches and invalidate()
+        from other threads never wait for a whole tree.
+
+        Args:
+            cancel: Optional threading.Event; when set the refresh stops after
+                the current directory, keeping what was refreshed so far
+
+        Returns:
+            Number of directories that had to be re-listed
+        """
+        stack = [self._normalize(root)]
+        rescanned = 0
+        while stack and not (cancel is not None and cancel.is_set()):
+            with self._lock, self._conn:
+                for _ in range(INDEX_REFRESH_BATCH):
+                    if not stack or (cancel is not None and cancel.is_set()):
+                        break
+                    subdirs, relisted = self._refresh_dir(stack.pop())
+                    rescanned += relisted
+                    if recursive:
+                        stack.extend(subdirs)
+        return rescanned
+
+    def _refresh_dir(self, directory):
+        """
+        Re-list one directory if its mtime changed.
+
+        Returns:
+            (its subdirectories, whether it had to be re-listed)
+        """
+        try:
+            # Stat before listing so a change made during the scan is seen next time
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            self._forget_dir(directory)
+            return [], False
+
+        row = self._conn.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (directory,)).fetchone()
+        if row is not None and row[0] == mtime_ns:
+            return [r[0] for r in self._conn.execute("SELECT path FROM dirs WHERE parent = ?", (directory,))], False
+        return self._scan_dir(directory, mtime_ns), True
+
+    def is_warm(self, directory, recursive=True):
+        """
+        Whether a search of directory can be answered from the index promptly.
+
+        True once directory (and, if recursive, every directory below it) was
+        listed by an earlier refresh and not invalidated since, so refreshing
+        it only re-lists what changed. A refresh that was cancelled part-way
+        leaves it cold.
+        """
+        directory = self._normalize(directory)
+        query = "SELECT 1 FROM dirs WHERE mtime_ns IS NULL AND "
+        if recursive:
+            low, high = self._subtree_bounds(directory)
+            query += "(path = ? OR (path >= ? AND path < ?)) LIMIT 1"
+            params = (directory, low, high)
+        else:
+            query += "path = ? LIMIT 1"
+            params = (directory,)
+        with self._lock:
+            listed = self._conn.execute("SELECT 1 FROM dirs WHERE path = ?", (directory,)).fetchone()
+            unlisted = self._conn.execute(query, params).fetchone()
+        return listed is not None and unlisted is None
+
+    def _scan_dir(self, directory, mtime_ns):
+        """Re-list one directory, replacing its file rows. Returns its subdirectories."""
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file():
+                            st = entry.stat()
+                            files.append((entry.path, directory, entry.name, st.st_size, st.st_mtime_ns,
+                                          int(entry.name.endswith(ENCRYPTED_EXTENSION))))
+                    except OSError:
+                        continue
+        except OSError:
+            self._forget_dir(directory)
+            return []
+
+        known = {r[0] for r in self._conn.execute("SELECT path FROM dirs WHERE parent = ?", (directory,))}
+        for gone in known.difference(subdirs):
+            self._forget_dir(gone)
+
+        self._conn.execute("DELETE FROM files WHERE dir = ?", (directory,))
+        self._conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", files)
+        # New subdirectories get a NULL mtime so they are listed on first visit
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, NULL)",
+            [(subdir, directory) for subdir in subdirs]
+        )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)",
+            (directory, os.path.dirname(directory), mtime_ns)
+        )
+        return subdirs
+
+    def _forget_dir(self, directory):
+        """Drop a directory and everything indexed below it."""
+        low, high = self._subtree_bounds(directory)
+        self._conn.execute("DELETE FROM files WHERE dir = ? OR (dir >= ? AND dir < ?)", (directory, low, high))
+        self._conn.execute("DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)", (directory, low, high))
+
+    def invalidate(self, *paths):
+        """
+        Mark the directories holding paths as stale.
+
+        Used after our own encrypt/decrypt operations, whose changes may fall
+        within the filesystem's mtime granularity of the last refresh.
+        """
+        with self._lock, self._conn:
+            for path in paths:
+                path = self._normalize(path)
+                self._conn.execute(
+                    "UPDATE dirs SET mtime_ns = NULL WHERE path IN (?, ?)",
+                    (path, os.path.dirname(path))
+                )
+
+    def search(self, directory, pattern='*', recursive=True, only_locked=False, extension_filter=None):
+        """
+        Query the index (call refresh first for up-to-date results).
+
+        Args mirror FileManager.search_files; pattern is matched against the
+        file name with glob syntax, or if it has a directory part (such as
+        'sub/*.txt') against the trailing levels of the path (see
+        match_relative).
+
+        Returns:
+            Sorted list of file paths
+        """
+        directory = self._normalize(directory)
+        parts = split_pattern(pattern)
+        query = "SELECT path FROM files WHERE name GLOB ?"
+        params = [parts[-1]]
+
+        # The directory levels of a pattern are matched below, so their files are anywhere in the subtree
+        if recursive or len(parts) > 1:
+            low, high = self._subtree_bounds(directory)
+            query += " AND (dir = ? OR (dir >= ? AND dir < ?))"
+            params += [directory, low, high]
+        else:
+            query += " AND dir = ?"
+            params.append(directory)
+
+        if only_locked:
+            query += " AND locked = 1"
+        if extension_filter:
+            query += " AND substr(name, -?) = ?"
+            params += [len(extension_filter), extension_filter]
+
+        query += " ORDER BY path"
+        with self._lock:
+            paths = [row[0] for row in self._conn.execute(query, params)]
+        if len(parts) > 1:
+            paths = [path for path in paths
+                     if match_relative(os.path.relpath(path, directory), parts, recursive)]
+        return paths
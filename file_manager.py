@@ -3,26 +3,152 @@ File operations including compression, search, and I/O handling.
 """
 
 import os
+import fnmatch
+import hashlib
+import json
+import stat
+import struct
 import zipfile
+import tarfile
 import shutil
 import tempfile
+import multiprocessing
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from pathlib import Path
 from datetime import datetime
 from config import *
+from key_cache import DerivedKeyCache
+from chunk_store import ChunkStore
+from metrics import Metrics, timed_stage
+from progress import ByteCounter, ByteProgress
+from job_journal import JobJournal
+from file_index import match_relative, split_pattern
+from durability import fsync_tree, group_fsync, remove_temp, remove_temp_siblings, replace_durably, temp_sibling
+
+
+_ARCHIVE_TRAILER = struct.Struct('>Q4s')
+
+
+def _copy_file_into(path, fileobj):
+    """Copy a file into fileobj, returning (size, SHA-256 hex digest) of what was copied."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            fileobj.write(block)
+            digest.update(block)
+            size += len(block)
+    return size, digest.hexdigest()
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _scan_directory(path):
+    """List one directory into (files, subdirectories) DirEntry lists."""
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    # DirEntry caches the type from the listing, so no extra stat here
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry)
+                    elif entry.is_file():
+                        files.append(entry)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return files, subdirs
 
 
 class FileManager:
     """Handles file and folder operations."""
 
+    @staticmethod
+    def walk(directory, recursive=True, include_dirs=False, workers=WALK_WORKERS):
+        """
+        Yield os.DirEntry objects for the files below directory as they are found.
+
+        Symlinked directories are not followed. Unreadable directories are skipped.
+
+        Args:
+            directory: Root directory to walk
+            recursive: Descend into subdirectories
+            include_dirs: Also yield subdirectory entries
+            workers: Threads listing directories concurrently. With 1 the walk is
+                sequential and depth-first with entries sorted by name, which
+                gives a reproducible order; otherwise the order is arbitrary
+        """
+        directory = str(directory)
+
+        if workers <= 1:
+            stack = [directory]
+            while stack:
+                files, subdirs = _scan_directory(stack.pop())
+                files.sort(key=lambda e: e.name)
+                subdirs.sort(key=lambda e: e.name)
+                yield from files
+                if include_dirs:
+                    yield from subdirs
+                if recursive:
+                    stack.extend(entry.path for entry in reversed(subdirs))
+            return
+
+        pool = ThreadPoolExecutor(max_workers=workers)
+        pending = {pool.submit(_scan_directory, directory)}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, subdirs = future.result()
+                    if recursive:
+                        for entry in subdirs:
+                            pending.add(pool.submit(_scan_directory, entry.path))
+                    yield from files
+                    if include_dirs:
+                        yield from subdirs
+        finally:
+            # Runs when the consumer stops early too, so an abandoned walk stops at once
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    @staticmethod
+    def get_total_size(paths):
+        """
+        Total size in bytes of files and folders (walked recursively).
+
+        Paths that do not exist or cannot be read count as 0.
+        """
+        total = 0
+        for path in paths:
+            try:
+                if os.path.isdir(path):
+                    total += sum(entry.stat(follow_symlinks=False).st_size for entry in FileManager.walk(path))
+                else:
+                    total += os.path.getsize(path)
+            except OSError:
+                continue
+        return total
+
     @staticmethod
     def compress_folder(folder_path, output_path):
         """Compress a folder to ZIP format."""
         with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            folder_path = Path(folder_path)
-            for file_path in folder_path.rglob('*'):
-                if file_path.is_file():
-                    arcname = file_path.relative_to(folder_path.parent)
-                    zipf.write(file_path, arcname)
+            folder_path = os.path.abspath(folder_path)
+            parent = os.path.dirname(folder_path)
+            for entry in FileManager.walk(folder_path):
+                zipf.write(entry.path, os.path.relpath(entry.path, parent))
 
     @staticmethod
     def extract_folder(zip_path, output_dir):
@@ -31,47 +157,366 @@ class FileManager:
             zipf.extractall(output_dir)
 
     @staticmethod
-    def search_files(directory, pattern='*', recursive=True, only_locked=False, extension_filter=None):
+    def stream_folder(folder_path, fileobj):
+        """
+        Write a folder as a tar stream to a writable file object.
+
+        Entries are relative to the folder itself. No temporary archive is
+        created, so the stream can go straight into an EncryptingWriter.
+        """
+        with tarfile.open(fileobj=fileobj, mode='w|', dereference=True) as tar:
+            folder_path = os.path.abspath(folder_path)
+            # Sequential walk keeps the archive order reproducible; reading the
+            # files, not listing them, dominates here
+            for entry in FileManager.walk(folder_path, include_dirs=True, workers=1):
+                arcname = Path(os.path.relpath(entry.path, folder_path)).as_posix()
+                tar.add(entry.path, arcname=arcname, recursive=False)
+
+    @staticmethod
+    def extract_folder_stream(fileobj, output_dir):
+        """Extract a tar stream (as written by stream_folder) into output_dir."""
+        os.makedirs(output_dir, exist_ok=True)
+        with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+            if hasattr(tarfile, 'data_filter'):
+                tar.extractall(output_dir, filter='data')
+                return
+
+            # Older Pythons: refuse entries that would land outside output_dir
+            root = os.path.realpath(output_dir)
+            for member in tar:
+                target = os.path.realpath(os.path.join(root, member.name))
+                if os.path.commonpath([root, target]) != root or not (member.isfile() or member.isdir()):
+                    raise ValueError(f"Unsafe archive entry: {member.name}")
+                tar.extract(member, output_dir)
+
+    @staticmethod
+    def write_archive(folder_path, fileobj):
+        """
+        Write a folder to fileobj in the PAYLOAD_ARCHIVE layout.
+
+        Member contents are written back to back, followed by a JSON manifest
+        of paths, offsets, sizes, mtimes, modes and SHA-256 digests. Written
+        into an EncryptingWriter, the manifest is encrypted along with the
+        data, and the chunk index lets list_archive and extract_member decrypt
+        only the manifest and the requested member.
+
+        Returns:
+            List of manifest member entries
+        """
+        members = []
+        offset = 0
+        for member, path in FileManager._scan_members(folder_path):
+            if member['type'] == 'file':
+                member['size'], member['sha256'] = _copy_file_into(path, fileobj)
+                member['offset'] = offset
+                offset += member['size']
+            members.append(member)
+
+        FileManager._write_manifest(fileobj, members)
+        return members
+
+    @staticmethod
+    def _scan_members(folder_path):
+        """Yield (manifest entry without data fields, absolute path) for a folder, in a stable order."""
+        folder_path = os.path.abspath(folder_path)
+        for entry in FileManager.walk(folder_path, include_dirs=True, workers=1):
+            info = entry.stat()
+            yield {
+                'path': Path(os.path.relpath(entry.path, folder_path)).as_posix(),
+                'type': 'dir' if entry.is_dir(follow_symlinks=False) else 'file',
+                'mtime': info.st_mtime,
+                'mode': stat.S_IMODE(info.st_mode)
+            }, entry.path
+
+    @staticmethod
+    def update_archive(folder_path, archive_path, password=None, key=None, key_cache=None, workers=1,
+                       fsync=True):
+        """
+        Bring an encrypted folder archive up to date with folder_path.
+
+        Members whose size and mtime match the manifest keep their existing
+        ciphertext, as do changed or moved files whose content hash matches a
+        stored member. Only the remaining files are encrypted, and they are
+        appended to the archive together with a new manifest, so the cost is
+        proportional to what changed. Once more than ARCHIVE_COMPACT_RATIO of
+        the archive would be data no member refers to, it is rewritten instead.
+        An append is always flushed to disk before returning (see
+        CryptoHandler.open_append_writer); fsync applies to rewrites. An
+        earlier update that a crash interrupted is rolled back first.
+
+        Returns:
+            Dictionary with added, reused and removed member counts, bytes_appended
+            and whether the archive was rewritten (compacted) or left as is (unchanged)
+        """
+        from crypto_handler import CryptoHandler
+
+        CryptoHandler.recover_append(archive_path)
+        with FileManager._open_archive(archive_path, password, key, key_cache) as reader:
+            old_members = FileManager._read_manifest(reader)
+            header_data = reader.header
+            stream_size = reader.size
+
+        old_files = {m['path']: m for m in old_members if m['type'] == 'file'}
+        by_hash = {m['sha256']: m for m in old_files.values() if 'sha256' in m}
+
+        members = []
+        to_append = []
+        for member, path in FileManager._scan_members(folder_path):
+            if member['type'] == 'file':
+                size = os.path.getsize(path)
+                old = old_files.get(member['path'])
+                if old is not None and old['size'] == size and old['mtime'] == member['mtime']:
+                    reuse = old
+                else:
+                    reuse = by_hash.get(_hash_file(path))
+                    if reuse is not None and reuse['size'] != size:
+                        reuse = None
+
+                if reuse is not None:
+                    member['offset'] = reuse['offset']
+                    member['size'] = reuse['size']
+                    if 'sha256' in reuse:
+                        member['sha256'] = reuse['sha256']
+                else:
+                    to_append.append((member, path))
+            members.append(member)
+
+        stats = {
+            'added': len(to_append),
+            'reused': sum(1 for m in members if m['type'] == 'file') - len(to_append),
+            'removed': len(set(old_files) - {m['path'] for m in members}),
+            'bytes_appended': 0,
+            'compacted': False,
+            'unchanged': members == old_members
+        }
+        if stats['unchanged']:
+            return stats
+
+        # Several members may share one stored copy; count each stored range once
+        live = sum(m['size'] for m in {m['offset']: m for m in members if 'offset' in m}.values())
+        appended = sum(os.path.getsize(path) for _, path in to_append)
+        if stream_size + appended and 1 - (live + appended) / (stream_size + appended) > ARCHIVE_COMPACT_RATIO:
+            # Too much dead data: the writer builds a fresh archive next to the old one, then swaps
+            with CryptoHandler.open_encrypt_writer(
+                archive_path, header_data['mode'], header_data['original_filename'],
+                password=password, key=key, payload_type=PAYLOAD_ARCHIVE, cipher=header_data['cipher'],
+                codec=header_data['codec'], workers=workers, chunk_size=header_data['chunk_size'],
+                fsync=fsync
+            ) as writer:
+                FileManager.write_archive(folder_path, writer)
+            stats['compacted'] = True
+            return stats
+
+        with CryptoHandler.open_append_writer(archive_path, password, key, key_cache, workers) as writer:
+            offset = stream_size
+            for member, path in to_append:
+                member['size'], member['sha256'] = _copy_file_into(path, writer)
+                member['offset'] = offset
+                offset += member['size']
+            FileManager._write_manifest(writer, members)
+        stats['bytes_appended'] = offset - stream_size
+        return stats
+
+    @staticmethod
+    def _write_manifest(fileobj, members):
+        manifest = json.dumps(
+            {'version': ARCHIVE_MANIFEST_VERSION, 'members': members},
+            separators=(',', ':')
+        ).encode('utf-8')
+        fileobj.write(manifest)
+        fileobj.write(_ARCHIVE_TRAILER.pack(len(manifest), ARCHIVE_MAGIC))
+
+    @staticmethod
+    def _read_manifest(reader):
+        """Read the member list from a seekable plaintext view of an archive."""
+        if reader.size < ARCHIVE_TRAILER_SIZE:
+            raise ValueError(MSG_CORRUPTED_FILE)
+        reader.seek(reader.size - ARCHIVE_TRAILER_SIZE)
+        length, magic = _ARCHIVE_TRAILER.unpack(reader.read(ARCHIVE_TRAILER_SIZE))
+        manifest_offset = reader.size - ARCHIVE_TRAILER_SIZE - length
+        if magic != ARCHIVE_MAGIC or manifest_offset < 0:
+            raise ValueError(MSG_CORRUPTED_FILE)
+
+        reader.seek(manifest_offset)
+        manifest = json.loads(reader.read(length).decode('utf-8'))
+        if manifest.get('version') != ARCHIVE_MANIFEST_VERSION:
+            raise ValueError(f"Unsupported archive manifest version: {manifest.get('version')}")
+        for member in manifest['members']:
+            if member['type'] == 'file' and member['offset'] + member['size'] > manifest_offset:
+                raise ValueError(MSG_CORRUPTED_FILE)
+        return manifest['members']
+
+    @staticmethod
+    def _open_archive(archive_path, password, key, key_cache):
+        from crypto_handler import CryptoHandler
+
+        reader = CryptoHandler.open_random_access(archive_path, password, key, key_cache)
+        if reader.header['payload_type'] != PAYLOAD_ARCHIVE:
+            reader.close()
+            raise ValueError("Not an encrypted folder archive")
+        return reader
+
+    @staticmethod
+    def _member_target(root, member_path):
+        """Resolve member_path below root, refusing paths that would escape it."""
+        root = os.path.realpath(root)
+        target = os.path.realpath(os.path.join(root, *member_path.split('/')))
+        if os.path.isabs(member_path) or os.path.commonpath([root, target]) != root or target == root:
+            raise ValueError(f"Unsafe archive entry: {member_path}")
+        return target
+
+    @staticmethod
+    def _copy_member(reader, member, target, progress=None):
+        reader.seek(member['offset'])
+        remaining = member['size']
+        with open(target, 'wb') as out:
+            while remaining:
+                block = reader.read(min(CHUNK_SIZE, remaining))
+                if not block:
+                    raise ValueError(MSG_TRUNCATED_FILE)
+                out.write(block)
+                remaining -= len(block)
+                if progress is not None:
+                    progress(len(block))
+        os.utime(target, (member['mtime'], member['mtime']))
+
+    @staticmethod
+    def list_archive(archive_path, password=None, key=None, key_cache=None):
+        """
+        List the members of an encrypted folder archive.
+
+        Only the chunks holding the manifest are decrypted.
+
+        Returns:
+            List of dicts with path, type ('file' or 'dir'), size, mtime and mode
+        """
+        with FileManager._open_archive(archive_path, password, key, key_cache) as reader:
+            return FileManager._read_manifest(reader)
+
+    @staticmethod
+    def extract_member(archive_path, member_path, output_dir, password=None, key=None, key_cache=None):
+        """
+        Decrypt a single file from an encrypted folder archive into output_dir.
+
+        Only the manifest and the chunks holding that member are decrypted.
+
+        Returns:
+            Path of the extracted file
+        """
+        with FileManager._open_archive(archive_path, password, key, key_cache) as reader:
+            members = {m['path']: m for m in FileManager._read_manifest(reader)}
+            member = members.get(member_path)
+            if member is None:
+                raise KeyError(f"No such member: {member_path}")
+            if member['type'] != 'file':
+                raise ValueError(f"Not a file: {member_path}")
+
+            os.makedirs(output_dir, exist_ok=True)
+            target = FileManager._member_target(output_dir, member_path.rsplit('/', 1)[-1])
+            try:
+                FileManager._copy_member(reader, member, target)
+            except Exception:
+                FileManager.safe_delete(target)
+                raise
+            return target
+
+    @staticmethod
+    def extract_archive(archive_path, output_dir, password=None, key=None, key_cache=None, progress=None):
+        """
+        Extract every member of an encrypted folder archive into output_dir.
+
+        progress, if given, is called with the size of every block of member
+        data written.
+        """
+        with FileManager._open_archive(archive_path, password, key, key_cache) as reader:
+            members = FileManager._read_manifest(reader)
+            os.makedirs(output_dir, exist_ok=True)
+            directories = []
+            # Files in offset order keep the reads sequential
+            for member in sorted(members, key=lambda m: (m['type'] == 'file', m.get('offset', 0))):
+                target = FileManager._member_target(output_dir, member['path'])
+                if member['type'] == 'dir':
+                    os.makedirs(target, exist_ok=True)
+                    directories.append((target, member))
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                FileManager._copy_member(reader, member, target, progress)
+                # Permission bits only: an archive must not create setuid, setgid or sticky files
+                os.chmod(target, member['mode'] & 0o777)
+
+            # Directory mtimes last, after their contents were written
+            for target, member in directories:
+                os.utime(target, (member['mtime'], member['mtime']))
+
+    @staticmethod
+    def search_files(directory, pattern='*', recursive=True, only_locked=False, extension_filter=None,
+                     index=None):
         """
         Search for files in a directory.
 
         Args:
             directory: Root directory to search
-            pattern: Filename pattern (supports wildcards)
-            recursive: Search subdirectories
+            pattern: Filename pattern (supports wildcards), optionally with
+                directory levels such as 'sub/*.txt'; like Path.glob, each
+                level matches one path component
+            recursive: Search subdirectories (for patterns with directory
+                levels: match them at any depth instead of only directly
+                below directory)
             only_locked: Only return .locked files
             extension_filter: Filter by file extension (e.g., '.txt')
+            index: Optional FileIndex; it is refreshed incrementally and queried
+                instead of walking the whole tree
 
         Returns:
             List of file paths
         """
-        results = []
-        directory = Path(directory)
+        return sorted(FileManager.iter_search(
+            directory, pattern=pattern, recursive=recursive, only_locked=only_locked,
+            extension_filter=extension_filter, index=index
+        ))
 
-        if not directory.exists():
-            return results
+    @staticmethod
+    def iter_search(directory, pattern='*', recursive=True, only_locked=False, extension_filter=None,
+                    index=None, workers=WALK_WORKERS, cancel=None):
+        """
+        Like search_files, but yield matching paths as soon as they are found.
 
-        # Choose search method
-        if recursive:
-            search_pattern = f"**/{pattern}"
-        else:
-            search_pattern = pattern
+        Without an index the tree is walked concurrently and results arrive in
+        no particular order. Closing the generator stops the walk; cancel (a
+        threading.Event) also interrupts an index refresh.
+        """
+        if not os.path.isdir(directory):
+            return
 
-        # Search files
-        for file_path in directory.glob(search_pattern):
-            if not file_path.is_file():
+        parts = split_pattern(pattern)
+        # A pattern's directory levels are searched for below the top level even when not recursive
+        descend = recursive or len(parts) > 1
+
+        if index is not None:
+            index.refresh(directory, recursive=descend, cancel=cancel)
+            if cancel is not None and cancel.is_set():
+                return
+            yield from index.search(directory, pattern=pattern, recursive=recursive,
+                                    only_locked=only_locked, extension_filter=extension_filter)
+            return
+
+        directory = str(Path(directory))
+        for entry in FileManager.walk(directory, recursive=descend, workers=workers):
+            name = entry.name
+            if len(parts) > 1:
+                if not match_relative(os.path.relpath(entry.path, directory), parts, recursive):
+                    continue
+            elif not fnmatch.fnmatch(name, pattern):
                 continue
 
             # Apply filters
-            if only_locked and not str(file_path).endswith(ENCRYPTED_EXTENSION):
+            if only_locked and not name.endswith(ENCRYPTED_EXTENSION):
                 continue
 
-            if extension_filter and not str(file_path).endswith(extension_filter):
+            if extension_filter and not name.endswith(extension_filter):
                 continue
 
-            results.append(str(file_path))
-
-        return sorted(results)
+            yield entry.path
 
     @staticmethod
     def get_file_info(filepath):
@@ -135,139 +580,777 @@ class FileManager:
         os.makedirs(directory, exist_ok=True)
 
 
+_worker_key_cache = None
+_worker_byte_counter = None
+_worker_journals = {}
+
+
+def _get_worker_key_cache():
+    """Per-process key cache for batch jobs running in a process pool."""
+    global _worker_key_cache
+    if _worker_key_cache is None:
+        _worker_key_cache = DerivedKeyCache()
+    return _worker_key_cache
+
+
+def _input_fingerprint(path):
+    """
+    (size, mtime_ns) of a file, or for a folder the total size and newest
+    mtime below it; None if path cannot be read.
+    """
+    try:
+        info = os.stat(path)
+        if not os.path.isdir(path):
+            return info.st_size, info.st_mtime_ns
+        size, mtime_ns = 0, info.st_mtime_ns
+        for root, dirs, files in os.walk(path):
+            for name in files + dirs:
+                info = os.lstat(os.path.join(root, name))
+                if name in files:
+                    size += info.st_size
+                mtime_ns = max(mtime_ns, info.st_mtime_ns)
+        return size, mtime_ns
+    except OSError:
+        return None
+
+
+def _remove_temp_outputs(operation, filepath):
+    """Delete the temporary outputs an interrupted 'encrypt' or 'decrypt' job left next to filepath."""
+    if operation == 'encrypt':
+        remove_temp_siblings(FileManager.get_encrypted_filename(os.path.normpath(filepath)))
+        return
+
+    from crypto_handler import CryptoHandler
+    try:
+        name = os.path.basename(CryptoHandler.read_file_metadata(filepath)['original_filename'])
+    except (OSError, ValueError):
+        return
+    target = os.path.join(os.path.dirname(filepath), name)
+    remove_temp_siblings(target)
+    # Folders encrypted as a ZIP are extracted to the name without .zip
+    remove_temp_siblings(os.path.splitext(target)[0])
+
+
+def _delete_input(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        FileManager.safe_delete(path)
+
+
+def _finish_job(filepath, output_path, delete_input, durability, metrics, record):
+    """
+    Commit a job's output and delete its input.
+
+    Under DURABILITY_BATCH both wait for the job's group commit, which
+    BatchProcessor runs as groups of jobs finish (see _GroupCommit). Under
+    DURABILITY_NONE the output is only synced, and so only committed, when
+    its input is about to be deleted.
+
+    Returns:
+        output_path
+    """
+    if durability == DURABILITY_BATCH:
+        return output_path
+    if durability == DURABILITY_NONE:
+        if not delete_input:
+            # Left as JOB_WRITING, so a resumed batch redoes it
+            return output_path
+        with timed_stage(metrics, STAGE_WRITE):
+            fsync_tree(output_path)
+    if record is not None:
+        record(JOB_COMMITTED, output_path)
+    if delete_input:
+        with timed_stage(metrics, STAGE_DELETE):
+            _delete_input(filepath)
+        if record is not None:
+            record(JOB_ORIGINAL_DELETED)
+    return output_path
+
+
+def _encrypt_one(filepath, mode, password, key, delete_originals, session_key, codec, chunk_workers,
+                 chunk_size=CHUNK_SIZE, incremental=False, chunk_store=None, durability=DURABILITY_FILE,
+                 key_cache=None, metrics=None, progress=None, record=None):
+    """
+    Encrypt one file or folder. Runs inline or inside a worker pool.
+
+    key_cache defaults to the worker process's own cache.
+
+    record, if given, is called as record(state, output=None) for the
+    journal once the output is durable (JOB_COMMITTED) and once the
+    original is deleted (JOB_ORIGINAL_DELETED).
+
+    Returns:
+        Output path
+    """
+    from crypto_handler import CryptoHandler
+
+    fsync = durability == DURABILITY_FILE
+
+    if key_cache is None:
+        key_cache = _get_worker_key_cache()
+
+    # Check if it's a folder
+    is_folder = os.path.isdir(filepath)
+    output_path = FileManager.get_encrypted_filename(os.path.normpath(filepath))
+
+    if is_folder and incremental and os.path.isfile(output_path) and \
+            CryptoHandler.read_file_metadata(output_path)['payload_type'] == PAYLOAD_ARCHIVE:
+        # Only changed members are encrypted and appended to the existing archive
+        with timed_stage(metrics, STAGE_ARCHIVE):
+            FileManager.update_archive(
+                filepath, output_path, password=password, key=key, key_cache=key_cache,
+                workers=CHUNK_WORKERS if chunk_workers is None else chunk_workers, fsync=fsync
+            )
+    elif is_folder:
+        # Stream the folder archive straight into the encryptor
+        with CryptoHandler.open_encrypt_writer(
+            output_path,
+            mode,
+            os.path.basename(os.path.normpath(filepath)),
+            password=password,
+            key=key,
+            payload_type=PAYLOAD_ARCHIVE,
+            session_key=session_key,
+            codec=codec,
+            workers=CHUNK_WORKERS if chunk_workers is None else chunk_workers,
+            chunk_size=chunk_size,
+            metrics=metrics,
+            progress=progress,
+            fsync=fsync
+        ) as writer:
+            with timed_stage(metrics, STAGE_ARCHIVE):
+                FileManager.write_archive(filepath, writer)
+    else:
+        CryptoHandler.encrypt_file(
+            filepath,
+            output_path,
+            mode,
+            password=password,
+            key=key,
+            session_key=session_key,
+            codec=codec,
+            workers=chunk_workers,
+            chunk_size=chunk_size,
+            # Even under group commit, a recipe's chunks are synced before the recipe is written
+            chunk_store=ChunkStore(
+                chunk_store, fsync=durability != DURABILITY_NONE or delete_originals
+            ) if chunk_store else None,
+            key_cache=key_cache,
+            metrics=metrics,
+            progress=progress,
+            fsync=fsync
+        )
+
+    return _finish_job(filepath, output_path, delete_originals, durability, metrics, record)
+
+
+def _extract_atomically(extract_dir, extract, fsync):
+    """Run extract(target) into a temporary sibling of extract_dir, then rename it into place."""
+    temp_dir = temp_sibling(extract_dir)
+    try:
+        extract(temp_dir)
+        replace_durably(temp_dir, extract_dir, fsync=fsync)
+    except BaseException:
+        remove_temp(temp_dir)
+        raise
+
+
+def _decrypt_one(filepath, password, key, delete_encrypted, key_cache=None, chunk_workers=None,
+                 chunk_store=None, durability=DURABILITY_FILE, metrics=None, progress=None, record=None):
+    """
+    Decrypt one file, extracting folders. Runs inline or inside a worker pool.
+
+    record is called as for _encrypt_one, with the decrypted file or
+    extracted folder as output. Folders are extracted next to their final
+    name and renamed into place once complete.
+
+    Returns:
+        Output path
+    """
+    from crypto_handler import CryptoHandler
+
+    fsync = durability == DURABILITY_FILE
+
+    if key_cache is None:
+        key_cache = _get_worker_key_cache()
+
+    output_dir = os.path.dirname(filepath)
+    chunk_workers = CryptoHandler.resolve_chunk_workers(filepath, chunk_workers)
+
+    chunk_store = ChunkStore(chunk_store, create=False) if chunk_store else None
+
+    with CryptoHandler.open_decrypt_reader(
+        filepath, password, key, key_cache, chunk_workers, chunk_store, metrics, progress
+    ) as reader:
+        header_data = reader.header
+
+        if header_data['payload_type'] in (PAYLOAD_TAR, PAYLOAD_ARCHIVE):
+            extract_dir = os.path.join(output_dir, header_data['original_filename'])
+
+            # Handle duplicate folder names
+            if os.path.exists(extract_dir):
+                counter = 1
+                while os.path.exists(extract_dir):
+                    extract_dir = os.path.join(output_dir, f"{header_data['original_filename']}_{counter}")
+                    counter += 1
+
+            def extract(target):
+                if header_data['payload_type'] == PAYLOAD_ARCHIVE:
+                    # Members are located through the manifest at the end
+                    FileManager.extract_archive(filepath, target, password, key, key_cache, progress)
+                else:
+                    # Stream decryption straight into extraction
+                    FileManager.extract_folder_stream(reader, target)
+                    # Drain any tar padding so a missing final chunk is still detected
+                    while reader.read(CHUNK_SIZE):
+                        pass
+
+            with timed_stage(metrics, STAGE_ARCHIVE):
+                _extract_atomically(extract_dir, extract, fsync)
+            output_path = extract_dir
+        else:
+            decrypt_result = CryptoHandler.save_decrypted(reader, output_dir, metrics, fsync)
+            output_path = decrypt_result['output_path']
+
+            # Folders encrypted as a ZIP archive are extracted afterwards
+            if decrypt_result['is_compressed']:
+                decrypted_zip = decrypt_result['output_path']
+                # Extract to folder with original name (without .zip)
+                folder_name = os.path.splitext(decrypt_result['original_filename'])[0]
+                extract_dir = os.path.join(output_dir, folder_name)
+
+                # Handle duplicate folder names
+                if os.path.exists(extract_dir):
+                    counter = 1
+                    while os.path.exists(extract_dir):
+                        extract_dir = os.path.join(output_dir, f"{folder_name}_{counter}")
+                        counter += 1
+
+                with timed_stage(metrics, STAGE_ARCHIVE):
+                    _extract_atomically(
+                        extract_dir, lambda target: FileManager.extract_folder(decrypted_zip, target), fsync
+                    )
+                FileManager.safe_delete(decrypted_zip)
+                output_path = extract_dir
+
+    return _finish_job(filepath, output_path, delete_encrypted, durability, metrics, record)
+
+
+def _get_worker_journal(journal):
+    """The JobJournal itself, or for a database path this process's own connection to it."""
+    if isinstance(journal, JobJournal):
+        return journal
+    if journal not in _worker_journals:
+        _worker_journals[journal] = JobJournal(journal)
+    return _worker_journals[journal]
+
+
+def _init_progress_worker(counter):
+    """Process pool initializer: shared memory can only reach workers at spawn time."""
+    global _worker_byte_counter
+    _worker_byte_counter = counter
+
+
+def _run_job(func, filepath, args, collect_metrics, size=0, counter=None, notify=None, journal=None):
+    """
+    Run one batch job inline or in a worker.
+
+    With a ByteCounter (passed in, or set up by _init_progress_worker), the
+    job adds its bytes as it processes them and, once done, whatever is
+    needed to make its total exactly size, so finished jobs never leave the
+    batch count off. notify, if given, is called after every count.
+
+    With journal=(JobJournal or its database path, batch id), the file is
+    marked JOB_WRITING, with its input's fingerprint, before the job starts
+    and the job records its progress from there. A failure is recorded as JOB_FAILED unless the
+    output was already committed.
+
+    Returns:
+        (error message or None, Metrics snapshot or None, output path or
+        None); the snapshot holds this file's stage timings and its latency
+    """
+    metrics = Metrics() if collect_metrics else None
+    if counter is None:
+        counter = _worker_byte_counter
+    progress = None
+    counted = [0]
+    if counter is not None:
+        lock = threading.Lock()
+
+        def progress(nbytes):
+            with lock:
+                counted[0] += nbytes
+            counter.add(nbytes)
+            if notify is not None:
+                notify()
+
+    record = None
+    committed = [False]
+    if journal is not None:
+        job_journal, batch = journal
+
+        def record(state, output=None, fingerprint=None):
+            _get_worker_journal(job_journal).set_state(batch, filepath, state, output, fingerprint=fingerprint)
+            committed[0] = committed[0] or state == JOB_COMMITTED
+
+    started = time.perf_counter()
+    error = None
+    output = None
+    try:
+        if record is not None:
+            record(JOB_WRITING, fingerprint=_input_fingerprint(filepath))
+        output = func(filepath, *args, metrics=metrics, progress=progress, record=record)
+    except Exception as e:
+        error = str(e)
+        if record is not None and not committed[0]:
+            try:
+                _get_worker_journal(job_journal).set_state(batch, filepath, JOB_FAILED, error=error)
+            except Exception:
+                # Left as JOB_WRITING, which is retried just the same
+                pass
+    if counter is not None:
+        counter.add(size - counted[0])
+    if metrics is None:
+        return error, None, output
+    # Plaintext through the cipher is the file's size, for folders too
+    metrics.observe_file(time.perf_counter() - started, metrics.stage_bytes(STAGE_CIPHER), ok=error is None)
+    return error, metrics.snapshot(), output
+
+
+class _GroupCommit:
+    """
+    Finished DURABILITY_BATCH jobs waiting to be committed together.
+
+    A group is committed once it holds max_files outputs or its oldest
+    output has waited max_delay seconds: all its outputs are synced in one
+    pass, recorded as committed, and only then are their inputs deleted.
+    Bounding groups keeps what a crash can lose, and the extra disk space
+    held by inputs awaiting deletion, small.
+    """
+
+    def __init__(self, journal=None, batch=None, delete_inputs=False, metrics=None,
+                 max_files=GROUP_COMMIT_FILES, max_delay=GROUP_COMMIT_INTERVAL):
+        self.journal = journal
+        self.batch = batch
+        self.delete_inputs = delete_inputs
+        self.metrics = metrics
+        self.max_files = max_files
+        self.max_delay = max_delay
+        self.errors = {}  # filepath -> error for outputs that could not be committed
+        self._pending = []
+        self._started = None
+
+    def add(self, filepath, output):
+        """Queue a finished job's output; commits the group once it is full."""
+        if not self._pending:
+            self._started = time.monotonic()
+        self._pending.append((filepath, output))
+        if len(self._pending) >= self.max_files:
+            self.flush()
+
+    def poll(self):
+        """Commit the group if its oldest output has waited long enough."""
+        if self._pending and time.monotonic() - self._started >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        """Commit every queued output now."""
+        group, self._pending = self._pending, []
+        if not group:
+            return
+        try:
+            group_fsync(output for _, output in group)
+        except OSError as e:
+            for path, _ in group:
+                self.errors[path] = f"Output written, but could not be synced to disk: {e}"
+            return
+        if self.batch is not None:
+            self.journal.set_states(self.batch, [(path, JOB_COMMITTED, output) for path, output in group])
+        if not self.delete_inputs:
+            return
+
+        deleted = []
+        with timed_stage(self.metrics, STAGE_DELETE):
+            for path, _ in group:
+                try:
+                    _delete_input(path)
+                    deleted.append(path)
+                except OSError as e:
+                    self.errors[path] = f"Output written, but the input could not be deleted: {e}"
+        if self.batch is not None:
+            self.journal.set_states(self.batch, [(path, JOB_ORIGINAL_DELETED, None) for path in deleted])
+
+
 class BatchProcessor:
     """Handles batch file operations."""
 
-    def __init__(self, progress_callback=None):
+    def __init__(self, progress_callback=None, key_cache=None, max_workers=1, executor=EXECUTOR_AUTO,
+                 file_index=None, metrics=None, byte_progress_callback=None, journal=None,
+                 durability=DEFAULT_DURABILITY):
         """
         Initialize batch processor.
 
         Args:
             progress_callback: Function to call with progress updates (current, total, message)
+                as files start and finish
+            key_cache: Optional shared DerivedKeyCache; by default a private cache
+                is used and zeroized at the end of each batch
+            max_workers: Number of files processed concurrently (1 = sequential,
+                None = one per CPU)
+            executor: EXECUTOR_AUTO, EXECUTOR_PROCESS or EXECUTOR_THREAD. Auto uses
+                processes for PBKDF2-bound password jobs and threads otherwise
+            file_index: Optional FileIndex to invalidate for every directory a
+                batch writes to or deletes from
+            metrics: Optional Metrics. Every file's stage timings (also from
+                worker processes) and latency are added to it, it emits a
+                'file' event per file and a 'summary' event per batch, and
+                batch results gain a 'metrics' summary
+            byte_progress_callback: Function called with a progress dict (see
+                progress.ByteProgress: bytes done and total, files done and
+                total, smoothed rate, ETA, message) while a batch runs, at
+                most every PROGRESS_INTERVAL seconds and once more at the end.
+                Bytes are counted inside the chunk loops, so large files
+                report progress while they are processed
+            journal: Optional JobJournal. Each file's state is recorded in it
+                as the batch runs; running the same batch (operation and file
+                list) again after a crash skips files whose output was
+                committed and whose input is unchanged (size and mtime),
+                finishes their deletion if it was interrupted, and redoes the
+                rest. A batch is dropped from the journal once a run of it
+                completes, failed files or not. Results gain a 'resumed' list
+                of skipped files
+            durability: Outputs are always written to a temporary file and
+                renamed into place once complete. DURABILITY_FILE also fsyncs
+                each output before its rename, DURABILITY_BATCH fsyncs finished
+                outputs together in groups of up to GROUP_COMMIT_FILES files or
+                GROUP_COMMIT_INTERVAL seconds (group commit), and
+                DURABILITY_NONE leaves flushing to the OS. Inputs are only
+                deleted once their outputs are synced, so under
+                DURABILITY_BATCH deletion waits for the file's group and
+                DURABILITY_NONE syncs an output before deleting its input.
+                Outputs that were never synced are not recorded as
+                committed in the journal
         """
         self.progress_callback = progress_callback
+        self._owns_key_cache = key_cache is None
+        self.key_cache = key_cache if key_cache is not None else DerivedKeyCache()
+        self.max_workers = max_workers if max_workers is not None else DEFAULT_MAX_WORKERS
+        self.executor = executor
+        self.file_index = file_index
+        self.metrics = metrics
+        self.byte_progress_callback = byte_progress_callback
+        self.journal = journal
+        self.durability = durability
+        self._byte_progress = None
+        self._byte_counter = None
 
     def _update_progress(self, current, total, message):
         """Update progress if callback is set."""
         if self.progress_callback:
             self.progress_callback(current, total, message)
+        if self._byte_progress is not None:
+            self._byte_progress.update(self._byte_counter.value, current, message)
 
-    def batch_encrypt(self, file_list, mode, password=None, key=None, delete_originals=False):
+    def _poll_byte_progress(self):
+        """Pass the bytes counted so far to the byte progress tracker (rate-limited there)."""
+        if self._byte_progress is not None:
+            self._byte_progress.update(self._byte_counter.value)
+
+    def _run_jobs(self, func, jobs, use_processes, verb, batch=None, delete_inputs=False):
         """
-        Encrypt multiple files.
+        Run func(filepath, *args) for each (filepath, args) job.
+
+        Progress callbacks are always made from the calling thread, and the
+        success list keeps the order of the input list. With a batch id, jobs
+        record their states in self.journal. Under DURABILITY_BATCH, finished
+        jobs are group committed (deleting their inputs if delete_inputs)
+        while the rest of the batch runs.
 
         Returns:
             Dictionary with success/failure lists
         """
+        total = len(jobs)
+        outcomes = [None] * total
+        workers = self._worker_count(total)
+        collect = self.metrics is not None
+
+        commit = None
+        if self.durability == DURABILITY_BATCH:
+            commit = _GroupCommit(self.journal, batch, delete_inputs, self.metrics)
+
+        def job_done(i):
+            self._record_job(jobs[i][0], *outcomes[i][:2])
+            if commit is not None and outcomes[i][0] is None:
+                commit.add(jobs[i][0], outcomes[i][2])
+
+        journal = None
+        if batch is not None:
+            # Worker processes open their own connection to the journal
+            journal = (self.journal.db_path if use_processes else self.journal, batch)
+
+        sizes = [0] * total
+        counter = None
+        if self.byte_progress_callback is not None:
+            self._update_progress(0, total, f"Measuring {total} item(s)...")
+            sizes = [FileManager.get_total_size([filepath]) for filepath, _ in jobs]
+            counter = self._byte_counter = ByteCounter()
+            self._byte_progress = ByteProgress(sum(sizes), total, self.byte_progress_callback)
+
+        try:
+            if workers <= 1:
+                for i, (filepath, args) in enumerate(jobs):
+                    self._update_progress(i, total, f"{verb} {os.path.basename(filepath)}...")
+                    outcomes[i] = _run_job(
+                        func, filepath, args, collect, sizes[i], counter, self._poll_byte_progress, journal
+                    )
+                    job_done(i)
+                    if commit is not None:
+                        commit.poll()
+            else:
+                if use_processes:
+                    # Spawn avoids forking a process that is running GUI threads
+                    pool = ProcessPoolExecutor(
+                        max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_init_progress_worker, initargs=(counter,)
+                    )
+                else:
+                    pool = ThreadPoolExecutor(max_workers=workers)
+
+                with pool:
+                    # Process workers find the counter through the initializer instead
+                    job_counter = None if use_processes else counter
+                    futures = {
+                        pool.submit(_run_job, func, filepath, args, collect, sizes[i], job_counter, None, journal): i
+                        for i, (filepath, args) in enumerate(jobs)
+                    }
+                    done = 0
+                    self._update_progress(0, total, f"{verb} {total} file(s) with {workers} workers...")
+                    pending = set(futures)
+                    # Wake up regularly to report bytes of files still in progress and commit groups
+                    timeout = PROGRESS_INTERVAL if counter is not None or commit is not None else None
+                    while pending:
+                        completed, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                        for future in completed:
+                            i = futures[future]
+                            try:
+                                outcomes[i] = future.result()
+                            except Exception as e:
+                                # The worker itself died (e.g. a broken process pool)
+                                outcomes[i] = (str(e), None, None)
+                            job_done(i)
+                            done += 1
+                            self._update_progress(done, total, f"{verb} {os.path.basename(jobs[i][0])}...")
+                        if commit is not None:
+                            commit.poll()
+                        self._poll_byte_progress()
+
+            if commit is not None:
+                self._update_progress(total, total, "Syncing outputs to disk...")
+                commit.flush()
+
+            if self._byte_progress is not None:
+                self._byte_progress.update(self._byte_progress.total_bytes, total, f"{verb} done", force=True)
+        finally:
+            self._byte_progress = None
+            self._byte_counter = None
+
         results = {
             'success': [],
             'failed': []
         }
+        for (filepath, _), (error, _, _) in zip(jobs, outcomes):
+            if error is None and commit is not None:
+                error = commit.errors.get(filepath)
+            if error is None:
+                results['success'].append(filepath)
+            else:
+                results['failed'].append((filepath, error))
+        return results
 
-        total = len(file_list)
+    def _record_job(self, filepath, error, snapshot):
+        """Add a finished job's metrics snapshot to self.metrics and emit its 'file' event."""
+        if snapshot is None:
+            return
+        self.metrics.merge(snapshot)
+        seconds, nbytes = snapshot['files'][3], snapshot['files'][2]
+        self.metrics.emit(
+            'file', path=filepath, ok=error is None, error=error, seconds=seconds, bytes=nbytes,
+            stages={name: entry[0] for name, entry in snapshot['stages'].items()}
+        )
 
-        for i, filepath in enumerate(file_list):
-            self._update_progress(i, total, f"Encrypting {os.path.basename(filepath)}...")
+    def _finish_metrics(self, results):
+        """Emit the batch 'summary' event and add the summary to results."""
+        if self.metrics is not None:
+            summary = self.metrics.summary()
+            self.metrics.emit('summary', **summary)
+            results['metrics'] = summary
+        return results
 
-            try:
-                # Check if it's a folder
-                is_folder = os.path.isdir(filepath)
-                is_compressed = False
-                input_file = filepath
-
-                if is_folder:
-                    # Compress folder first
-                    temp_zip = FileManager.create_temp_file(suffix='.zip')
-                    FileManager.compress_folder(filepath, temp_zip)
-                    input_file = temp_zip
-                    is_compressed = True
-
-                # Encrypt
-                output_path = FileManager.get_encrypted_filename(filepath)
-
-                from crypto_handler import CryptoHandler
-                CryptoHandler.encrypt_file(
-                    input_file,
-                    output_path,
-                    mode,
-                    password=password,
-                    key=key,
-                    is_compressed=is_compressed
-                )
-
-                # Clean up temp file if folder
-                if is_folder:
-                    FileManager.safe_delete(temp_zip)
-
-                # Delete original if requested
-                if delete_originals:
-                    if is_folder:
-                        shutil.rmtree(filepath)
-                    else:
-                        FileManager.safe_delete(filepath)
+    def _resume(self, operation, file_list, delete_inputs):
+        """
+        Start or resume a journaled batch.
 
-                results['success'].append(filepath)
+        Files whose output is committed are done unless their input changed
+        since its job started; if their deletion was interrupted it is
+        finished here. Everything else is run (again), after removing the
+        temporary outputs of jobs the crash interrupted.
 
-            except Exception as e:
-                results['failed'].append((filepath, str(e)))
+        Returns:
+            (batch id or None, files to run, files already done)
+        """
+        if self.journal is None:
+            return None, file_list, []
+        batch = self.journal.begin(operation, file_list)
+        states = self.journal.states(batch)
+        todo = []
+        done = []
+        for path in file_list:
+            state, output, _, fingerprint = states[JobJournal._normalize(path)]
+            if state == JOB_WRITING:
+                _remove_temp_outputs(operation, path)
+            committed = state == JOB_ORIGINAL_DELETED or (
+                state == JOB_COMMITTED and output and os.path.exists(output))
+            if committed and os.path.exists(path) and _input_fingerprint(path) != fingerprint:
+                # Changed (or recreated) since its output was written
+                committed = False
+            if committed:
+                if state == JOB_COMMITTED and delete_inputs and os.path.exists(path):
+                    _delete_input(path)
+                    self.journal.set_state(batch, path, JOB_ORIGINAL_DELETED)
+                done.append(path)
+            else:
+                todo.append(path)
+        return batch, todo, done
 
-        self._update_progress(total, total, "Encryption complete!")
+    def _finish_journal(self, batch, file_list, done, results):
+        """
+        Merge files skipped on resume into results and drop the batch.
+
+        Only a crash needs resuming: after a completed run, running the same
+        batch again starts over, so failed files are retried and changed
+        inputs are never mistaken for done.
+        """
+        if batch is None:
+            return results
+        finished = set(done).union(results['success'])
+        results['success'] = [path for path in file_list if path in finished]
+        results['resumed'] = done
+        self.journal.forget(batch)
         return results
 
-    def batch_decrypt(self, file_list, password=None, key=None, delete_encrypted=False):
+    def _invalidate_index(self, file_list):
+        """Outputs land next to their inputs, so their directories are what changed."""
+        if self.file_index is not None and file_list:
+            self.file_index.invalidate(*file_list)
+
+    def _worker_count(self, total):
+        """Number of workers actually used for a batch of total files."""
+        return max(1, min(self.max_workers, total))
+
+    def _chunk_workers(self, total):
+        """Cipher threads per file: let large files use every core only when files run one at a time."""
+        return None if self._worker_count(total) <= 1 else 1
+
+    def _job_key_cache(self, use_processes, total):
+        """Key cache to pass to jobs: this processor's, unless they run in worker processes, which use their own."""
+        return None if use_processes and self._worker_count(total) > 1 else self.key_cache
+
+    def _use_processes(self, password_job):
+        """Decide between a process pool and a thread pool."""
+        if self.executor == EXECUTOR_PROCESS:
+            return True
+        if self.executor == EXECUTOR_THREAD:
+            return False
+        return password_job
+
+    def batch_encrypt(self, file_list, mode, password=None, key=None, delete_originals=False,
+                      session_key=False, codec=CODEC_AUTO, chunk_size=CHUNK_SIZE, incremental=False,
+                      chunk_store=None):
         """
-        Decrypt multiple files.
+        Encrypt multiple files.
+
+        Args:
+            session_key: In password mode, run PBKDF2 once for the whole batch and
+                give each file its own HKDF subkey from a per-file nonce
+            codec: Compression codec (CODEC_*); files that look incompressible
+                are stored without compression
+            chunk_size: Plaintext bytes per encrypted chunk
+            incremental: For folders whose .locked archive already exists, encrypt
+                only new or changed members and append them to it (see
+                FileManager.update_archive); the archive keeps its original settings
+            chunk_store: Directory of a deduplicating ChunkStore (created if
+                missing). Files are split into content-defined chunks stored
+                there once each, and their .locked files only hold recipes;
+                folders are encrypted as usual
 
         Returns:
-            Dictionary with success/failure lists
+            Dictionary with success/failure lists, plus a 'metrics' summary
+            when the processor has a Metrics
         """
-        results = {
-            'success': [],
-            'failed': []
-        }
-
         total = len(file_list)
 
-        for i, filepath in enumerate(file_list):
-            self._update_progress(i, total, f"Decrypting {os.path.basename(filepath)}...")
+        from crypto_handler import CryptoHandler
+        batch_key = None
+        if session_key and mode == MODE_PASSWORD and password and file_list and not chunk_store:
+            self._update_progress(0, total, "Deriving session key...")
+            with timed_stage(self.metrics, STAGE_KDF):
+                batch_key = CryptoHandler.derive_key_from_password(password)
 
-            try:
-                # Decrypt
-                output_dir = os.path.dirname(filepath)
-
-                from crypto_handler import CryptoHandler
-                decrypt_result = CryptoHandler.decrypt_file(
-                    filepath,
-                    output_dir,
-                    password=password,
-                    key=key
-                )
-
-                # If it was a compressed folder, extract it
-                if decrypt_result['is_compressed']:
-                    decrypted_zip = decrypt_result['output_path']
-                    # Extract to folder with original name (without .zip)
-                    folder_name = os.path.splitext(decrypt_result['original_filename'])[0]
-                    extract_dir = os.path.join(output_dir, folder_name)
-
-                    # Handle duplicate folder names
-                    if os.path.exists(extract_dir):
-                        counter = 1
-                        while os.path.exists(extract_dir):
-                            extract_dir = os.path.join(output_dir, f"{folder_name}_{counter}")
-                            counter += 1
-
-                    FileManager.extract_folder(decrypted_zip, extract_dir)
-                    FileManager.safe_delete(decrypted_zip)
-
-                # Delete encrypted file if requested
-                if delete_encrypted:
-                    FileManager.safe_delete(filepath)
+        if chunk_store:
+            # Create the store here so worker processes do not race to initialize it
+            ChunkStore(chunk_store)
 
-                results['success'].append(filepath)
+        batch, todo, done = self._resume('encrypt', file_list, delete_originals)
+        # Per-file PBKDF2 and content-defined chunking are CPU bound; session keys and key files are I/O bound
+        use_processes = self._use_processes(bool(chunk_store) or (mode == MODE_PASSWORD and batch_key is None))
+        key_cache = self._job_key_cache(use_processes, len(todo))
+        chunk_workers = self._chunk_workers(len(todo))
+        jobs = [
+            (filepath, (mode, password, key, delete_originals, batch_key, codec, chunk_workers, chunk_size,
+                        incremental, chunk_store, self.durability, key_cache))
+            for filepath in todo
+        ]
+        try:
+            results = self._run_jobs(_encrypt_one, jobs, use_processes, "Encrypting", batch, delete_originals)
+        finally:
+            if self._owns_key_cache:
+                self.key_cache.clear()
+            self._invalidate_index(file_list)
+        results = self._finish_journal(batch, file_list, done, results)
+
+        self._update_progress(total, total, "Encryption complete!")
+        return self._finish_metrics(results)
+
+    def batch_decrypt(self, file_list, password=None, key=None, delete_encrypted=False, chunk_store=None):
+        """
+        Decrypt multiple files.
+
+        Args:
+            chunk_store: Directory of the ChunkStore for files encrypted into
+                one; the default store at CHUNK_STORE_PATH is used if not given
 
-            except Exception as e:
-                results['failed'].append((filepath, str(e)))
+        Returns:
+            Dictionary with success/failure lists, plus a 'metrics' summary
+            when the processor has a Metrics
+        """
+        total = len(file_list)
+
+        batch, todo, done = self._resume('decrypt', file_list, delete_encrypted)
+        use_processes = self._use_processes(bool(password))
+        key_cache = self._job_key_cache(use_processes, len(todo))
+        chunk_workers = self._chunk_workers(len(todo))
+        jobs = [
+            (filepath, (password, key, delete_encrypted, key_cache, chunk_workers, chunk_store, self.durability))
+            for filepath in todo
+        ]
+        try:
+            results = self._run_jobs(_decrypt_one, jobs, use_processes, "Decrypting", batch, delete_encrypted)
+        finally:
+            if self._owns_key_cache:
+                self.key_cache.clear()
+            self._invalidate_index(file_list)
+        results = self._finish_journal(batch, file_list, done, results)
 
         self._update_progress(total, total, "Decryption complete!")
-        return results
+        return self._finish_metrics(results)
@@ -0,0 +1,168 @@
+"""
+Crash-safe journal of batch jobs, used to resume interrupted batches.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from config import *
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    operation TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    batch TEXT NOT NULL,
+    path TEXT NOT NULL,
+    state TEXT NOT NULL,
+    output TEXT,
+    error TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    updated REAL NOT NULL,
+    PRIMARY KEY (batch, path)
+);
+"""
+
+
+class JobJournal:
+    """
+    SQLite journal of the state of every file in a batch.
+
+    A file goes from JOB_PENDING to JOB_WRITING when its job starts, to
+    JOB_COMMITTED once its output is complete and synced to disk, and to
+    JOB_ORIGINAL_DELETED after its input was deleted (JOB_FAILED on error).
+    Every state change is a durable transaction in WAL mode, so after a
+    crash the journal never claims more than what is on disk. Each file
+    also keeps the fingerprint (size, mtime_ns) its input had when its job
+    started, so a resumed batch can tell whether the input changed since.
+
+    A batch is identified by its operation and list of paths, so running
+    the same command again resumes it. Worker processes open their own
+    JobJournal on the same file; writers wait for each other.
+    """
+
+    def __init__(self, db_path=JOURNAL_DB_PATH):
+        """
+        Open (or create) a journal.
+
+        Args:
+            db_path: SQLite database file, or ':memory:' for a throwaway journal
+        """
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, timeout=JOURNAL_BUSY_TIMEOUT, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # FULL syncs the WAL on every commit, so a recorded state survives a power cut
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def _normalize(path):
+        return os.path.normpath(os.path.abspath(path))
+
+    @staticmethod
+    def batch_id(operation, paths):
+        """Id of the batch running operation over paths (in this order)."""
+        digest = hashlib.sha256(operation.encode())
+        for path in paths:
+            digest.update(b'\0' + JobJournal._normalize(path).encode('utf-8', 'surrogateescape'))
+        return digest.hexdigest()
+
+    def begin(self, operation, paths):
+        """
+        Start or resume a batch; files not journaled yet are added as JOB_PENDING.
+
+        Returns:
+            Batch id
+        """
+        batch = self.batch_id(operation, paths)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO batches (id, operation, created) VALUES (?, ?, ?)",
+                (batch, operation, now)
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO jobs (batch, path, state, updated) VALUES (?, ?, ?, ?)",
+                [(batch, self._normalize(path), JOB_PENDING, now) for path in paths]
+            )
+        return batch
+
+    def states(self, batch):
+        """
+        Returns:
+            Dictionary mapping normalized path to (state, output path or None,
+            error or None, input fingerprint (size, mtime_ns) or None)
+        """
+        with self._lock:
+            return {
+                path: (state, output, error, self._fingerprint(size, mtime_ns))
+                for path, state, output, error, size, mtime_ns in self._conn.execute(
+                    "SELECT path, state, output, error, size, mtime_ns FROM jobs WHERE batch = ?", (batch,))
+            }
+
+    def state(self, batch, path):
+        """(state, output, error, fingerprint) of one file, or None if it is not in the batch."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, output, error, size, mtime_ns FROM jobs WHERE batch = ? AND path = ?",
+                (batch, self._normalize(path))
+            ).fetchone()
+        return None if row is None else row[:3] + (self._fingerprint(*row[3:]),)
+
+    @staticmethod
+    def _fingerprint(size, mtime_ns):
+        return None if size is None else (size, mtime_ns)
+
+    def set_state(self, batch, path, state, output=None, error=None, fingerprint=None):
+        """
+        Record a file's new state.
+
+        The output path and input fingerprint (size, mtime_ns) are kept
+        unless new ones are given.
+        """
+        size, mtime_ns = fingerprint if fingerprint is not None else (None, None)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, output = COALESCE(?, output), error = ?, "
+                "size = COALESCE(?, size), mtime_ns = COALESCE(?, mtime_ns), updated = ? "
+                "WHERE batch = ? AND path = ?",
+                (state, output and self._normalize(output), error, size, mtime_ns, time.time(),
+                 batch, self._normalize(path))
+            )
+
+    def set_states(self, batch, entries):
+        """Record several (path, state, output) changes in one transaction."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE jobs SET state = ?, output = COALESCE(?, output), error = NULL, updated = ? "
+                "WHERE batch = ? AND path = ?",
+                [(state, output and self._normalize(output), now, batch, self._normalize(path))
+                 for path, state, output in entries]
+            )
+
+    def forget(self, batch):
+        """Drop a batch, e.g. once a run of it completed."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE batch = ?", (batch,))
+            self._conn.execute("DELETE FROM batches WHERE id = ?", (batch,))
@@ -0,0 +1,150 @@
+"""
+In-process cache of password-derived keys.
+"""
+
+import ctypes
+import hashlib
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from config import *
+
+
+def _lock_memory(address, size):
+    """Best-effort page lock so cached keys are not swapped to disk."""
+    try:
+        if sys.platform == 'win32':
+            return bool(ctypes.windll.kernel32.VirtualLock(ctypes.c_void_p(address), ctypes.c_size_t(size)))
+        libc = ctypes.CDLL(None)
+        return libc.mlock(ctypes.c_void_p(address), ctypes.c_size_t(size)) == 0
+    except Exception:
+        return False
+
+
+def _unlock_memory(address, size):
+    """Undo _lock_memory."""
+    try:
+        if sys.platform == 'win32':
+            ctypes.windll.kernel32.VirtualUnlock(ctypes.c_void_p(address), ctypes.c_size_t(size))
+        else:
+            ctypes.CDLL(None).munlock(ctypes.c_void_p(address), ctypes.c_size_t(size))
+    except Exception:
+        pass
+
+
+class _CachedKey:
+    """A derived key held in a locked, zeroizable buffer."""
+
+    def __init__(self, key, expires_at):
+        self.buffer = bytearray(key)
+        self.expires_at = expires_at
+        self._view = (ctypes.c_char * len(self.buffer)).from_buffer(self.buffer)
+        self._locked = _lock_memory(ctypes.addressof(self._view), len(self.buffer))
+
+    def value(self):
+        return bytes(self.buffer)
+
+    def zeroize(self):
+        ctypes.memset(ctypes.addressof(self._view), 0, len(self.buffer))
+        if self._locked:
+            _unlock_memory(ctypes.addressof(self._view), len(self.buffer))
+            self._locked = False
+
+
+class DerivedKeyCache:
+    """
+    Bounded LRU cache of PBKDF2-derived keys with TTL expiry.
+
+    Entries are keyed by salt and an HMAC fingerprint of the password under a
+    per-process random secret, so the password itself is never stored. Key
+    buffers are page-locked where the OS allows it and overwritten with zeros
+    when evicted, expired or cleared. Note that callers receive a bytes copy,
+    which Python cannot zeroize.
+    """
+
+    def __init__(self, max_entries=KEY_CACHE_MAX_ENTRIES, ttl=KEY_CACHE_TTL):
+        """
+        Initialize key cache.
+
+        Args:
+            max_entries: Maximum number of cached keys before LRU eviction
+            ttl: Seconds after which a cached key expires
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._secret = os.urandom(32)
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _cache_key(self, password, salt):
+        fingerprint = hmac.new(self._secret, password.encode(), hashlib.sha256).digest()
+        return bytes(salt), fingerprint
+
+    def _purge_expired(self, now):
+        expired = [k for k, entry in self._entries.items() if entry.expires_at <= now]
+        for k in expired:
+            self._entries.pop(k).zeroize()
+
+    def get(self, password, salt):
+        """Return the cached key for (password, salt), or None."""
+        cache_key = self._cache_key(password, salt)
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(cache_key)
+            return entry.value()
+
+    def put(self, password, salt, key):
+        """Cache a derived key, evicting the least recently used entries."""
+        cache_key = self._cache_key(password, salt)
+        with self._lock:
+            old = self._entries.pop(cache_key, None)
+            if old is not None:
+                old.zeroize()
+            self._entries[cache_key] = _CachedKey(key, time.monotonic() + self.ttl)
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                evicted.zeroize()
+
+    def get_or_derive(self, password, salt, derive):
+        """
+        Return the cached key, calling derive() on a miss.
+
+        Concurrent callers asking for the same (password, salt) wait for a
+        single derivation instead of each running the KDF.
+        """
+        key = self.get(password, salt)
+        if key is not None:
+            return key
+
+        cache_key = self._cache_key(password, salt)
+        with self._lock:
+            pending = self._pending.setdefault(cache_key, threading.Lock())
+
+        with pending:
+            key = self.get(password, salt)
+            if key is None:
+                key = derive()
+                self.put(password, salt, key)
+
+        with self._lock:
+            self._pending.pop(cache_key, None)
+        return key
+
+    def clear(self):
+        """Zeroize and drop every cached key."""
+        with self._lock:
+            for entry in self._entries.values():
+                entry.zeroize()
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            return len(self._entries)
@@ -6,6 +6,8 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
 import threading
+import multiprocessing
+import time
 from config import *
 from ui_components import FileListFrame, PasswordEntryFrame, ProgressFrame, SearchFrame
 
@@ -13,6 +15,7 @@ from ui_components import FileListFrame, PasswordEntryFrame, ProgressFrame, Sear
 _crypto_handler = None
 _file_manager = None
 _batch_processor = None
+_file_index = None
 
 
 def _load_crypto():
@@ -34,6 +37,18 @@ def _load_file_manager():
     return _file_manager, _batch_processor
 
 
+def _load_file_index():
+    """Lazy open the persistent search index; None if it cannot be opened."""
+    global _file_index
+    if _file_index is None:
+        try:
+            from file_index import FileIndex
+            _file_index = FileIndex(INDEX_DB_PATH)
+        except Exception:
+            return None
+    return _file_index
+
+
 class FileEncryptorApp:
     """Main application class."""
 
@@ -46,8 +61,13 @@ class FileEncryptorApp:
         self.mode_var = tk.IntVar(value=MODE_PASSWORD)
         self.key_file_path = None
         self.delete_originals_var = tk.BooleanVar(value=False)
+        self.codec_var = tk.StringVar(value=CODEC_NAMES[CODEC_AUTO])
+        self._search_cancel = None
+        self._search_id = 0
+        self._warmup_cancel = None
 
         self.setup_ui()
+        self.root.protocol('WM_DELETE_WINDOW', self.on_close)
         
         # Pre-load heavy modules after UI appears but before user interacts
         # Schedule after 100ms to ensure UI is fully rendered
@@ -85,7 +105,7 @@ class FileEncryptorApp:
         ttk.Button(button_frame, text='Clear All', command=self.clear_files).pack(side='left', padx=2)
 
         # Search frame
-        self.search_frame = SearchFrame(top_frame, search_callback=self.do_search)
+        self.search_frame = SearchFrame(top_frame, search_callback=self.do_search, cancel_callback=self.cancel_search)
         self.search_frame.pack(fill='x')
 
         # Middle section - File list
@@ -154,6 +174,16 @@ class FileEncryptorApp:
             variable=self.delete_originals_var
         ).pack(side='left')
 
+        from compression import available_codecs
+        ttk.Combobox(
+            options_frame,
+            textvariable=self.codec_var,
+            values=[CODEC_NAMES[CODEC_AUTO]] + [CODEC_NAMES[c] for c in available_codecs()],
+            state='readonly',
+            width=12
+        ).pack(side='right')
+        ttk.Label(options_frame, text='Compression:').pack(side='right', padx=5)
+
         # Action buttons
         action_frame = ttk.Frame(bottom_frame)
         action_frame.pack(fill='x', pady=(0, 10))
@@ -202,25 +232,109 @@ class FileEncryptorApp:
         self.file_list.clear()
 
     def do_search(self, directory, pattern, recursive, only_locked):
-        """Execute file search."""
-        try:
-            FileManager, _ = _load_file_manager()
-            results = FileManager.search_files(
-                directory,
-                pattern=pattern,
-                recursive=recursive,
-                only_locked=only_locked
-            )
+        """Start a file search in the background, streaming results into the list."""
+        if self._search_cancel is not None:
+            return
+
+        cancel = threading.Event()
+        self._search_cancel = cancel
+        # A new search takes over from the index warm-up of the last one
+        self._stop_warmup()
+        warmup = threading.Event()
+        self._warmup_cancel = warmup
+        self._search_id += 1
+        search_id = self._search_id
+        self.file_list.clear()
+        self.search_frame.set_searching(True)
+
+        def search_thread():
+            found = 0
+            batch = []
+            start = last_flush = time.monotonic()
+            error = None
+            index = _load_file_index()
+            # Patterns with directory levels (e.g. 'sub/*.txt') look below the top level either way
+            from file_index import split_pattern
+            deep = recursive or len(split_pattern(pattern)) > 1
+            # A cold (or only partly warmed) index would hold back every result until the tree is
+            # re-listed; stream from the concurrent walker instead and warm the index afterwards
+            use_index = index is not None and index.is_warm(directory, deep)
+            try:
+                FileManager, _ = _load_file_manager()
+                results = FileManager.iter_search(
+                    directory,
+                    pattern=pattern,
+                    recursive=recursive,
+                    only_locked=only_locked,
+                    index=index if use_index else None,
+                    cancel=cancel
+                )
+                try:
+                    for filepath in results:
+                        if cancel.is_set():
+                            break
+                        batch.append(filepath)
+                        found += 1
+                        now = time.monotonic()
+                        # Hand results over in batches so the event queue is not flooded
+                        if len(batch) >= SEARCH_BATCH_SIZE or now - last_flush >= SEARCH_UPDATE_INTERVAL:
+                            self.root.after(0, self._add_search_results, search_id, batch, found, now - start)
+                            batch = []
+                            last_flush = now
+                finally:
+                    results.close()
+            except Exception as e:
+                error = e
+
+            elapsed = time.monotonic() - start
+            self.root.after(0, self._finish_search, search_id, batch, found, elapsed, cancel.is_set(), error)
+
+            if index is not None and not use_index and error is None and not cancel.is_set():
+                try:
+                    index.refresh(directory, recursive=deep, cancel=warmup)
+                except Exception:
+                    # The index is only an accelerator; the next search walks again
+                    pass
+
+        threading.Thread(target=search_thread, daemon=True).start()
+
+    def cancel_search(self):
+        """Stop the running search, or the index warm-up after it; results found so far stay in the list."""
+        if self._search_cancel is not None:
+            self._search_cancel.set()
+        self._stop_warmup()
+
+    def _stop_warmup(self):
+        """Stop refreshing the index after a search that walked the tree; what was indexed is kept."""
+        if self._warmup_cancel is not None:
+            self._warmup_cancel.set()
+            self._warmup_cancel = None
+
+    def on_close(self):
+        """Stop background searches and index refreshes, then close the window."""
+        self.cancel_search()
+        self.root.destroy()
+
+    def _add_search_results(self, search_id, batch, found, elapsed):
+        """Append a batch of search results (runs on the Tk thread)."""
+        if search_id != self._search_id:
+            return
+        self.file_list.add_files(batch)
+        self.search_frame.set_status(found, elapsed)
 
-            if results:
-                self.file_list.clear()
-                self.file_list.add_files(results)
-                messagebox.showinfo('Search Complete', f'Found {len(results)} file(s)')
-            else:
-                messagebox.showinfo('Search Complete', 'No files found')
+    def _finish_search(self, search_id, batch, found, elapsed, cancelled, error):
+        """Add the last batch and report the outcome (runs on the Tk thread)."""
+        if search_id != self._search_id:
+            return
+        self.file_list.add_files(batch)
+        self.search_frame.set_status(found, elapsed, finished=True, cancelled=cancelled)
+        self.search_frame.set_searching(False)
+        self._search_cancel = None
 
-        except Exception as e:
-            messagebox.showerror('Search Error', f'Error searching files: {str(e)}')
+        if error is not None:
+            messagebox.showerror('Search Error', f'Error searching files: {str(error)}')
+        elif not cancelled and not found:
+            messagebox.showinfo('Search Complete', 'No files found')
 
     def load_key_file(self):
         """Load an encryption key file."""
@@ -314,17 +428,24 @@ class FileEncryptorApp:
         ):
             return
 
+        codec = next(c for c, name in CODEC_NAMES.items() if name == self.codec_var.get())
+
         # Run encryption in thread
         def encrypt_thread():
             try:
                 _, BatchProcessor = _load_file_manager()
-                processor = BatchProcessor(progress_callback=self.update_progress)
+                processor = BatchProcessor(
+                    byte_progress_callback=self.update_progress,
+                    max_workers=DEFAULT_MAX_WORKERS,
+                    file_index=_load_file_index()
+                )
                 results = processor.batch_encrypt(
                     selected,
                     params['mode'],
                     password=params['password'],
                     key=params['key'],
-                    delete_originals=self.delete_originals_var.get()
+                    delete_originals=self.delete_originals_var.get(),
+                    codec=codec
                 )
 
                 self.root.after(0, lambda: self.show_results('Encryption', results))
@@ -368,7 +489,11 @@ class FileEncryptorApp:
         def decrypt_thread():
             try:
                 _, BatchProcessor = _load_file_manager()
-                processor = BatchProcessor(progress_callback=self.update_progress)
+                processor = BatchProcessor(
+                    byte_progress_callback=self.update_progress,
+                    max_workers=DEFAULT_MAX_WORKERS,
+                    file_index=_load_file_index()
+                )
                 results = processor.batch_decrypt(
                     selected,
                     password=params['password'],
@@ -386,9 +511,12 @@ class FileEncryptorApp:
 
         threading.Thread(target=decrypt_thread, daemon=True).start()
 
-    def update_progress(self, current, total, message):
-        """Update progress bar from worker thread."""
-        self.root.after(0, lambda: self.progress_frame.update_progress(current, total, message))
+    def update_progress(self, info):
+        """Update progress bar from worker thread (info is a byte progress dict)."""
+        self.progress_frame.post_progress(
+            info['bytes_done'], info['bytes_total'],
+            f"{info['message']} [{info['files_done']}/{info['files_total']}]", info['rate'], info['eta']
+        )
 
     def show_results(self, operation, results):
         """Show operation results."""
@@ -415,6 +543,8 @@ class FileEncryptorApp:
 
 def main():
     """Main entry point."""
+    # Required for the batch process pool in frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = FileEncryptorApp(root)
     root.mainloop()
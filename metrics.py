@@ -0,0 +1,255 @@
+"""
+Structured performance metrics for encryption jobs.
+
+A Metrics object collects per-stage timers and byte counts (key derivation,
+archiving, reading, compression, cipher work, writing, deleting) and a
+histogram of per-file latencies. CryptoHandler and BatchProcessor record
+into it when one is passed in; without one nothing is measured.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from config import *
+
+
+def _throughput(nbytes, seconds):
+    return nbytes / (1024 * 1024) / seconds if seconds > 0 else 0.0
+
+
+class Metrics:
+    """
+    Thread-safe collector of stage timings, byte counts and file latencies.
+
+    Stage seconds are summed over every thread that did the work, so with
+    parallel cipher workers a stage can add up to more than the wall time.
+    The archive stage covers building or extracting folder archives, which
+    for streamed folders includes the read, cipher and write time inside.
+
+    Events (dicts with an 'event' key) go to the callback and, if set, are
+    appended to jsonl_path as JSON lines. BatchProcessor emits a 'file' event
+    per file and a 'summary' event per batch; prometheus_path is rewritten in
+    the Prometheus text format at every summary.
+    """
+
+    def __init__(self, callback=None, jsonl_path=None, prometheus_path=None):
+        self.callback = callback
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._stages = {}  # name -> [seconds, calls, bytes]
+        self._buckets = [0] * (len(METRICS_LATENCY_BUCKETS) + 1)  # last bucket is +Inf
+        self._files = [0, 0, 0, 0.0, 0.0]  # count, failed, bytes, seconds, max seconds
+
+    def add(self, stage, seconds, nbytes=0):
+        """Record one timed piece of work in a stage."""
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                self._stages[stage] = [seconds, 1, nbytes]
+            else:
+                entry[0] += seconds
+                entry[1] += 1
+                entry[2] += nbytes
+
+    @contextmanager
+    def stage(self, name, nbytes=0):
+        """Time the body of a with-block as one call of a stage."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started, nbytes)
+
+    def stage_bytes(self, name):
+        """Bytes recorded so far for a stage."""
+        with self._lock:
+            entry = self._stages.get(name)
+            return entry[2] if entry else 0
+
+    def observe_file(self, seconds, nbytes=0, ok=True):
+        """Record the latency and plaintext size of one finished file."""
+        bucket = next(
+            (i for i, bound in enumerate(METRICS_LATENCY_BUCKETS) if seconds <= bound),
+            len(METRICS_LATENCY_BUCKETS)
+        )
+        with self._lock:
+            self._buckets[bucket] += 1
+            self._files[0] += 1
+            self._files[1] += 0 if ok else 1
+            self._files[2] += nbytes
+            self._files[3] += seconds
+            self._files[4] = max(self._files[4], seconds)
+
+    def snapshot(self):
+        """Plain, picklable copy of the counters (for sending back from worker processes)."""
+        with self._lock:
+            return {
+                'stages': {name: list(entry) for name, entry in self._stages.items()},
+                'buckets': list(self._buckets),
+                'files': list(self._files)
+            }
+
+    def merge(self, snapshot):
+        """Add the counters of a snapshot to this collector."""
+        with self._lock:
+            for name, (seconds, calls, nbytes) in snapshot['stages'].items():
+                entry = self._stages.setdefault(name, [0.0, 0, 0])
+                entry[0] += seconds
+                entry[1] += calls
+                entry[2] += nbytes
+            for i, count in enumerate(snapshot['buckets']):
+                self._buckets[i] += count
+            files = snapshot['files']
+            for i in range(4):
+                self._files[i] += files[i]
+            self._files[4] = max(self._files[4], files[4])
+
+    def emit(self, event, **fields):
+        """Send an event to the callback and the JSON lines file."""
+        fields['event'] = event
+        if self.jsonl_path:
+            with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(fields, default=str) + '\n')
+        if self.callback is not None:
+            self.callback(fields)
+        if event == 'summary' and self.prometheus_path:
+            self.write_prometheus(self.prometheus_path)
+
+    def _percentile(self, buckets, count, q):
+        """Upper bound of the bucket holding the q-th quantile (max latency for +Inf)."""
+        if not count:
+            return 0.0
+        cumulative = 0
+        for bound, n in zip(METRICS_LATENCY_BUCKETS, buckets):
+            cumulative += n
+            if cumulative >= q * count:
+                return bound
+        return self._files[4]
+
+    def summary(self):
+        """
+        Totals since the collector was created.
+
+        Returns:
+            Dictionary with wall_seconds, files (count, failed, bytes,
+            throughput_mbps), stages ({name: seconds, calls, bytes,
+            throughput_mbps}) and latency (count, mean/p50/p95/max seconds,
+            cumulative bucket counts keyed by upper bound)
+        """
+        with self._lock:
+            wall = time.perf_counter() - self._started
+            count, failed, nbytes, seconds, max_seconds = self._files
+            buckets = list(self._buckets)
+            cumulative = 0
+            bucket_counts = {}
+            for bound, n in zip(list(METRICS_LATENCY_BUCKETS) + ['+Inf'], buckets):
+                cumulative += n
+                bucket_counts[str(bound)] = cumulative
+            return {
+                'wall_seconds': wall,
+                'files': {
+                    'count': count,
+                    'failed': failed,
+                    'bytes': nbytes,
+                    'throughput_mbps': _throughput(nbytes, wall)
+                },
+                'stages': {
+                    name: {
+                        'seconds': stage_seconds,
+                        'calls': calls,
+                        'bytes': stage_bytes,
+                        'throughput_mbps': _throughput(stage_bytes, stage_seconds)
+                    }
+                    for name, (stage_seconds, calls, stage_bytes) in self._stages.items()
+                },
+                'latency': {
+                    'count': count,
+                    'sum_seconds': seconds,
+                    'mean_seconds': seconds / count if count else 0.0,
+                    'p50_seconds': self._percentile(buckets, count, 0.5),
+                    'p95_seconds': self._percentile(buckets, count, 0.95),
+                    'max_seconds': max_seconds,
+                    'buckets': bucket_counts
+                }
+            }
+
+    def to_prometheus(self, prefix=METRICS_PROMETHEUS_PREFIX):
+        """Render the totals in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = [
+            f"# HELP {prefix}_stage_seconds_total Time spent per stage, summed over threads.",
+            f"# TYPE {prefix}_stage_seconds_total counter"
+        ]
+        for name, stage in sorted(summary['stages'].items()):
+            lines.append(f'{prefix}_stage_seconds_total{{stage="{name}"}} {stage["seconds"]:.6f}')
+        lines += [
+            f"# HELP {prefix}_stage_bytes_total Bytes processed per stage.",
+            f"# TYPE {prefix}_stage_bytes_total counter"
+        ]
+        for name, stage in sorted(summary['stages'].items()):
+            lines.append(f'{prefix}_stage_bytes_total{{stage="{name}"}} {stage["bytes"]}')
+
+        files = summary['files']
+        latency = summary['latency']
+        lines += [
+            f"# HELP {prefix}_files_total Files processed.",
+            f"# TYPE {prefix}_files_total counter",
+            f"{prefix}_files_total {files['count']}",
+            f"# HELP {prefix}_files_failed_total Files that failed.",
+            f"# TYPE {prefix}_files_failed_total counter",
+            f"{prefix}_files_failed_total {files['failed']}",
+            f"# HELP {prefix}_file_seconds Per-file latency.",
+            f"# TYPE {prefix}_file_seconds histogram"
+        ]
+        for bound, cumulative in latency['buckets'].items():
+            lines.append(f'{prefix}_file_seconds_bucket{{le="{bound}"}} {cumulative}')
+        lines += [
+            f"{prefix}_file_seconds_sum {latency['sum_seconds']:.6f}",
+            f"{prefix}_file_seconds_count {latency['count']}"
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Write to_prometheus() to path atomically (for the node_exporter textfile collector)."""
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+
+class _TimedIO:
+    """File object wrapper that records read() and write() calls in a Metrics stage."""
+
+    def __init__(self, f, metrics, stage):
+        self._f = f
+        self._metrics = metrics
+        self._stage = stage
+
+    def read(self, size=-1):
+        started = time.perf_counter()
+        data = self._f.read(size)
+        self._metrics.add(self._stage, time.perf_counter() - started, len(data))
+        return data
+
+    def write(self, data):
+        started = time.perf_counter()
+        n = self._f.write(data)
+        self._metrics.add(self._stage, time.perf_counter() - started, len(data))
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def timed_stage(metrics, name, nbytes=0):
+    """metrics.stage(name, nbytes), or a no-op context if metrics is None."""
+    return nullcontext() if metrics is None else metrics.stage(name, nbytes)
+
+
+def timed_io(f, metrics, stage):
+    """Wrap f so its reads or writes are timed into metrics; returns f unchanged if metrics is None."""
+    return f if metrics is None else _TimedIO(f, metrics, stage)
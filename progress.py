@@ -0,0 +1,122 @@
+"""
+Byte-level progress with a smoothed throughput and an ETA.
+
+BatchProcessor counts the bytes its jobs process into a ByteCounter (shared
+with worker processes) and a ByteProgress turns those counts into
+rate-limited updates, so a single large file moves the bar and the ETA
+weighs files by size instead of counting them.
+"""
+
+import multiprocessing
+import threading
+import time
+from config import *
+
+
+class ByteCounter:
+    """
+    Byte counter that threads and spawned worker processes can add to.
+
+    It lives in shared memory, so it must reach worker processes through
+    the pool initializer rather than as a job argument.
+    """
+
+    def __init__(self):
+        self._value = multiprocessing.get_context('spawn').Value('q', 0)
+
+    def add(self, nbytes):
+        with self._value.get_lock():
+            self._value.value += nbytes
+
+    @property
+    def value(self):
+        return self._value.value
+
+
+class ByteProgress:
+    """
+    Turns byte counts into progress updates for a batch of known total size.
+
+    update() may be called as often as convenient; the callback runs at most
+    every interval seconds unless forced. It receives a dict with bytes_done,
+    bytes_total, files_done, files_total, percent, rate (bytes per second,
+    exponentially smoothed), eta (seconds, None until a rate is known),
+    elapsed and message.
+    """
+
+    def __init__(self, total_bytes, total_files, callback, interval=PROGRESS_INTERVAL, smoothing=PROGRESS_SMOOTHING):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.callback = callback
+        self.interval = interval
+        self.smoothing = smoothing
+        self.bytes_done = 0
+        self.files_done = 0
+        self.message = ''
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._sample_time = self._started
+        self._sample_bytes = 0
+        self._last_report = None
+        self._rate = None
+
+    def update(self, bytes_done=None, files_done=None, message=None, force=False):
+        """Record the current position and call back if the interval has passed (or force)."""
+        with self._lock:
+            if bytes_done is not None:
+                self.bytes_done = min(max(bytes_done, self.bytes_done), self.total_bytes)
+            if files_done is not None:
+                self.files_done = files_done
+            if message is not None:
+                self.message = message
+
+            now = time.perf_counter()
+            if not force and self._last_report is not None and now - self._last_report < self.interval:
+                return
+            self._last_report = now
+
+            # Rate samples shorter than the interval are too noisy to use
+            elapsed = now - self._sample_time
+            if elapsed >= self.interval:
+                sample = (self.bytes_done - self._sample_bytes) / elapsed
+                self._rate = sample if self._rate is None else self._rate + self.smoothing * (sample - self._rate)
+                self._sample_time = now
+                self._sample_bytes = self.bytes_done
+
+            rate = self._rate
+            if rate is None and self.bytes_done and now > self._started:
+                # Until the first full sample, the average so far is the best estimate
+                rate = self.bytes_done / (now - self._started)
+            remaining = self.total_bytes - self.bytes_done
+            info = {
+                'bytes_done': self.bytes_done,
+                'bytes_total': self.total_bytes,
+                'files_done': self.files_done,
+                'files_total': self.total_files,
+                'percent': 100.0 * self.bytes_done / self.total_bytes if self.total_bytes else 100.0,
+                'rate': rate,
+                'eta': remaining / rate if rate else (0.0 if not remaining else None),
+                'elapsed': now - self._started,
+                'message': self.message
+            }
+        self.callback(info)
+
+
+def format_rate(rate):
+    """Human-readable throughput, e.g. '85.3 MB/s'."""
+    if rate is None:
+        return ''
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if rate < 1024 or unit == 'GB':
+            return f"{rate:.1f} {unit}/s"
+        rate /= 1024
+
+
+def format_eta(seconds):
+    """Remaining time as m:ss or h:mm:ss, or '' if unknown."""
+    if seconds is None:
+        return ''
+    seconds = int(seconds + 0.5)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
@@ -3,11 +3,32 @@ Test script for encryption/decryption functionality.
 """
 
 import os
+import io
+import json
+import subprocess
+import sys
 import tempfile
+import time
 import shutil
+from pathlib import Path
+from contextlib import redirect_stdout
 from crypto_handler import CryptoHandler
-from file_manager import FileManager
-from config import MODE_PASSWORD, MODE_KEYFILE
+from file_manager import FileManager, BatchProcessor
+from file_index import FileIndex
+from key_cache import DerivedKeyCache
+from chunk_store import ChunkStore
+from metrics import Metrics
+from progress import ByteProgress
+from job_journal import JobJournal
+import benchmark
+from config import (
+    APPEND_BACKUP_SUFFIX, MSG_APPEND_PENDING, TEMP_FILE_PREFIX,
+    JOB_COMMITTED, JOB_FAILED, JOB_ORIGINAL_DELETED, JOB_WRITING,
+    DURABILITY_FILE, DURABILITY_BATCH, DURABILITY_NONE, EXECUTOR_THREAD,
+    MODE_PASSWORD, MODE_KEYFILE, CHUNK_SIZE, EXT_KEY_NONCE, EXT_CHUNK_STORE, PAYLOAD_TAR, PAYLOAD_ARCHIVE,
+    CODEC_AUTO, CODEC_NONE, CODEC_DEFLATE,
+    FOOTER_SIZE, CIPHER_FERNET, CIPHER_AES_GCM, CIPHER_CHACHA20_POLY1305
+)
 
 
 def test_password_encryption():
@@ -241,6 +262,23 @@ def test_file_search():
         assert len(results) == 3, f"Expected 3 files in root, found {len(results)}"
         print(f"✓ Non-recursive search: {len(results)}")
 
+        # Patterns with a directory part match like Path.glob, with or without the index
+        os.makedirs(os.path.join(subdir, 'more', 'subdir'))
+        for name in ('more/test4.txt', 'more/subdir/test5.txt'):
+            with open(os.path.join(subdir, *name.split('/')), 'w') as f:
+                f.write("test")
+        with FileIndex(':memory:') as index:
+            for pattern in ('subdir/*.txt', 'sub*/test3.*', '*/*.txt', 'subdir/more/*'):
+                for recursive in (True, False):
+                    glob = ('**/' if recursive else '') + pattern
+                    expected = sorted(str(p) for p in Path(temp_dir).glob(glob) if p.is_file())
+                    assert expected, f"No files for {glob}"
+                    for search_index in (None, index):
+                        results = FileManager.search_files(temp_dir, pattern=pattern, recursive=recursive,
+                                                           index=search_index)
+                        assert results == expected, f"{glob} (index={search_index}): {results}"
+        print("✓ Patterns with directories match")
+
         # Clean up
         shutil.rmtree(temp_dir)
 
@@ -254,6 +292,1633 @@ def test_file_search():
         return False
 
 
+def test_chunked_encryption():
+    """Test multi-chunk files, version 1 compatibility and truncation detection."""
+    print("Testing chunked encryption...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        # File spanning several chunks with a partial last chunk
+        data = os.urandom(CHUNK_SIZE * 2 + 12345)
+        plain_file = os.path.join(temp_dir, 'big.bin')
+        with open(plain_file, 'wb') as f:
+            f.write(data)
+
+        encrypted_file = plain_file + '.locked'
+        CryptoHandler.encrypt_file(plain_file, encrypted_file, MODE_PASSWORD, password='chunktest123')
+        header = CryptoHandler.parse_file_header(encrypted_file)
+        assert header['version'] == 2, "Expected version 2 header"
+        print("✓ Version 2 file written")
+
+        decrypt_dir = os.path.join(temp_dir, 'out')
+        os.makedirs(decrypt_dir)
+        result = CryptoHandler.decrypt_file(encrypted_file, decrypt_dir, password='chunktest123')
+        with open(result['output_path'], 'rb') as f:
+            assert f.read() == data, "Content mismatch"
+        print("✓ Multi-chunk content verified")
+
+        # Dropping the final chunk must be detected, and no output left behind
+        truncated_file = os.path.join(temp_dir, 'truncated.locked')
+        with open(encrypted_file, 'rb') as f:
+            blob = f.read()
+        with open(truncated_file, 'wb') as f:
+            f.write(blob[:len(blob) - CHUNK_SIZE // 2])
+        truncated_dir = os.path.join(temp_dir, 'truncated')
+        os.makedirs(truncated_dir)
+        try:
+            CryptoHandler.decrypt_file(truncated_file, truncated_dir, password='chunktest123')
+            print("✗ Truncated file should have failed!")
+            return False
+        except ValueError:
+            assert not os.listdir(truncated_dir), "Partial output left behind"
+            print("✓ Truncated file rejected")
+
+        # Version 1 files (single Fernet token) still decrypt
+        key, salt = CryptoHandler.derive_key_from_password('legacytest123')
+        filename = b'legacy.txt'
+        legacy_file = os.path.join(temp_dir, 'legacy.txt.locked')
+        with open(legacy_file, 'wb') as f:
+            f.write(b'FLCK' + bytes([1, MODE_PASSWORD]) + salt + b'\x00')
+            f.write(len(filename).to_bytes(2, 'big') + filename)
+            f.write(CryptoHandler.encrypt_data(b'legacy content', key))
+        legacy_dir = os.path.join(temp_dir, 'legacy')
+        os.makedirs(legacy_dir)
+        result = CryptoHandler.decrypt_file(legacy_file, legacy_dir, password='legacytest123')
+        with open(result['output_path'], 'rb') as f:
+            assert f.read() == b'legacy content', "Legacy content mismatch"
+        print("✓ Version 1 file decrypted")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Chunked encryption test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Chunked encryption test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_aead_ciphers():
+    """Test binary AEAD chunk ciphers and header authentication."""
+    print("Testing AEAD ciphers...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        data = os.urandom(CHUNK_SIZE + 1000)
+        plain_file = os.path.join(temp_dir, 'data.bin')
+        with open(plain_file, 'wb') as f:
+            f.write(data)
+
+        key = CryptoHandler.generate_key_file(os.path.join(temp_dir, 'test.key'))
+        sizes = {}
+        for cipher in (CIPHER_FERNET, CIPHER_AES_GCM, CIPHER_CHACHA20_POLY1305):
+            encrypted_file = os.path.join(temp_dir, f'data{cipher}.locked')
+            CryptoHandler.encrypt_file(plain_file, encrypted_file, MODE_KEYFILE, key=key, cipher=cipher)
+            sizes[cipher] = os.path.getsize(encrypted_file)
+
+            out_dir = os.path.join(temp_dir, f'out{cipher}')
+            os.makedirs(out_dir)
+            result = CryptoHandler.decrypt_file(encrypted_file, out_dir, key=key)
+            with open(result['output_path'], 'rb') as f:
+                assert f.read() == data, f"Content mismatch for cipher {cipher}"
+        print("✓ All ciphers round-trip")
+
+        # Binary AEAD output has a small constant overhead, Fernet's base64 does not
+        assert sizes[CIPHER_AES_GCM] - len(data) < 200, "AES-GCM overhead too large"
+        assert sizes[CIPHER_FERNET] > len(data) * 1.3, "Expected base64 expansion for Fernet"
+        print(f"✓ AES-GCM overhead: {sizes[CIPHER_AES_GCM] - len(data)} bytes")
+
+        # Tampering with the header (original filename) must be detected for every cipher
+        for cipher in (CIPHER_FERNET, CIPHER_AES_GCM, CIPHER_CHACHA20_POLY1305):
+            encrypted_file = os.path.join(temp_dir, f'data{cipher}.locked')
+            with open(encrypted_file, 'rb') as f:
+                blob = f.read()
+            tampered_file = os.path.join(temp_dir, 'tampered.locked')
+            with open(tampered_file, 'wb') as f:
+                f.write(blob.replace(b'data.bin', b'evil.bin', 1))
+            try:
+                CryptoHandler.decrypt_file(tampered_file, temp_dir, key=key)
+                print(f"✗ Tampered header should have failed for cipher {cipher}!")
+                return False
+            except ValueError:
+                pass
+        print("✓ Tampered header rejected")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ AEAD cipher test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ AEAD cipher test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_key_cache():
+    """Test derived-key cache hits, LRU eviction, TTL and zeroization."""
+    print("Testing derived-key cache...")
+
+    try:
+        calls = []
+
+        def derive(value):
+            def _derive():
+                calls.append(value)
+                return value
+            return _derive
+
+        cache = DerivedKeyCache(max_entries=2, ttl=60)
+        assert cache.get_or_derive('pw', b'salt1', derive(b'k1')) == b'k1'
+        assert cache.get_or_derive('pw', b'salt1', derive(b'other')) == b'k1'
+        assert calls == [b'k1'], "Cached key should not be derived twice"
+        assert cache.get('other-pw', b'salt1') is None, "Different password must miss"
+        print("✓ Cache hit on same password and salt")
+
+        entry = cache._entries[next(iter(cache._entries))]
+        cache.put('pw', b'salt2', b'k2')
+        cache.put('pw', b'salt3', b'k3')
+        assert cache.get('pw', b'salt1') is None, "LRU entry should be evicted"
+        assert entry.buffer == bytearray(2), "Evicted key should be zeroized"
+        print("✓ LRU eviction zeroizes keys")
+
+        cache.ttl = 0
+        cache.put('pw', b'salt4', b'k4')
+        assert cache.get('pw', b'salt4') is None, "Expired key should miss"
+        cache.clear()
+        assert len(cache) == 0
+        print("✓ TTL expiry and clear")
+
+        # decrypt_file reuses the cached key for the same file
+        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.txt') as f:
+            f.write("cached key content")
+            temp_file = f.name
+        encrypted_file = temp_file + '.locked'
+        CryptoHandler.encrypt_file(temp_file, encrypted_file, MODE_PASSWORD, password='cachetest123')
+
+        cache = DerivedKeyCache()
+        decrypt_dir = tempfile.mkdtemp()
+        for _ in range(2):
+            result = CryptoHandler.decrypt_file(
+                encrypted_file, decrypt_dir, password='cachetest123', key_cache=cache
+            )
+        assert len(cache) == 1, "Expected one cached key"
+        with open(result['output_path'], 'r') as f:
+            assert f.read() == "cached key content", "Content mismatch"
+        print("✓ decrypt_file uses the cache")
+
+        # Batch encryption in this process uses the processor's cache, and zeroizes a private one afterwards
+        import file_manager
+        store_dir = os.path.join(decrypt_dir, 'store')
+        worker_keys = len(file_manager._worker_key_cache or ())
+        shared = DerivedKeyCache()
+        BatchProcessor(key_cache=shared, executor=EXECUTOR_THREAD).batch_encrypt(
+            [temp_file], MODE_PASSWORD, password='cachetest123', chunk_store=store_dir)
+        assert len(shared) == 1, "Store key should be cached in the processor's cache"
+        processor = BatchProcessor(executor=EXECUTOR_THREAD)
+        processor.batch_encrypt([temp_file], MODE_PASSWORD, password='cachetest123', chunk_store=store_dir)
+        assert len(processor.key_cache) == 0, "Private cache should be cleared after the batch"
+        assert len(file_manager._worker_key_cache or ()) == worker_keys, "The worker cache was used in this process"
+        print("✓ Batch encryption keeps keys only in the processor's cache")
+
+        os.remove(temp_file)
+        os.remove(encrypted_file)
+        shutil.rmtree(decrypt_dir)
+
+        print("✓ Key cache test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Key cache test FAILED: {e}\n")
+        return False
+
+
+def test_session_key_batch():
+    """Test batch encryption with a single session key derivation."""
+    print("Testing session key batch encryption...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        files = []
+        for i in range(4):
+            path = os.path.join(temp_dir, f'session{i}.txt')
+            with open(path, 'w') as f:
+                f.write(f"Session file {i}")
+            files.append(path)
+
+        processor = BatchProcessor()
+        results = processor.batch_encrypt(files, MODE_PASSWORD, password='sessiontest123', session_key=True)
+        assert len(results['success']) == 4, f"Encryption failed: {results['failed']}"
+
+        headers = [CryptoHandler.parse_file_header(f + '.locked') for f in files]
+        assert len({h['salt'] for h in headers}) == 1, "Batch should share one salt"
+        assert len({h['extensions'][EXT_KEY_NONCE] for h in headers}) == 4, "Nonces must be unique"
+        print("✓ One salt, unique per-file nonces")
+
+        for path in files:
+            os.remove(path)
+
+        cache = DerivedKeyCache()
+        processor = BatchProcessor(key_cache=cache)
+        results = processor.batch_decrypt([f + '.locked' for f in files], password='sessiontest123')
+        assert len(results['success']) == 4, f"Decryption failed: {results['failed']}"
+        assert len(cache) == 1, "Session master key should be derived once"
+        for i, path in enumerate(files):
+            with open(path, 'r') as f:
+                assert f.read() == f"Session file {i}", "Content mismatch"
+        print("✓ Batch decrypted with one key derivation")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Session key batch test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Session key batch test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_parallel_batch():
+    """Test parallel batch processing with thread and process pools."""
+    print("Testing parallel batch processing...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        files = []
+        for i in range(6):
+            path = os.path.join(temp_dir, f'parallel{i}.txt')
+            with open(path, 'w') as f:
+                f.write(f"Parallel file {i}")
+            files.append(path)
+        missing = os.path.join(temp_dir, 'missing.txt')
+
+        key = CryptoHandler.generate_key_file(os.path.join(temp_dir, 'parallel.key'))
+        progress = []
+        processor = BatchProcessor(
+            progress_callback=lambda c, t, m: progress.append((c, t)),
+            max_workers=3
+        )
+
+        # Key file jobs run on a thread pool
+        results = processor.batch_encrypt(files + [missing], MODE_KEYFILE, key=key)
+        assert results['success'] == files, "Success list should keep input order"
+        assert [f for f, _ in results['failed']] == [missing], "Missing file should fail"
+        assert progress[-1] == (7, 7), "Final progress should be complete"
+        print("✓ Thread pool batch with failure reporting")
+
+        # Password jobs run on a process pool
+        password_files = files[:2]
+        results = processor.batch_encrypt(password_files, MODE_PASSWORD, password='paralleltest123')
+        assert results['success'] == password_files, f"Process pool failed: {results['failed']}"
+        for path in password_files:
+            os.remove(path)
+        results = processor.batch_decrypt(
+            [f + '.locked' for f in password_files], password='paralleltest123', delete_encrypted=True
+        )
+        assert results['success'] == [f + '.locked' for f in password_files], f"Failed: {results['failed']}"
+        with open(password_files[0], 'r') as f:
+            assert f.read() == "Parallel file 0", "Content mismatch"
+        print("✓ Process pool batch round-trip")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Parallel batch test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Parallel batch test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_streaming_folder_batch():
+    """Test folder encryption streamed without a temporary archive (archive and tar layouts)."""
+    print("Testing streaming folder batch...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        folder = os.path.join(temp_dir, 'project')
+        os.makedirs(os.path.join(folder, 'src', 'pkg'))
+        os.makedirs(os.path.join(folder, 'empty'))
+        contents = {
+            'readme.txt': b'read me',
+            os.path.join('src', 'main.py'): b'print("hi")',
+            os.path.join('src', 'pkg', 'data.bin'): os.urandom(CHUNK_SIZE + 77)
+        }
+        for name, data in contents.items():
+            with open(os.path.join(folder, name), 'wb') as f:
+                f.write(data)
+
+        key = CryptoHandler.generate_key_file(os.path.join(temp_dir, 'folder.key'))
+        processor = BatchProcessor()
+        results = processor.batch_encrypt([folder], MODE_KEYFILE, key=key, delete_originals=True)
+        assert results['success'] == [folder], f"Encryption failed: {results['failed']}"
+        assert not os.path.exists(folder), "Original folder should be deleted"
+
+        header = CryptoHandler.parse_file_header(folder + '.locked')
+        assert header['payload_type'] == PAYLOAD_ARCHIVE, "Folder should be stored as a member archive"
+        assert header['original_filename'] == 'project'
+        print("✓ Folder streamed into encrypted archive")
+
+        results = processor.batch_decrypt([folder + '.locked'], key=key)
+        assert results['success'] == [folder + '.locked'], f"Decryption failed: {results['failed']}"
+        for name, data in contents.items():
+            with open(os.path.join(folder, name), 'rb') as f:
+                assert f.read() == data, f"Content mismatch for {name}"
+        assert os.path.isdir(os.path.join(folder, 'empty')), "Empty folder should be restored"
+        print("✓ Folder extracted from the archive")
+
+        # Folders stored as a tar stream by earlier versions still decrypt
+        with CryptoHandler.open_encrypt_writer(folder + '.locked', MODE_KEYFILE, 'project', key=key,
+                                               payload_type=PAYLOAD_TAR) as writer:
+            FileManager.stream_folder(folder, writer)
+        shutil.rmtree(folder)
+        results = processor.batch_decrypt([folder + '.locked'], key=key)
+        assert results['success'] == [folder + '.locked'], f"Decryption failed: {results['failed']}"
+        for name, data in contents.items():
+            with open(os.path.join(folder, name), 'rb') as f:
+                assert f.read() == data, f"Content mismatch for {name}"
+        print("✓ Tar folder extracted straight from decryption")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Streaming folder batch test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Streaming folder batch test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_compression_codecs():
+    """Test chunk compression and the incompressible-data skip heuristic."""
+    print("Testing compression codecs...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        key = CryptoHandler.generate_key_file(os.path.join(temp_dir, 'codec.key'))
+        text = b"compressible line of text\n" * 100000
+        cases = [
+            ('text.txt', text, CODEC_DEFLATE, CODEC_DEFLATE),
+            ('auto.txt', text, CODEC_AUTO, None),
+            ('random.bin', os.urandom(200000), CODEC_DEFLATE, CODEC_NONE),
+            ('photo.jpg', text, CODEC_DEFLATE, CODEC_NONE)
+        ]
+        for name, data, requested, expected in cases:
+            plain_file = os.path.join(temp_dir, name)
+            with open(plain_file, 'wb') as f:
+                f.write(data)
+            encrypted_file = plain_file + '.locked'
+            CryptoHandler.encrypt_file(plain_file, encrypted_file, MODE_KEYFILE, key=key, codec=requested)
+
+            header = CryptoHandler.parse_file_header(encrypted_file)
+            if expected is not None:
+                assert header['codec'] == expected, f"{name}: expected codec {expected}, got {header['codec']}"
+            if header['codec'] != CODEC_NONE:
+                assert os.path.getsize(encrypted_file) < len(data) // 10, f"{name} was not compressed"
+
+            os.remove(plain_file)
+            result = CryptoHandler.decrypt_file(encrypted_file, temp_dir, key=key)
+            with open(result['output_path'], 'rb') as f:
+                assert f.read() == data, f"Content mismatch for {name}"
+        print("✓ Compressed and skipped files round-trip")
+
+        # Every codec stops at the size limit instead of inflating a whole oversized chunk
+        from compression import available_codecs, get_codec
+        for codec_id in available_codecs():
+            codec = get_codec(codec_id)
+            if codec is None:
+                continue
+            bomb = codec.compress(bytes(64 * 1024 * 1024))
+            try:
+                codec.decompress(bomb, CHUNK_SIZE)
+                assert False, f"Codec {codec_id} decompressed past its limit"
+            except ValueError:
+                pass
+            assert codec.decompress(codec.compress(text), len(text)) == text
+        print("✓ Decompression bounded for every available codec")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Compression codec test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Compression codec test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_parallel_chunk_pipeline():
+    """Test multithreaded chunk sealing and opening within one file."""
+    print("Testing parallel chunk pipeline...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        data = os.urandom(CHUNK_SIZE * 9 + 4321)
+        plain_file = os.path.join(temp_dir, 'large.bin')
+        with open(plain_file, 'wb') as f:
+            f.write(data)
+
+        key = CryptoHandler.generate_key_file(os.path.join(temp_dir, 'pipeline.key'))
+        encrypted_file = plain_file + '.locked'
+        stats = CryptoHandler.encrypt_file(plain_file, encrypted_file, MODE_KEYFILE, key=key, workers=4)
+        assert stats['bytes_in'] == len(data), "Byte count mismatch"
+        assert stats['throughput_mbps'] > 0, "Throughput not reported"
+        print(f"✓ Encrypted with 4 workers at {stats['throughput_mbps']:.1f} MB/s")
+
+        # Output from the parallel engine must be readable by the sequential one and vice versa
+        out_dir = os.path.join(temp_dir, 'out')
+        os.makedirs(out_dir)
+        result = CryptoHandler.decrypt_file(encrypted_file, out_dir, key=key, workers=1)
+        with open(result['output_path'], 'rb') as f:
+            assert f.read() == data, "Content mismatch (sequential decrypt)"
+        os.remove(result['output_path'])
+
+        result = CryptoHandler.decrypt_file(encrypted_file, out_dir, key=key, workers=4)
+        with open(result['output_path'], 'rb') as f:
+            assert f.read() == data, "Content mismatch (parallel decrypt)"
+        print(f"✓ Decrypted with 4 workers at {result['throughput_mbps']:.1f} MB/s")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Parallel chunk pipeline test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Parallel chunk pipeline test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_mapped_io():
+    """Test the memory-mapped read path and preallocated output."""
+    print("Testing memory-mapped I/O...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        key = CryptoHandler.generate_key_file(os.path.join(temp_dir, 'mapped.key'))
+        for name, data in (('empty.bin', b''), ('exact.bin', os.urandom(CHUNK_SIZE * 2)),
+                           ('text.txt', b'abc' * CHUNK_SIZE)):
+            plain_file = os.path.join(temp_dir, name)
+            with open(plain_file, 'wb') as f:
+                f.write(data)
+
+            encrypted_file = plain_file + '.locked'
+            stats = CryptoHandler.encrypt_file(plain_file, encrypted_file, MODE_KEYFILE, key=key)
+            # Preallocated space must be trimmed to exactly what was written
+            assert os.path.getsize(encrypted_file) == stats['bytes_out'], f"{name}: output not truncated"
+
+            os.remove(plain_file)
+            result = CryptoHandler.decrypt_file(encrypted_file, temp_dir, key=key)
+            with open(result['output_path'], 'rb') as f:
+                assert f.read() == data, f"Content mismatch for {name}"
+        print("✓ Empty, chunk-aligned and compressed files round-trip")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Memory-mapped I/O test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Memory-mapped I/O test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_header_inspection():
+    """Test header-only parsing, the lazy payload accessor and bulk inspect."""
+    print("Testing header inspection...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        key = CryptoHandler.generate_key_file(os.path.join(temp_dir, 'inspect.key'))
+        paths = []
+        for i in range(20):
+            plain_file = os.path.join(temp_dir, f'doc{i}.txt')
+            with open(plain_file, 'w') as f:
+                f.write(f"Document {i}")
+            CryptoHandler.encrypt_file(plain_file, plain_file + '.locked', MODE_KEYFILE, key=key)
+            paths.append(plain_file + '.locked')
+
+        bogus = os.path.join(temp_dir, 'bogus.locked')
+        with open(bogus, 'wb') as f:
+            f.write(b'not an encrypted file')
+
+        metadata = CryptoHandler.read_file_metadata(paths[0])
+        assert metadata['original_filename'] == 'doc0.txt'
+        assert metadata['mode'] == MODE_KEYFILE
+        assert metadata['data_offset'] == len(metadata['header_bytes'])
+        print("✓ Metadata parsed without the payload")
+
+        header = CryptoHandler.parse_file_header(paths[0])
+        assert 'encrypted_data' not in header, "Payload should be loaded lazily"
+        with open(paths[0], 'rb') as f:
+            assert header['encrypted_data'] == f.read()[metadata['data_offset']:]
+        print("✓ Lazy payload accessor")
+
+        results = CryptoHandler.inspect(paths + [bogus])
+        assert [r['path'] for r in results] == paths + [bogus], "Results should keep input order"
+        assert all('metadata' in r for r in results[:-1])
+        assert 'error' in results[-1], "Invalid file should report an error"
+        print("✓ Bulk inspect")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Header inspection test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Header inspection test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_file_index():
+    """Test the persistent search index, incremental refresh and invalidation."""
+    print("Testing file index...")
+
+    temp_dir = tempfile.mkdtemp()
+    index_dir = tempfile.mkdtemp()
+    try:
+        subdir = os.path.join(temp_dir, 'sub', 'deep')
+        os.makedirs(subdir)
+        for path in [os.path.join(temp_dir, 'a.txt'), os.path.join(temp_dir, 'b.doc'),
+                     os.path.join(subdir, 'c.txt')]:
+            with open(path, 'w') as f:
+                f.write("indexed")
+
+        with FileIndex(os.path.join(index_dir, 'db', 'files.sqlite3')) as index:
+            assert not index.is_warm(temp_dir), "A new index should be cold"
+            for kwargs in [{}, {'pattern': '*.txt'}, {'recursive': False}, {'extension_filter': '.doc'}]:
+                expected = FileManager.search_files(temp_dir, **kwargs)
+                indexed = FileManager.search_files(temp_dir, index=index, **kwargs)
+                assert [os.path.abspath(p) for p in expected] == indexed, f"Index mismatch for {kwargs}"
+            print("✓ Index answers match a full walk")
+
+            assert index.refresh(temp_dir) == 0, "Unchanged tree should not be re-listed"
+            assert index.is_warm(temp_dir) and index.is_warm(subdir)
+            print("✓ Unchanged tree refreshed from directory mtimes")
+
+            key = CryptoHandler.generate_key_file(os.path.join(index_dir, 'test.key'))
+            processor = BatchProcessor(file_index=index)
+            processor.batch_encrypt([os.path.join(subdir, 'c.txt')], MODE_KEYFILE, key=key, delete_originals=True)
+            results = FileManager.search_files(temp_dir, only_locked=True, index=index)
+            assert results == [os.path.join(subdir, 'c.txt.locked')], f"Unexpected results: {results}"
+            index.invalidate(os.path.join(temp_dir, 'a.txt'))
+            assert not index.is_warm(temp_dir), "An invalidated directory should be cold"
+            print("✓ Batch operations invalidate the index")
+
+            shutil.rmtree(os.path.join(temp_dir, 'sub'))
+            results = FileManager.search_files(temp_dir, pattern='*.txt', index=index)
+            assert results == [os.path.join(temp_dir, 'a.txt')], f"Unexpected results: {results}"
+            print("✓ Removed directories dropped from the index")
+
+            # A refresh releases the index between batches of directories and can be cancelled part-way
+            for i in range(150):
+                os.makedirs(os.path.join(temp_dir, 'many', f'd{i:03d}'))
+
+            class CancelAfter:
+                def __init__(self, checks):
+                    self.checks = checks
+                    self.unlocked = 0
+
+                def is_set(self):
+                    self.unlocked += not index._lock.locked()
+                    self.checks -= 1
+                    return self.checks < 0
+
+            cancel = CancelAfter(100)
+            index.refresh(temp_dir, cancel=cancel)
+            assert cancel.unlocked > 1, "Refresh should release the index between batches"
+            assert not index.is_warm(temp_dir), "A cancelled refresh should leave the tree cold"
+            index.refresh(temp_dir)
+            assert index.is_warm(temp_dir)
+            print("✓ Refresh runs in cancellable batches")
+
+        shutil.rmtree(temp_dir)
+        shutil.rmtree(index_dir)
+
+        print("✓ File index test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ File index test FAILED: {e}\n")
+        for path in (temp_dir, index_dir):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        return False
+
+
+def test_tree_walker():
+    """Test the scandir walker in sequential and concurrent modes."""
+    print("Testing tree walker...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        expected = set()
+        for i in range(5):
+            subdir = os.path.join(temp_dir, f'dir{i}', 'nested')
+            os.makedirs(subdir)
+            for j in range(10):
+                path = os.path.join(subdir if j % 2 else os.path.dirname(subdir), f'file{j}.txt')
+                with open(path, 'w') as f:
+                    f.write("walk")
+                expected.add(path)
+
+        sequential = [entry.path for entry in FileManager.walk(temp_dir, workers=1)]
+        assert set(sequential) == expected, "Sequential walk missed files"
+        assert sequential == [entry.path for entry in FileManager.walk(temp_dir, workers=1)], \
+            "Sequential walk order should be reproducible"
+        concurrent = [entry.path for entry in FileManager.walk(temp_dir, workers=4)]
+        assert sorted(concurrent) == sorted(sequential), "Concurrent walk should find the same files"
+        print(f"✓ Sequential and concurrent walks agree: {len(concurrent)} files")
+
+        top_level = list(FileManager.walk(temp_dir, recursive=False, include_dirs=True))
+        assert sorted(e.name for e in top_level) == [f'dir{i}' for i in range(5)]
+        print("✓ Non-recursive walk with directories")
+
+        walker = FileManager.walk(temp_dir, workers=4)
+        first = next(walker)
+        walker.close()
+        assert first.path in expected
+        print("✓ Walk stops when abandoned")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Tree walker test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Tree walker test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_cli():
+    """Test the headless CLI end to end."""
+    print("Testing CLI...")
+
+    import cli
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        def run(argv, password=None):
+            out = io.StringIO()
+            read_fd = None
+            if password is not None:
+                read_fd, write_fd = os.pipe()
+                os.write(write_fd, password.encode() + b'\n')
+                os.close(write_fd)
+                argv = argv + ['--password-fd', str(read_fd)]
+            try:
+                with redirect_stdout(out):
+                    status = cli.main(argv)
+            finally:
+                if read_fd is not None:
+                    os.close(read_fd)
+            return status, [json.loads(line) for line in out.getvalue().splitlines()]
+
+        plain_file = os.path.join(temp_dir, 'report.csv')
+        data = b"id,value\n" * 50000
+        with open(plain_file, 'wb') as f:
+            f.write(data)
+
+        status, events = run(['encrypt', plain_file, '--chunk-size', '64K', '--delete', '--workers', '1'],
+                             password='cli_password_123')
+        assert status == 0, f"Encrypt failed: {events}"
+        assert events[-1]['event'] == 'result' and events[-1]['success'] == [plain_file]
+        assert any(e['event'] == 'progress' for e in events), "Expected JSON progress events"
+        print("✓ Encrypt with password from a file descriptor")
+
+        status, events = run(['inspect', plain_file + '.locked'])
+        assert status == 0 and events[0]['chunk_size'] == 64 * 1024
+        assert events[0]['original_filename'] == 'report.csv'
+        print("✓ Inspect shows the requested chunk size")
+
+        status, events = run(['search', temp_dir, '--locked'])
+        assert [e['path'] for e in events if e['event'] == 'match'] == [plain_file + '.locked']
+        print("✓ Search")
+
+        status, events = run(['decrypt', plain_file + '.locked', '--quiet', '--workers', '1'],
+                             password='wrong_password_123')
+        assert status == 1 and len(events) == 1 and events[0]['failed'], "Wrong password should fail"
+        status, events = run(['decrypt', plain_file + '.locked', '--workers', '1'], password='cli_password_123')
+        assert status == 0, f"Decrypt failed: {events}"
+        with open(plain_file, 'rb') as f:
+            assert f.read() == data
+        print("✓ Decrypt")
+
+        imported = subprocess.run(
+            [sys.executable, '-c', "import sys, cli; print('tkinter' in sys.modules)"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        ).stdout.strip()
+        assert imported == 'False', "Importing the CLI should not load tkinter"
+        print("✓ CLI does not import tkinter")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ CLI test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ CLI test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+class _PipeReader(io.RawIOBase):
+    """Non-seekable reader that returns short reads, like a pipe."""
+
+    def __init__(self, data):
+        self._data = memoryview(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self._data), 7000)
+        b[:n] = self._data[:n]
+        self._data = self._data[n:]
+        return n
+
+
+def test_stream_encryption():
+    """Test encrypt_stream/decrypt_stream over non-seekable streams."""
+    print("Testing stream encryption...")
+
+    try:
+        key = CryptoHandler.generate_key_file(os.devnull)
+        data = os.urandom(100000) + b"log line\n" * 200000
+
+        for workers in (1, 3):
+            encrypted = io.BytesIO()
+            stats = CryptoHandler.encrypt_stream(
+                _PipeReader(data), encrypted, MODE_KEYFILE, key=key,
+                original_filename='dump.sql', workers=workers, chunk_size=64 * 1024
+            )
+            assert stats['bytes_in'] == len(data)
+            assert stats['bytes_out'] == len(encrypted.getvalue())
+
+            decrypted = io.BytesIO()
+            result = CryptoHandler.decrypt_stream(_PipeReader(encrypted.getvalue()), decrypted,
+                                                  key=key, workers=workers)
+            assert decrypted.getvalue() == data, "Stream round trip mismatch"
+            assert result['original_filename'] == 'dump.sql' and result['bytes'] == len(data)
+        print("✓ Round trip through pipe-like streams")
+
+        truncated = encrypted.getvalue()[:len(encrypted.getvalue()) // 2]
+        try:
+            CryptoHandler.decrypt_stream(_PipeReader(truncated), io.BytesIO(), key=key)
+            assert False, "Truncated stream should fail"
+        except ValueError:
+            pass
+        print("✓ Truncated stream detected")
+
+        print("✓ Stream encryption test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Stream encryption test FAILED: {e}\n")
+        return False
+
+
+def test_random_access():
+    """Test byte-range decryption through the chunk index footer."""
+    print("Testing random access...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        key = CryptoHandler.generate_key_file(os.path.join(temp_dir, 'range.key'))
+        data = b"".join(b"row %08d\n" % i for i in range(60000))
+        plain_file = os.path.join(temp_dir, 'table.txt')
+        with open(plain_file, 'wb') as f:
+            f.write(data)
+
+        encrypted_file = plain_file + '.locked'
+        CryptoHandler.encrypt_file(plain_file, encrypted_file, MODE_KEYFILE, key=key,
+                                   codec=CODEC_DEFLATE, chunk_size=64 * 1024)
+
+        for offset, length in [(0, 10), (65530, 20), (100000, 300000), (len(data) - 5, 100), (len(data) + 1, 10)]:
+            assert CryptoHandler.read_range(encrypted_file, offset, length, key=key) == data[offset:offset + length], \
+                f"Range mismatch at {offset}+{length}"
+        print("✓ Ranges across chunk boundaries and past the end")
+
+        with CryptoHandler.open_random_access(encrypted_file, key=key) as f:
+            assert f.size == len(data)
+            f.seek(-11, os.SEEK_END)
+            assert f.read() == data[-11:]
+            f.seek(131072)
+            assert f.read(11) == data[131072:131083]
+        print("✓ Seekable file object")
+
+        # Files written without a footer are indexed by scanning frame headers
+        no_index_file = os.path.join(temp_dir, 'no_index.locked')
+        with open(no_index_file, 'wb') as out:
+            with CryptoHandler.open_encrypt_stream(out, MODE_KEYFILE, 'table.txt', key=key,
+                                                   chunk_size=64 * 1024, chunk_index=False) as writer:
+                writer.write(data)
+        assert CryptoHandler.read_range(no_index_file, 200000, 50, key=key) == data[200000:200050]
+        print("✓ Frame scan fallback without a footer")
+
+        # A tampered index must not yield wrong plaintext
+        with open(encrypted_file, 'r+b') as f:
+            f.seek(-FOOTER_SIZE - 12, os.SEEK_END)
+            f.write(b'\x00' * 8)
+        try:
+            CryptoHandler.read_range(encrypted_file, 0, 10, key=key)
+            assert False, "Tampered footer should be detected"
+        except ValueError:
+            pass
+        result = CryptoHandler.decrypt_file(encrypted_file, os.path.join(temp_dir), key=key)
+        with open(result['output_path'], 'rb') as f:
+            assert f.read() == data, "Sequential decryption should not depend on the footer"
+        print("✓ Tampered footer detected")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Random access test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Random access test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_folder_archive():
+    """Test listing and extracting single members of an encrypted folder."""
+    print("Testing folder archive...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        folder = os.path.join(temp_dir, 'dataset')
+        os.makedirs(os.path.join(folder, 'tables'))
+        os.makedirs(os.path.join(folder, 'empty'))
+        contents = {
+            'tables/users.csv': b"id,name\n" * 40000,
+            'tables/orders.csv': os.urandom(300000),
+            'notes.txt': b"restore me"
+        }
+        for name, data in contents.items():
+            with open(os.path.join(folder, *name.split('/')), 'wb') as f:
+                f.write(data)
+        os.chmod(os.path.join(folder, 'notes.txt'), 0o4755)
+
+        key = CryptoHandler.generate_key_file(os.path.join(temp_dir, 'archive.key'))
+        results = BatchProcessor().batch_encrypt([folder], MODE_KEYFILE, key=key, chunk_size=64 * 1024)
+        assert results['success'] == [folder], f"Encryption failed: {results['failed']}"
+        archive = folder + '.locked'
+
+        members = FileManager.list_archive(archive, key=key)
+        files = {m['path']: m['size'] for m in members if m['type'] == 'file'}
+        assert files == {name: len(data) for name, data in contents.items()}, f"Unexpected manifest: {files}"
+        assert any(m['path'] == 'empty' and m['type'] == 'dir' for m in members)
+        print(f"✓ Listed {len(members)} members")
+
+        out_dir = os.path.join(temp_dir, 'restore')
+        path = FileManager.extract_member(archive, 'tables/orders.csv', out_dir, key=key)
+        with open(path, 'rb') as f:
+            assert f.read() == contents['tables/orders.csv']
+        assert os.listdir(out_dir) == ['orders.csv'], "Only the requested member should be written"
+        print("✓ Extracted a single member")
+
+        try:
+            FileManager.extract_member(archive, 'missing.txt', out_dir, key=key)
+            assert False, "Missing member should raise"
+        except KeyError:
+            pass
+        print("✓ Missing member rejected")
+
+        if os.name != 'nt':
+            full_dir = os.path.join(temp_dir, 'full')
+            FileManager.extract_archive(archive, full_dir, key=key)
+            mode = os.stat(os.path.join(full_dir, 'notes.txt')).st_mode & 0o7777
+            assert mode == 0o755, f"Extracted mode {oct(mode)} keeps special bits"
+            print("✓ Setuid bits dropped on extraction")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Folder archive test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Folder archive test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_incremental_archive():
+    """Test that re-encrypting a folder only appends changed members."""
+    print("Testing incremental folder re-encryption...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        folder = os.path.join(temp_dir, 'photos')
+        os.makedirs(os.path.join(folder, '2024'))
+        contents = {
+            '2024/a.raw': os.urandom(400000),
+            '2024/b.raw': os.urandom(400000),
+            'index.txt': b"a b"
+        }
+        for name, data in contents.items():
+            with open(os.path.join(folder, *name.split('/')), 'wb') as f:
+                f.write(data)
+
+        key = CryptoHandler.generate_key_file(os.path.join(temp_dir, 'photos.key'))
+        processor = BatchProcessor()
+        results = processor.batch_encrypt([folder], MODE_KEYFILE, key=key, chunk_size=64 * 1024)
+        assert results['success'] == [folder], f"Encryption failed: {results['failed']}"
+        archive = folder + '.locked'
+        first_size = os.path.getsize(archive)
+
+        # Unchanged folder: the archive is not touched at all
+        before = os.stat(archive).st_mtime_ns
+        stats = FileManager.update_archive(folder, archive, key=key)
+        assert stats['unchanged'] and os.stat(archive).st_mtime_ns == before
+        print("✓ Unchanged folder left the archive as is")
+
+        # Add a small file, copy an existing one and delete another
+        contents['2024/c.raw'] = os.urandom(20000)
+        contents['2024/a-copy.raw'] = contents['2024/a.raw']
+        del contents['index.txt']
+        for name in ('2024/c.raw', '2024/a-copy.raw'):
+            with open(os.path.join(folder, *name.split('/')), 'wb') as f:
+                f.write(contents[name])
+        os.remove(os.path.join(folder, 'index.txt'))
+
+        results = processor.batch_encrypt([folder], MODE_KEYFILE, key=key, incremental=True)
+        assert results['success'] == [folder], f"Incremental run failed: {results['failed']}"
+        growth = os.path.getsize(archive) - first_size
+        assert growth < 64 * 1024 + 20000, f"Archive grew by {growth} bytes for a 20000 byte change"
+        print(f"✓ Appended {growth} bytes for one new file (duplicate reused)")
+
+        out_dir = os.path.join(temp_dir, 'restore')
+        FileManager.extract_archive(archive, out_dir, key=key)
+        for name, data in contents.items():
+            with open(os.path.join(out_dir, *name.split('/')), 'rb') as f:
+                assert f.read() == data, f"{name} differs after update"
+        assert not os.path.exists(os.path.join(out_dir, 'index.txt')), "Deleted file should be gone"
+        print("✓ Updated archive extracts to the new folder state")
+
+        # A crash in the middle of an append is rolled back by the next update; reads fail until then
+        before = [m['path'] for m in FileManager.list_archive(archive, key=key)]
+        late = os.path.join(folder, 'late.raw')
+        with open(late, 'wb') as f:
+            f.write(os.urandom(30000))
+        script = (
+            "import os, sys\n"
+            "import file_manager\n"
+            "def crash(path, fileobj):\n"
+            "    fileobj.write(b'partial member')\n"
+            "    os._exit(3)\n"
+            "file_manager._copy_file_into = crash\n"
+            "file_manager.FileManager.update_archive(sys.argv[1], sys.argv[2], key=sys.argv[3].encode())\n"
+        )
+        crashed = subprocess.run(
+            [sys.executable, '-c', script, folder, archive, key.decode()],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+        )
+        assert crashed.returncode == 3, crashed.stderr
+        try:
+            FileManager.list_archive(archive, key=key)
+            assert False, "Reading an interrupted append should fail"
+        except ValueError as e:
+            assert str(e) == MSG_APPEND_PENDING, str(e)
+        assert os.path.exists(archive + APPEND_BACKUP_SUFFIX), "A reader must not touch the append backup"
+        assert CryptoHandler.recover_append(archive)
+        assert [m['path'] for m in FileManager.list_archive(archive, key=key)] == before, "Archive lost members"
+        assert not os.path.exists(archive + APPEND_BACKUP_SUFFIX), "Append backup left behind"
+        print("✓ Interrupted append rolled back")
+
+        # An append still running is neither read nor rolled back
+        size = os.path.getsize(archive)
+        writer = CryptoHandler.open_append_writer(archive, key=key)
+        writer.write(b'live append')
+        for attempt in (lambda: CryptoHandler.read_range(archive, 0, 10, key=key),
+                        lambda: CryptoHandler.recover_append(archive),
+                        lambda: FileManager.update_archive(folder, archive, key=key)):
+            try:
+                attempt()
+                assert False, "Running append was disturbed"
+            except ValueError:
+                pass
+        assert os.path.exists(archive + APPEND_BACKUP_SUFFIX), "Running append lost its backup"
+        writer.abort()
+        assert os.path.getsize(archive) == size and not os.path.exists(archive + APPEND_BACKUP_SUFFIX)
+        stats = FileManager.update_archive(folder, archive, key=key)
+        assert stats['added'] == 1 and 'late.raw' in [m['path'] for m in FileManager.list_archive(archive, key=key)]
+        os.remove(late)
+        print("✓ Running append left alone")
+
+        # Dropping most of the data triggers a rewrite
+        for name in ('2024/a.raw', '2024/a-copy.raw', '2024/b.raw'):
+            os.remove(os.path.join(folder, *name.split('/')))
+        stats = FileManager.update_archive(folder, archive, key=key)
+        assert stats['compacted'] and os.path.getsize(archive) < 100000, "Archive should be compacted"
+        assert [m['path'] for m in FileManager.list_archive(archive, key=key) if m['type'] == 'file'] == ['2024/c.raw']
+        print("✓ Mostly dead archive was compacted")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Incremental folder test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Incremental folder test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_chunk_store():
+    """Test deduplicating encryption into a content-addressed chunk store."""
+    print("Testing chunk store deduplication...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        store_dir = os.path.join(temp_dir, 'store')
+        data = os.urandom(2 * 1024 * 1024)
+        # v2 shares everything with v1 except a small insertion near the start
+        versions = {'v1.img': data, 'v2.img': data[:100000] + b'inserted' + data[100000:]}
+        for name, content in versions.items():
+            with open(os.path.join(temp_dir, name), 'wb') as f:
+                f.write(content)
+
+        def store_size():
+            return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(store_dir) for f in files)
+
+        key = CryptoHandler.generate_key_file(os.path.join(temp_dir, 'store.key'))
+        processor = BatchProcessor()
+        results = processor.batch_encrypt([os.path.join(temp_dir, 'v1.img')], MODE_KEYFILE, key=key,
+                                          chunk_store=store_dir)
+        assert not results['failed'], f"Encryption failed: {results['failed']}"
+        first = store_size()
+        results = processor.batch_encrypt([os.path.join(temp_dir, 'v2.img')], MODE_KEYFILE, key=key,
+                                          chunk_store=store_dir)
+        assert not results['failed'], f"Encryption failed: {results['failed']}"
+        growth = store_size() - first
+        assert growth < len(data) // 4, f"Store grew by {growth} bytes for an 8 byte insertion"
+
+        recipe = os.path.join(temp_dir, 'v2.img.locked')
+        assert os.path.getsize(recipe) < 4096, "Recipe file should be small"
+        assert EXT_CHUNK_STORE in CryptoHandler.read_file_metadata(recipe)['extensions']
+        print(f"✓ Second version added {growth} bytes to the store")
+
+        # Boundaries must match the byte-at-a-time gear hash, so stores stay stable across versions
+        import hashlib
+        from chunk_store import cdc_chunks
+        gear = [int.from_bytes(hashlib.sha256(b'FLCK gear %d' % i).digest()[:4], 'big') for i in range(256)]
+
+        def reference_chunks(data, min_size, avg_size, max_size):
+            bits = avg_size.bit_length() - 1
+            masks = (((1 << (bits + 1)) - 1) << (31 - bits), ((1 << (bits - 1)) - 1) << (33 - bits))
+            chunks = []
+            while data:
+                cut = min(len(data), max_size)
+                if len(data) > min_size:
+                    h = 0
+                    for pos in range(min_size, cut):
+                        h = ((h << 1) + gear[data[pos]]) & 0xFFFFFFFF
+                        if not h & masks[pos >= avg_size]:
+                            cut = pos + 1
+                            break
+                chunks.append(data[:cut])
+                data = data[cut:]
+            return chunks
+
+        sample = os.urandom(200000) + bytes(30000) + b'abc' * 20000
+        assert list(cdc_chunks(io.BytesIO(sample), 256, 1024, 4096)) == reference_chunks(sample, 256, 1024, 4096)
+        print("✓ Chunk boundaries match the gear hash")
+
+        for name in versions:
+            os.remove(os.path.join(temp_dir, name))
+        results = processor.batch_decrypt([os.path.join(temp_dir, name + '.locked') for name in versions],
+                                          key=key, chunk_store=store_dir)
+        assert not results['failed'], f"Decryption failed: {results['failed']}"
+        for name, content in versions.items():
+            with open(os.path.join(temp_dir, name), 'rb') as f:
+                assert f.read() == content, f"{name} differs after decryption"
+        print("✓ Both versions restored from the store")
+
+        # Password mode: the store salt gives every file the same store key
+        password = "StorePassword123"
+        stats = CryptoHandler.encrypt_file(
+            os.path.join(temp_dir, 'v1.img'), os.path.join(temp_dir, 'pw.locked'), MODE_PASSWORD,
+            password=password, chunk_store=ChunkStore(store_dir)
+        )
+        assert stats['new_chunks'] == stats['chunks'], "Different keys must not share chunks"
+        stats = CryptoHandler.encrypt_file(
+            os.path.join(temp_dir, 'v2.img'), os.path.join(temp_dir, 'pw2.locked'), MODE_PASSWORD,
+            password=password, chunk_store=ChunkStore(store_dir), key_cache=DerivedKeyCache()
+        )
+        assert stats['new_chunks'] < stats['chunks'] // 4, f"Password files should share chunks: {stats}"
+        out_dir = os.path.join(temp_dir, 'out')
+        os.makedirs(out_dir)
+        result = CryptoHandler.decrypt_file(os.path.join(temp_dir, 'pw2.locked'), out_dir, password=password,
+                                            chunk_store=ChunkStore(store_dir))
+        with open(result['output_path'], 'rb') as f:
+            assert f.read() == versions['v2.img']
+        print("✓ Password files deduplicate against each other")
+
+        # A different store, or a tampered chunk, must be rejected
+        try:
+            CryptoHandler.decrypt_file(recipe, out_dir, key=key, chunk_store=ChunkStore(os.path.join(temp_dir, 'other')))
+            assert False, "Wrong store should be rejected"
+        except ValueError:
+            pass
+
+        objects = [os.path.join(d, f) for d, _, files in os.walk(os.path.join(store_dir, 'objects')) for f in files]
+        for path in objects:
+            with open(path, 'r+b') as f:
+                f.seek(5)
+                byte = f.read(1)
+                f.seek(5)
+                f.write(bytes([byte[0] ^ 1]))
+        try:
+            CryptoHandler.decrypt_file(recipe, out_dir, key=key, chunk_store=ChunkStore(store_dir))
+            assert False, "Tampered chunk should be rejected"
+        except ValueError:
+            pass
+        assert os.listdir(out_dir) == ['v2.img'], "No partial output should remain"
+        print("✓ Wrong store and tampered chunks rejected")
+
+        # Damaged blobs (here tampered, or truncated by a crash) are written again, not reused
+        with open(objects[0], 'wb'):
+            pass
+        stats = CryptoHandler.encrypt_file(
+            os.path.join(temp_dir, 'v2.img'), recipe, MODE_KEYFILE, key=key,
+            chunk_store=ChunkStore(store_dir, fsync=True)
+        )
+        assert stats['new_chunks'] == stats['chunks'], f"Damaged blobs were reused: {stats}"
+        assert not any(f.startswith(TEMP_FILE_PREFIX) for _, _, files in os.walk(store_dir) for f in files)
+        os.remove(os.path.join(out_dir, 'v2.img'))
+        result = CryptoHandler.decrypt_file(recipe, out_dir, key=key, chunk_store=ChunkStore(store_dir))
+        with open(result['output_path'], 'rb') as f:
+            assert f.read() == versions['v2.img']
+        print("✓ Damaged chunks rewritten")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Chunk store test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Chunk store test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_benchmark():
+    """Test the benchmark runner and baseline comparison."""
+    print("Testing benchmark suite...")
+
+    try:
+        results = benchmark.run_suite('smoke', only=['file_1K', 'search'], log=lambda line: None)
+        assert set(results['results']) == {'file_1K', 'search_tree'}, f"Unexpected cases: {results['results']}"
+        for name, metrics in results['results'].items():
+            assert 'error' not in metrics, f"{name} failed: {metrics['error']}"
+        assert results['results']['file_1K']['encrypt_mbps'] > 0
+        assert results['results']['search_tree']['files'] == 40
+        print("✓ Smoke profile ran in subprocesses")
+
+        baseline = {'results': {
+            'file_1M': {'encrypt_seconds': 0.5, 'encrypt_mbps': 2.0, 'bytes': 1048576},
+            'kdf_pbkdf2': {'kdf_ms': 100.0},
+            'file_1K': {'encrypt_seconds': 0.001, 'encrypt_mbps': 1.0}
+        }}
+        current = {'results': {
+            'file_1M': {'encrypt_seconds': 0.8, 'encrypt_mbps': 1.25, 'bytes': 1048576},
+            'kdf_pbkdf2': {'kdf_ms': 110.0},
+            'file_1K': {'encrypt_seconds': 0.004, 'encrypt_mbps': 0.25}
+        }}
+        regressions = benchmark.compare(current, baseline, tolerance=0.25)
+        flagged = {(name, metric) for name, metric, *_ in regressions}
+        assert flagged == {('file_1M', 'encrypt_seconds'), ('file_1M', 'encrypt_mbps')}, f"Flagged {flagged}"
+        print("✓ Regressions beyond the tolerance are flagged, noise is not")
+
+        print("✓ Benchmark test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Benchmark test FAILED: {e}\n")
+        return False
+
+
+def test_metrics():
+    """Test per-stage metrics collected during batches."""
+    print("Testing batch metrics...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        paths = []
+        for i in range(3):
+            path = os.path.join(temp_dir, f'file{i}.bin')
+            with open(path, 'wb') as f:
+                f.write(os.urandom(200 * 1024))
+            paths.append(path)
+
+        events = []
+        jsonl_path = os.path.join(temp_dir, 'metrics.jsonl')
+        prom_path = os.path.join(temp_dir, 'metrics.prom')
+        metrics = Metrics(callback=events.append, jsonl_path=jsonl_path, prometheus_path=prom_path)
+        key = CryptoHandler.generate_key_file(os.path.join(temp_dir, 'metrics.key'))
+        # Process workers send their counters back as snapshots
+        processor = BatchProcessor(max_workers=2, executor='process', metrics=metrics)
+        results = processor.batch_encrypt(paths, MODE_KEYFILE, key=key, delete_originals=True, codec=CODEC_NONE)
+        assert not results['failed'], f"Encryption failed: {results['failed']}"
+
+        summary = results['metrics']
+        assert summary['files']['count'] == 3 and summary['files']['bytes'] == 3 * 200 * 1024
+        # Mapped inputs are read through page faults inside the cipher stage
+        for stage in ('cipher', 'write', 'delete'):
+            assert stage in summary['stages'], f"Missing stage {stage}: {list(summary['stages'])}"
+        assert summary['stages']['cipher']['bytes'] == 3 * 200 * 1024
+        assert summary['latency']['count'] == 3 and summary['latency']['p95_seconds'] > 0
+        file_events = [e for e in events if e['event'] == 'file']
+        assert sorted(e['path'] for e in file_events) == sorted(paths)
+        assert all(e['ok'] and 'cipher' in e['stages'] for e in file_events)
+        assert events[-1]['event'] == 'summary'
+        print("✓ Stage timings merged from worker processes")
+
+        results = processor.batch_decrypt([p + '.locked' for p in paths], key=key)
+        assert not results['failed'], f"Decryption failed: {results['failed']}"
+        assert results['metrics']['files']['count'] == 6, "Totals accumulate across batches"
+        assert 'read' in results['metrics']['stages'], "Decryption reads frames through the read stage"
+
+        with open(jsonl_path, 'r', encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f]
+        assert [e['event'] for e in lines].count('summary') == 2 and len(lines) == 8
+        with open(prom_path, 'r', encoding='utf-8') as f:
+            prom = f.read()
+        assert 'file_encryptor_stage_seconds_total{stage="cipher"}' in prom
+        assert 'file_encryptor_file_seconds_bucket{le="+Inf"} 6' in prom
+        assert 'file_encryptor_files_total 6' in prom
+        print("✓ JSON lines and Prometheus exports written")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Metrics test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Metrics test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_byte_progress():
+    """Test byte-accurate progress from inside the chunk loops."""
+    print("Testing byte progress...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        big = os.path.join(temp_dir, 'big.bin')
+        with open(big, 'wb') as f:
+            f.write(os.urandom(5 * CHUNK_SIZE + 123))
+        key = CryptoHandler.generate_key_file(os.path.join(temp_dir, 'progress.key'))
+        counts = []
+        CryptoHandler.encrypt_file(big, big + '.locked', MODE_KEYFILE, key=key,
+                                   codec=CODEC_NONE, workers=2, progress=counts.append)
+        assert len(counts) == 6 and sum(counts) == os.path.getsize(big), f"Chunk counts: {counts}"
+        print("✓ Encryption reports bytes chunk by chunk")
+
+        updates = []
+        tracker = ByteProgress(1000, 1, updates.append, interval=0.05)
+        for done in range(0, 1001, 10):
+            tracker.update(done)
+        assert len(updates) == 1, "Updates within the interval should be dropped"
+        time.sleep(0.06)
+        tracker.update(500)
+        time.sleep(0.06)
+        tracker.update(600)
+        info = updates[-1]
+        assert info['bytes_done'] == 1000 and info['percent'] == 100.0, "Progress never goes backwards"
+        assert info['eta'] == 0.0 and info['rate'] is not None
+        print("✓ Updates are rate-limited with a smoothed rate")
+
+        paths = [big]
+        for i in range(4):
+            path = os.path.join(temp_dir, f'small{i}.txt')
+            with open(path, 'w') as f:
+                f.write('x' * (1000 * (i + 1)))
+            paths.append(path)
+        folder = os.path.join(temp_dir, 'folder')
+        os.makedirs(folder)
+        with open(os.path.join(folder, 'inner.bin'), 'wb') as f:
+            f.write(os.urandom(70000))
+        paths.append(folder)
+        total = sum(os.path.getsize(p) for p in paths[:-1]) + 70000
+        assert FileManager.get_total_size(paths) == total
+
+        for executor, password in (('thread', None), ('process', 'ProgressPassword1')):
+            updates = []
+            processor = BatchProcessor(byte_progress_callback=updates.append, max_workers=3, executor=executor)
+            if password:
+                results = processor.batch_encrypt(paths, MODE_PASSWORD, password=password)
+            else:
+                results = processor.batch_encrypt(paths, MODE_KEYFILE, key=key)
+            assert not results['failed'], f"Encryption failed: {results['failed']}"
+            final = updates[-1]
+            assert final['bytes_done'] == final['bytes_total'] == total, f"{executor}: {final}"
+            assert final['files_done'] == final['files_total'] == len(paths)
+            assert all(a['bytes_done'] <= b['bytes_done'] for a, b in zip(updates, updates[1:]))
+        print("✓ Batch totals add up in thread and process pools")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Byte progress test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Byte progress test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_job_journal():
+    """Test resuming an interrupted batch from the job journal."""
+    print("Testing job journal resume...")
+
+    temp_dir = tempfile.mkdtemp()
+    journal = None
+    try:
+        files = []
+        for i in range(4):
+            path = os.path.join(temp_dir, f'journal{i}.txt')
+            with open(path, 'w') as f:
+                f.write(f"Journal file {i}")
+            files.append(path)
+        key = CryptoHandler.generate_key_file(os.path.join(temp_dir, 'journal.key'))
+        journal = JobJournal(os.path.join(temp_dir, 'journal.sqlite3'))
+
+        # State left by a crash: file 0 done, file 1 committed but not deleted,
+        # file 2 half written, file 3 never started
+        def fingerprint(path):
+            info = os.stat(path)
+            return info.st_size, info.st_mtime_ns
+
+        batch = journal.begin('encrypt', files)
+        for path in files[:2]:
+            CryptoHandler.encrypt_file(path, path + '.locked', MODE_KEYFILE, key=key)
+            journal.set_state(batch, path, JOB_COMMITTED, path + '.locked', fingerprint=fingerprint(path))
+        os.remove(files[0])
+        journal.set_state(batch, files[0], JOB_ORIGINAL_DELETED)
+        with open(files[2] + '.locked', 'wb') as f:
+            f.write(b'FLCK partial')
+        journal.set_state(batch, files[2], JOB_WRITING)
+        committed_mtime = os.stat(files[1] + '.locked').st_mtime_ns
+        leftover = os.path.join(temp_dir, TEMP_FILE_PREFIX + '0123456789ab_journal2.txt.locked')
+        unrelated = os.path.join(temp_dir, TEMP_FILE_PREFIX + '0123456789ab_other.txt.locked')
+        for path in (leftover, unrelated):
+            with open(path, 'wb') as f:
+                f.write(b'FLCK partial')
+
+        processor = BatchProcessor(journal=journal)
+        results = processor.batch_encrypt(files, MODE_KEYFILE, key=key, delete_originals=True)
+        assert results['success'] == files, f"Failed: {results['failed']}"
+        assert results['resumed'] == files[:2], f"Resumed {results['resumed']}"
+        assert os.stat(files[1] + '.locked').st_mtime_ns == committed_mtime, "Committed output was redone"
+        assert not any(os.path.exists(path) for path in files), "Originals should be deleted"
+        assert journal.states(batch) == {}, "A completed batch should be dropped"
+        assert not os.path.exists(leftover) and os.path.exists(unrelated), "Interrupted job's temp file kept"
+        os.remove(unrelated)
+        print("✓ Committed files skipped, interrupted ones redone")
+
+        # Process workers record their own states; a completed run drops its batch even if a file failed
+        missing = os.path.join(temp_dir, 'missing.locked')
+        locked = [path + '.locked' for path in files] + [missing]
+        batch = JobJournal.batch_id('decrypt', locked)
+        seen = {}
+
+        def progress(current, total, message):
+            if message.startswith('Decrypting') and current == total:
+                seen.update(journal.states(batch))
+
+        processor = BatchProcessor(progress_callback=progress, journal=journal, max_workers=2, executor='process',
+                                   durability=DURABILITY_FILE)
+        results = processor.batch_decrypt(locked, key=key)
+        assert [path for path, _ in results['failed']] == [missing]
+        assert all(seen[os.path.abspath(path)][0] == JOB_COMMITTED for path in locked[:-1]), seen
+        assert seen[os.path.abspath(missing)][0] == JOB_FAILED, seen
+        assert journal.states(batch) == {}, "A completed run should drop its batch"
+        for i, path in enumerate(files):
+            with open(path, 'r') as f:
+                assert f.read() == f"Journal file {i}"
+        print("✓ Worker processes journal their progress")
+
+        # An interrupted decryption's temp file is found through the name in the header
+        os.remove(files[0])
+        leftover = os.path.join(temp_dir, TEMP_FILE_PREFIX + '0123456789ab_journal0.txt')
+        with open(leftover, 'wb') as f:
+            f.write(b'partial plaintext')
+        batch = journal.begin('decrypt', locked[:1])
+        journal.set_state(batch, locked[0], JOB_WRITING)
+        results = BatchProcessor(journal=journal).batch_decrypt(locked[:1], key=key)
+        assert results['success'] == locked[:1] and not os.path.exists(leftover), "Decrypt temp file kept"
+
+        # A committed file whose input changed since is redone, not resumed
+        batch = journal.begin('encrypt', files[:2])
+        for path in files[:2]:
+            journal.set_state(batch, path, JOB_COMMITTED, path + '.locked', fingerprint=fingerprint(path))
+        with open(files[0], 'w') as f:
+            f.write("Changed after commit")
+        results = BatchProcessor(journal=journal).batch_encrypt(files[:2], MODE_KEYFILE, key=key)
+        assert results['resumed'] == files[1:2], f"Resumed {results['resumed']}"
+        os.remove(files[0])
+        BatchProcessor().batch_decrypt([files[0] + '.locked'], key=key)
+        with open(files[0], 'r') as f:
+            assert f.read() == "Changed after commit", "Stale output kept for a changed input"
+        print("✓ Changed inputs are redone")
+
+        journal.close()
+        shutil.rmtree(temp_dir)
+
+        print("✓ Job journal test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Job journal test FAILED: {e}\n")
+        if journal is not None:
+            journal.close()
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
+def test_atomic_writes():
+    """Test that outputs appear atomically under every durability policy."""
+    print("Testing atomic writes...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        key = CryptoHandler.generate_key_file(os.path.join(temp_dir, 'atomic.key'))
+
+        def temp_files():
+            return [name for root, dirs, names in os.walk(temp_dir)
+                    for name in names + dirs if name.startswith(TEMP_FILE_PREFIX)]
+
+        # A failed write leaves neither an output nor a temporary file
+        output = os.path.join(temp_dir, 'failed.locked')
+        try:
+            with CryptoHandler.open_encrypt_writer(output, MODE_KEYFILE, 'failed.txt', key=key) as writer:
+                writer.write(b'partial data')
+                raise RuntimeError("interrupted")
+        except RuntimeError:
+            pass
+        assert not os.path.exists(output) and not temp_files(), "Failed write left files behind"
+
+        # ...and does not touch an existing output of the same name
+        source = os.path.join(temp_dir, 'atomic.txt')
+        with open(source, 'w') as f:
+            f.write("Atomic content")
+        CryptoHandler.encrypt_file(source, output, MODE_KEYFILE, key=key)
+        with open(output, 'rb') as f:
+            before = f.read()
+        writer = CryptoHandler.open_encrypt_writer(output, MODE_KEYFILE, 'failed.txt', key=key)
+        writer.write(b'replacement')
+        writer.abort()
+        with open(output, 'rb') as f:
+            assert f.read() == before, "Aborted write replaced the existing output"
+        assert not temp_files()
+        os.remove(output)
+        print("✓ Failed writes leave no partial outputs")
+
+        # Every policy round-trips files and folders, deleting inputs only once committed
+        for durability in (DURABILITY_FILE, DURABILITY_BATCH, DURABILITY_NONE):
+            work = os.path.join(temp_dir, durability)
+            folder = os.path.join(work, 'folder')
+            os.makedirs(os.path.join(folder, 'sub'))
+            files = []
+            for i in range(3):
+                path = os.path.join(work, f'file{i}.txt')
+                with open(path, 'w') as f:
+                    f.write(f"{durability} file {i}")
+                files.append(path)
+            with open(os.path.join(folder, 'sub', 'inner.txt'), 'w') as f:
+                f.write("Inner file")
+
+            journal = JobJournal(':memory:')
+            processor = BatchProcessor(durability=durability, journal=journal)
+            inputs = files + [folder]
+            results = processor.batch_encrypt(inputs, MODE_KEYFILE, key=key, delete_originals=True)
+            assert results['success'] == inputs, f"{durability}: {results['failed']}"
+            assert not any(os.path.exists(path) for path in inputs), f"{durability}: inputs not deleted"
+            assert journal.states(JobJournal.batch_id('encrypt', inputs)) == {}, "Batch not completed"
+            journal.close()
+
+            locked = [path + '.locked' for path in inputs]
+            results = BatchProcessor(durability=durability).batch_decrypt(locked, key=key, delete_encrypted=True)
+            assert results['success'] == locked, f"{durability}: {results['failed']}"
+            assert not any(os.path.exists(path) for path in locked), f"{durability}: encrypted files not deleted"
+            for i, path in enumerate(files):
+                with open(path, 'r') as f:
+                    assert f.read() == f"{durability} file {i}"
+            with open(os.path.join(folder, 'sub', 'inner.txt'), 'r') as f:
+                assert f.read() == "Inner file"
+            assert not temp_files(), f"{durability}: temporary files left behind"
+        print("✓ File, batch and no-sync policies round-trip")
+
+        # Without syncing, an output is only committed when its input is deleted
+        class RecordingJournal(JobJournal):
+            def set_state(self, batch, path, state, *args, **kwargs):
+                recorded.append((os.path.basename(path), state))
+                return super().set_state(batch, path, state, *args, **kwargs)
+
+        for delete_originals in (False, True):
+            recorded = []
+            unsynced = os.path.join(temp_dir, f'unsynced{delete_originals}.txt')
+            with open(unsynced, 'w') as f:
+                f.write("Unsynced")
+            BatchProcessor(durability=DURABILITY_NONE, journal=RecordingJournal(':memory:')).batch_encrypt(
+                [unsynced], MODE_KEYFILE, key=key, delete_originals=delete_originals)
+            states = [state for _, state in recorded]
+            if delete_originals:
+                assert states == [JOB_WRITING, JOB_COMMITTED, JOB_ORIGINAL_DELETED], states
+                assert not os.path.exists(unsynced)
+            else:
+                assert states == [JOB_WRITING], states
+                os.remove(unsynced)
+            os.remove(unsynced + '.locked')
+        print("✓ No-sync policy commits only outputs it synced")
+
+        # A failed job under group commit keeps its input
+        missing = os.path.join(temp_dir, 'missing.txt')
+        results = BatchProcessor(durability=DURABILITY_BATCH).batch_encrypt(
+            [source, missing], MODE_KEYFILE, key=key, delete_originals=True)
+        assert results['success'] == [source] and [path for path, _ in results['failed']] == [missing]
+        assert not os.path.exists(source) and os.path.exists(source + '.locked')
+        print("✓ Group commit deletes only committed inputs")
+
+        # A crash mid-batch keeps the groups committed so far, and their inputs are already deleted
+        crash_dir = os.path.join(temp_dir, 'crash')
+        os.makedirs(crash_dir)
+        files = []
+        for i in range(30):
+            path = os.path.join(crash_dir, f'crash{i:02d}.txt')
+            with open(path, 'w') as f:
+                f.write(f"Crash file {i}")
+            files.append(path)
+        journal_path = os.path.join(temp_dir, 'crash.sqlite3')
+        script = (
+            "import os, sys, time, json\n"
+            "from file_manager import BatchProcessor\n"
+            "from job_journal import JobJournal\n"
+            "from config import *\n"
+            "files, key, journal = json.loads(sys.argv[1])\n"
+            "def progress(current, total, message):\n"
+            "    if current == 10:\n"
+            "        time.sleep(GROUP_COMMIT_INTERVAL + 0.1)\n"
+            "    if current == 20:\n"
+            "        os._exit(3)\n"
+            "BatchProcessor(progress_callback=progress, journal=JobJournal(journal), durability=DURABILITY_BATCH)"
+            ".batch_encrypt(files, MODE_KEYFILE, key=key, delete_originals=True)\n"
+        )
+        crashed = subprocess.run(
+            [sys.executable, '-c', script, json.dumps([files, key.decode(), journal_path])],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+        )
+        assert crashed.returncode == 3, crashed.stderr
+        assert not any(os.path.exists(path) for path in files[:11]), "Committed group's inputs not deleted"
+        assert all(os.path.exists(path) for path in files[11:]), "Uncommitted inputs were deleted"
+        journal = JobJournal(journal_path)
+        results = BatchProcessor(journal=journal).batch_encrypt(files, MODE_KEYFILE, key=key, delete_originals=True)
+        journal.close()
+        assert results['success'] == files, f"Failed: {results['failed']}"
+        assert results['resumed'] == files[:11], f"Resumed {results['resumed']}"
+        print("✓ Groups committed before a crash are resumed")
+
+        shutil.rmtree(temp_dir)
+
+        print("✓ Atomic writes test PASSED\n")
+        return True
+
+    except Exception as e:
+        print(f"✗ Atomic writes test FAILED: {e}\n")
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        return False
+
+
 def main():
     """Run all tests."""
     print("="*60)
@@ -264,7 +1929,30 @@ def main():
         test_password_encryption,
         test_keyfile_encryption,
         test_folder_encryption,
-        test_file_search
+        test_file_search,
+        test_chunked_encryption,
+        test_aead_ciphers,
+        test_key_cache,
+        test_session_key_batch,
+        test_parallel_batch,
+        test_streaming_folder_batch,
+        test_compression_codecs,
+        test_parallel_chunk_pipeline,
+        test_mapped_io,
+        test_header_inspection,
+        test_file_index,
+        test_tree_walker,
+        test_cli,
+        test_stream_encryption,
+        test_random_access,
+        test_folder_archive,
+        test_incremental_archive,
+        test_chunk_store,
+        test_benchmark,
+        test_metrics,
+        test_byte_progress,
+        test_job_journal,
+        test_atomic_writes
     ]
 
     results = []
@@ -279,6 +1967,5 @@ def main():
 
 
 if __name__ == '__main__':
-    import sys
     success = main()
     sys.exit(0 if success else 1)
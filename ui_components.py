@@ -4,37 +4,32 @@ Reusable UI components for the application.
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
+import itertools
 import os
+import threading
 from config import *
+from progress import format_eta, format_rate
 
 
 class FileListFrame(ttk.Frame):
-    """Frame displaying a list of files with checkboxes."""
+    """
+    Frame displaying a list of files with checkboxes.
+
+    The list is virtualized: only the rows currently in view exist as canvas
+    items, and selection is one byte per row, so it stays responsive with
+    millions of entries.
+    """
 
     def __init__(self, parent, **kwargs):
         super().__init__(parent, **kwargs)
         self.files = []
-        self.checkboxes = {}
-
-        # Create scrollable frame
-        self.canvas = tk.Canvas(self, bg='white')
-        self.scrollbar = ttk.Scrollbar(self, orient='vertical', command=self.canvas.yview)
-        self.scrollable_frame = ttk.Frame(self.canvas)
-
-        self.scrollable_frame.bind(
-            '<Configure>',
-            lambda e: self.canvas.configure(scrollregion=self.canvas.bbox('all'))
-        )
-
-        self.canvas.create_window((0, 0), window=self.scrollable_frame, anchor='nw')
-        self.canvas.configure(yscrollcommand=self.scrollbar.set)
-
-        # Pack elements
-        self.canvas.pack(side='left', fill='both', expand=True)
-        self.scrollbar.pack(side='right', fill='y')
+        self._rows = {}              # filepath -> row number
+        self._selected = bytearray()  # 1 byte per row, 1 = selected
+        self._top = 0                # first visible row
+        self._row_items = []         # reusable canvas items, one tuple per visible row
 
         # Header
-        self.header_frame = ttk.Frame(self.scrollable_frame)
+        self.header_frame = ttk.Frame(self)
         self.header_frame.pack(fill='x', padx=5, pady=5)
 
         self.select_all_var = tk.BooleanVar(value=True)
@@ -50,62 +45,136 @@ class FileListFrame(ttk.Frame):
         self.count_label = ttk.Label(self.header_frame, text='0 files')
         self.count_label.pack(side='right')
 
+        # Rows are drawn on a canvas; the scrollbar drives _top directly
+        body = ttk.Frame(self)
+        body.pack(fill='both', expand=True)
+
+        self.canvas = tk.Canvas(body, bg='white', highlightthickness=0)
+        self.scrollbar = ttk.Scrollbar(body, orient='vertical', command=self._on_scrollbar)
+
+        self.canvas.pack(side='left', fill='both', expand=True)
+        self.scrollbar.pack(side='right', fill='y')
+
+        self.canvas.bind('<Configure>', lambda e: self._render())
+        self.canvas.bind('<Button-1>', self._on_click)
+        self.canvas.bind('<MouseWheel>', self._on_mousewheel)
+        self.canvas.bind('<Button-4>', lambda e: self._scroll_to(self._top - 3))
+        self.canvas.bind('<Button-5>', lambda e: self._scroll_to(self._top + 3))
+
     def add_file(self, filepath):
         """Add a file to the list."""
-        if filepath not in self.files:
-            self.files.append(filepath)
-            self._create_checkbox(filepath)
-            self._update_count()
+        self.add_files([filepath])
 
     def add_files(self, filepaths):
         """Add multiple files to the list."""
+        added = 0
         for filepath in filepaths:
-            self.add_file(filepath)
+            if filepath not in self._rows:
+                self._rows[filepath] = len(self.files)
+                self.files.append(filepath)
+                added += 1
+
+        if added:
+            self._selected.extend(b'\x01' * added)
+            self._update_count()
+            self._render()
 
     def clear(self):
         """Clear all files from the list."""
         self.files = []
-        self.checkboxes = {}
-        for widget in self.scrollable_frame.winfo_children():
-            if widget != self.header_frame:
-                widget.destroy()
+        self._rows = {}
+        self._selected = bytearray()
+        self._top = 0
         self._update_count()
+        self._render()
 
-    def _create_checkbox(self, filepath):
-        """Create checkbox for a file."""
-        var = tk.BooleanVar(value=True)
-        frame = ttk.Frame(self.scrollable_frame)
-        frame.pack(fill='x', padx=5, pady=2)
-
-        cb = ttk.Checkbutton(frame, variable=var)
-        cb.pack(side='left')
-
-        # File name label
-        filename = os.path.basename(filepath)
-        label = ttk.Label(frame, text=filename, cursor='hand2')
-        label.pack(side='left', padx=5)
+    def is_selected(self, filepath):
+        """Whether filepath is in the list and checked."""
+        row = self._rows.get(filepath)
+        return row is not None and bool(self._selected[row])
 
-        # Path label (smaller, gray)
-        path_label = ttk.Label(frame, text=filepath, foreground='gray', font=('TkDefaultFont', 8))
-        path_label.pack(side='left', padx=5)
-
-        self.checkboxes[filepath] = var
+    def set_selected(self, filepath, selected):
+        """Check or uncheck one file."""
+        row = self._rows.get(filepath)
+        if row is not None:
+            self._selected[row] = 1 if selected else 0
+            self._render()
 
     def toggle_all(self):
         """Toggle all checkboxes."""
-        state = self.select_all_var.get()
-        for var in self.checkboxes.values():
-            var.set(state)
+        state = b'\x01' if self.select_all_var.get() else b'\x00'
+        self._selected = bytearray(state * len(self.files))
+        self._render()
 
     def get_selected_files(self):
         """Get list of selected files."""
-        return [filepath for filepath, var in self.checkboxes.items() if var.get()]
+        return list(itertools.compress(self.files, self._selected))
 
     def _update_count(self):
         """Update file count label."""
         count = len(self.files)
         self.count_label.config(text=f"{count} file{'s' if count != 1 else ''}")
 
+    def _visible_rows(self):
+        return max(1, self.canvas.winfo_height() // FILE_LIST_ROW_HEIGHT)
+
+    def _scroll_to(self, top):
+        """Make row top the first visible row (clamped)."""
+        top = max(0, min(int(top), len(self.files) - self._visible_rows()))
+        if top != self._top:
+            self._top = top
+            self._render()
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self._scroll_to(float(amount) * len(self.files))
+        elif action == 'scroll':
+            step = self._visible_rows() if unit == 'pages' else 1
+            self._scroll_to(self._top + int(amount) * step)
+
+    def _on_mousewheel(self, event):
+        # Windows reports multiples of 120, macOS small raw deltas
+        steps = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        self._scroll_to(self._top - steps * 3)
+
+    def _on_click(self, event):
+        row = self._top + int(event.y // FILE_LIST_ROW_HEIGHT)
+        if row < len(self.files):
+            self._selected[row] ^= 1
+            self._render()
+
+    def _render(self):
+        """Draw the visible window of rows, reusing canvas items."""
+        visible = self._visible_rows()
+        # A row may be partly visible at the bottom
+        while len(self._row_items) < visible + 1:
+            y = len(self._row_items) * FILE_LIST_ROW_HEIGHT + FILE_LIST_ROW_HEIGHT // 2
+            self._row_items.append((
+                self.canvas.create_rectangle(8, y - 6, 20, y + 6, outline='gray'),
+                self.canvas.create_text(14, y, text='\u2713'),
+                self.canvas.create_text(30, y, anchor='w'),
+                self.canvas.create_text(30 + FILE_LIST_NAME_WIDTH, y, anchor='w', fill='gray',
+                                        font=('TkDefaultFont', 8))
+            ))
+
+        for i, (box, tick, name, path) in enumerate(self._row_items):
+            row = self._top + i
+            if row < len(self.files):
+                filepath = self.files[row]
+                self.canvas.itemconfigure(box, state='normal')
+                self.canvas.itemconfigure(tick, state='normal' if self._selected[row] else 'hidden')
+                self.canvas.itemconfigure(name, state='normal', text=os.path.basename(filepath))
+                self.canvas.itemconfigure(path, state='normal', text=filepath)
+            else:
+                for item in (box, tick, name, path):
+                    self.canvas.itemconfigure(item, state='hidden')
+
+        total = len(self.files)
+        if total:
+            self.scrollbar.set(self._top / total, min(1.0, (self._top + visible) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
 
 class PasswordEntryFrame(ttk.Frame):
     """Frame for password entry with visibility toggle."""
@@ -150,10 +219,17 @@ class PasswordEntryFrame(ttk.Frame):
 
 
 class ProgressFrame(ttk.Frame):
-    """Frame with progress bar and status label."""
+    """
+    Frame with progress bar and status label.
+
+    Worker threads call post_progress, which keeps only the latest values
+    and has at most one redraw queued on the Tk event loop at a time.
+    """
 
     def __init__(self, parent, **kwargs):
         super().__init__(parent, **kwargs)
+        self._pending = None
+        self._pending_lock = threading.Lock()
 
         # Status label
         self.status_var = tk.StringVar(value='Ready')
@@ -164,19 +240,38 @@ class ProgressFrame(ttk.Frame):
         self.progress = ttk.Progressbar(self, mode='determinate')
         self.progress.pack(fill='x')
 
-    def update_progress(self, current, total, message=''):
-        """Update progress bar and status."""
+    def update_progress(self, current, total, message='', rate=None, eta=None):
+        """Update progress bar and status; rate (bytes/s) and eta (seconds) are shown if known."""
         if total > 0:
             percentage = (current / total) * 100
             self.progress['value'] = percentage
 
+        details = [text for text in (format_rate(rate), format_eta(eta) and f"{format_eta(eta)} left") if text]
+        if message and details:
+            message = f"{message}  ({', '.join(details)})"
         if message:
             self.status_var.set(message)
 
         self.update_idletasks()
 
+    def post_progress(self, current, total, message='', rate=None, eta=None):
+        """update_progress from any thread; updates arriving before the redraw replace each other."""
+        with self._pending_lock:
+            schedule = self._pending is None
+            self._pending = (current, total, message, rate, eta)
+        if schedule:
+            self.after(0, self._apply_pending)
+
+    def _apply_pending(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, None
+        if pending is not None:
+            self.update_progress(*pending)
+
     def reset(self):
         """Reset progress to 0."""
+        with self._pending_lock:
+            self._pending = None
         self.progress['value'] = 0
         self.status_var.set('Ready')
 
@@ -188,9 +283,10 @@ class ProgressFrame(ttk.Frame):
 class SearchFrame(ttk.LabelFrame):
     """Frame for file search functionality."""
 
-    def __init__(self, parent, search_callback=None, **kwargs):
+    def __init__(self, parent, search_callback=None, cancel_callback=None, **kwargs):
         super().__init__(parent, text='Search Files', **kwargs)
         self.search_callback = search_callback
+        self.cancel_callback = cancel_callback
 
         # Directory selection
         dir_frame = ttk.Frame(self)
@@ -220,8 +316,18 @@ class SearchFrame(ttk.LabelFrame):
         self.locked_only_var = tk.BooleanVar(value=False)
         ttk.Checkbutton(options_frame, text='Only .locked files', variable=self.locked_only_var).pack(side='left', padx=5)
 
-        # Search button
-        ttk.Button(self, text='Search', command=self.do_search).pack(pady=5)
+        # Search/cancel buttons and live status
+        button_frame = ttk.Frame(self)
+        button_frame.pack(fill='x', padx=5, pady=5)
+
+        self.search_button = ttk.Button(button_frame, text='Search', command=self.do_search)
+        self.search_button.pack(side='left')
+
+        self.cancel_button = ttk.Button(button_frame, text='Cancel', command=self.do_cancel, state='disabled')
+        self.cancel_button.pack(side='left', padx=5)
+
+        self.status_var = tk.StringVar(value='')
+        ttk.Label(button_frame, textvariable=self.status_var, foreground='gray').pack(side='left', padx=5)
 
     def browse_directory(self):
         """Open directory browser."""
@@ -239,6 +345,22 @@ class SearchFrame(ttk.LabelFrame):
                 self.locked_only_var.get()
             )
 
+    def do_cancel(self):
+        """Cancel the running search."""
+        if self.cancel_callback:
+            self.cancel_callback()
+
+    def set_searching(self, searching):
+        """Switch the buttons between idle and searching states."""
+        self.search_button.config(state='disabled' if searching else 'normal')
+        self.cancel_button.config(state='normal' if searching else 'disabled')
+
+    def set_status(self, found, elapsed, finished=False, cancelled=False):
+        """Show the live result count and scan rate."""
+        rate = found / elapsed if elapsed > 0 else 0.0
+        state = ' (cancelled)' if cancelled else '' if finished else '...'
+        self.status_var.set(f"{found} file{'s' if found != 1 else ''} found, {rate:,.0f} files/s{state}")
+
     def get_search_params(self):
         """Get current search parameters."""
         return {